@@ -0,0 +1,35 @@
+"""faces embedding hnsw index
+
+Revision ID: b41d7e2c9a10
+Revises: 5e69dc97a227
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41d7e2c9a10'
+down_revision: Union[str, Sequence[str], None] = '5e69dc97a227'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY can't run inside a transaction block; keeps faces writable while it builds
+    with op.get_context().autocommit_block():
+        op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_faces_embedding_hnsw "
+            "ON faces USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_faces_embedding_hnsw")
@@ -0,0 +1,49 @@
+"""person clusters
+
+Revision ID: c7e3a5f19d42
+Revises: b41d7e2c9a10
+Create Date: 2026-10-18 11:03:27.118904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from pgvector.sqlalchemy import Vector
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e3a5f19d42'
+down_revision: Union[str, Sequence[str], None] = 'b41d7e2c9a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'person_clusters',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('project_id', postgresql.UUID(as_uuid=False), nullable=False),
+        sa.Column('centroid', Vector(512), nullable=True),
+        sa.Column('face_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('image_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('cover_face_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_person_clusters_project_id'), 'person_clusters', ['project_id'], unique=False)
+    op.add_column('faces', sa.Column('cluster_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_faces_cluster_id'), 'faces', ['cluster_id'], unique=False)
+    op.create_foreign_key('fk_faces_cluster_id', 'faces', 'person_clusters', ['cluster_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('fk_faces_cluster_id', 'faces', type_='foreignkey')
+    op.drop_index(op.f('ix_faces_cluster_id'), table_name='faces')
+    op.drop_column('faces', 'cluster_id')
+    op.drop_index(op.f('ix_person_clusters_project_id'), table_name='person_clusters')
+    op.drop_table('person_clusters')
@@ -0,0 +1,38 @@
+"""faces compact embeddings
+
+Revision ID: d2f8b61e4a07
+Revises: c7e3a5f19d42
+Create Date: 2026-10-18 14:03:27.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import HALFVEC, BIT
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f8b61e4a07'
+down_revision: Union[str, Sequence[str], None] = 'c7e3a5f19d42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # columns only; existing rows are backfilled in batches and indexed concurrently
+    # with `python manage_index.py compact` so the migration doesn't hold a long lock.
+    # halfvec and bit need pgvector >= 0.7; pick up a newer extension the server already ships
+    op.execute("ALTER EXTENSION vector UPDATE")
+    op.add_column('faces', sa.Column('embedding_half', HALFVEC(512), nullable=True))
+    op.add_column('faces', sa.Column('embedding_bits', BIT(512), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_faces_embedding_half_hnsw")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_faces_embedding_bits_hnsw")
+    op.drop_column('faces', 'embedding_bits')
+    op.drop_column('faces', 'embedding_half')
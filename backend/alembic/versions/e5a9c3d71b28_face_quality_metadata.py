@@ -0,0 +1,37 @@
+"""face quality metadata
+
+Revision ID: e5a9c3d71b28
+Revises: d2f8b61e4a07
+Create Date: 2026-10-18 15:21:08.640217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a9c3d71b28'
+down_revision: Union[str, Sequence[str], None] = 'd2f8b61e4a07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('faces', sa.Column('face_index', sa.Integer(), nullable=True))
+    op.add_column('faces', sa.Column('bbox', postgresql.ARRAY(sa.Integer()), nullable=True))
+    op.add_column('faces', sa.Column('det_score', sa.Float(), nullable=True))
+    op.add_column('faces', sa.Column('face_size', sa.Integer(), nullable=True))
+    op.add_column('faces', sa.Column('yaw', sa.Float(), nullable=True))
+    op.add_column('faces', sa.Column('pitch', sa.Float(), nullable=True))
+    op.add_column('faces', sa.Column('roll', sa.Float(), nullable=True))
+    op.add_column('faces', sa.Column('sharpness', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for column in ('sharpness', 'roll', 'pitch', 'yaw', 'face_size', 'det_score', 'bbox', 'face_index'):
+        op.drop_column('faces', column)
@@ -0,0 +1,144 @@
+# recall vs latency of the ANN index on a scratch copy of the faces table
+# usage: python -m benchmarks.bench_ann [rows ...] [--method hnsw|ivfflat] [--queries 200] [--k 50] [--projects 50]
+# defaults to 100k and 1M rows of synthetic identity-clustered 512-d embeddings; the filtered pass
+# restricts every query to one of --projects equal slices, like a project-scoped selfie search
+import argparse
+import io
+import time
+import numpy as np
+from sqlalchemy import text
+from models import engine
+
+TABLE = "faces_ann_bench"
+
+
+def synthetic_embeddings(rows: int, dim: int = 512, faces_per_identity: int = 20, seed: int = 0) -> np.ndarray:
+    "clusters of noisy copies around random identity centres, closer to real face data than uniform noise"
+    rng = np.random.default_rng(seed)
+    identities = max(1, rows // faces_per_identity)
+    centres = rng.standard_normal((identities, dim)).astype(np.float32)
+    labels = rng.integers(0, identities, rows)
+    vectors = centres[labels] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_table(vectors: np.ndarray, projects: int = 50):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        conn.execute(text(f"CREATE TABLE {TABLE} (id bigserial PRIMARY KEY, project int, embedding vector({vectors.shape[1]}))"))
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        for start in range(0, len(vectors), 50_000):
+            buf = io.StringIO()
+            for v in vectors[start:start + 50_000]:
+                buf.write("[" + ",".join(f"{x:.6f}" for x in v) + "]\n")
+            buf.seek(0)
+            cur.copy_expert(f"COPY {TABLE} (embedding) FROM STDIN", buf)
+        raw.commit()
+        cur.execute(f"UPDATE {TABLE} SET project = id % {int(projects)}")
+        cur.execute(f"CREATE INDEX ON {TABLE} (project)")
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def build_index(method: str, rows: int) -> float:
+    started = time.perf_counter()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SET maintenance_work_mem = '2GB'"))
+        if method == "hnsw":
+            conn.execute(text(f"CREATE INDEX ON {TABLE} USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"))
+        else:
+            lists = max(10, rows // 1000) if rows <= 1_000_000 else int(rows ** 0.5)
+            conn.execute(text(f"CREATE INDEX ON {TABLE} USING ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})"))
+        conn.execute(text(f"ANALYZE {TABLE}"))
+    return time.perf_counter() - started
+
+
+def top_k(conn, query: np.ndarray, k: int, project: int = None) -> tuple:
+    vec = "[" + ",".join(f"{x:.6f}" for x in query) + "]"
+    where = "WHERE project = :project" if project is not None else ""
+    started = time.perf_counter()
+    ids = conn.execute(
+        text(f"SELECT id FROM {TABLE} {where} ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k"),
+        {"q": vec, "k": k, "project": project},
+    ).scalars().all()
+    return set(ids), (time.perf_counter() - started) * 1000
+
+
+def run_filtered(query_set: np.ndarray, method: str, k: int, projects: int):
+    "recall/latency when every query keeps only one project's rows, per iterative_scan mode"
+    targets = [i % projects for i in range(len(query_set))]
+    with engine.connect() as conn:
+        conn.execute(text("SET enable_indexscan = off"))
+        exact = [top_k(conn, q, k, p) for q, p in zip(query_set, targets)]
+        conn.rollback()
+    ms = np.percentile([ms for _, ms in exact], [50, 99])
+    print(f"filtered to 1/{projects}, exact scan: p50={ms[0]:.1f}ms p99={ms[1]:.1f}ms")
+
+    prefix = "hnsw" if method == "hnsw" else "ivfflat"
+    # "off" mirrors vector_index.set_search_params without iterative scan: widest ef_search instead
+    modes = [("off", "hnsw.ef_search = 1000" if method == "hnsw" else "ivfflat.probes = 50"), ("relaxed_order", None)]
+    if method == "hnsw":
+        modes.append(("strict_order", None))
+    for mode, extra in modes:
+        with engine.connect() as conn:
+            conn.execute(text(f"SET {prefix}.iterative_scan = {mode}"))
+            if extra:
+                conn.execute(text(f"SET {extra}"))
+            approx = [top_k(conn, q, k, p) for q, p in zip(query_set, targets)]
+            conn.rollback()
+        recall = np.mean([len(a & e) / max(1, len(e)) for (a, _), (e, _) in zip(approx, exact)])
+        short = sum(len(a) < len(e) for (a, _), (e, _) in zip(approx, exact))
+        ms = np.percentile([ms for _, ms in approx], [50, 99])
+        print(f"  iterative_scan={mode:<13} recall@{k}={recall:.3f} p50={ms[0]:.1f}ms p99={ms[1]:.1f}ms short={short}")
+
+
+def run(rows: int, method: str, queries: int, k: int, projects: int):
+    vectors = synthetic_embeddings(rows)
+    load_table(vectors, projects)
+    rng = np.random.default_rng(1)
+    picks = vectors[rng.integers(0, rows, queries)]
+    query_set = picks + 0.3 * rng.standard_normal(picks.shape).astype(np.float32)
+
+    with engine.connect() as conn:
+        conn.execute(text("SET enable_indexscan = off"))
+        exact = [top_k(conn, q, k) for q in query_set]
+        conn.rollback()
+    exact_ms = np.percentile([ms for _, ms in exact], [50, 99])
+    print(f"\n{rows} rows, exact scan: p50={exact_ms[0]:.1f}ms p99={exact_ms[1]:.1f}ms")
+
+    build_s = build_index(method, rows)
+    print(f"{method} build: {build_s:.1f}s")
+
+    knob, values = ("hnsw.ef_search", (20, 40, 80, 160, 320)) if method == "hnsw" else ("ivfflat.probes", (1, 5, 10, 20, 50))
+    for value in values:
+        with engine.connect() as conn:
+            conn.execute(text(f"SET {knob} = {value}"))
+            approx = [top_k(conn, q, k) for q in query_set]
+            conn.rollback()
+        recall = np.mean([len(a & e) / max(1, len(e)) for (a, _), (e, _) in zip(approx, exact)])
+        ms = np.percentile([ms for _, ms in approx], [50, 99])
+        print(f"  {knob}={value:<4} recall@{k}={recall:.3f} p50={ms[0]:.1f}ms p99={ms[1]:.1f}ms")
+
+    run_filtered(query_set, method, k, projects)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", nargs="*", type=int, default=[100_000, 1_000_000])
+    parser.add_argument("--method", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--projects", type=int, default=50)
+    args = parser.parse_args()
+    for rows in args.rows:
+        run(rows, args.method, args.queries, args.k, args.projects)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# compare per-image fa.get() against the batched engine on a local folder of photos
+# usage: python -m benchmarks.bench_inference /path/to/event [batch_size]
+# "groups of 1" is what tasks.process_image gets; batch_size is what a dispatched chunk gets
+import os
+import sys
+import time
+import cv2
+from insightface.app import FaceAnalysis
+from inference import FaceBatchEngine
+
+EXTS = (".jpg", ".jpeg", ".png")
+
+
+def load_images(folder: str) -> list:
+    names = sorted(n for n in os.listdir(folder) if n.lower().endswith(EXTS))
+    return [cv2.imread(os.path.join(folder, n), cv2.IMREAD_COLOR) for n in names]
+
+
+def main():
+    folder = sys.argv[1]
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    fa = FaceAnalysis(allowed_modules=["detection", "recognition"], providers=["CPUExecutionProvider"])
+    fa.prepare(ctx_id=-1, det_size=(640, 640))
+    engine = FaceBatchEngine(fa)
+
+    images = load_images(folder)
+    print(f"Loaded {len(images)} images from {folder}")
+
+    started = time.perf_counter()
+    single_faces = 0
+    for img in images:
+        single_faces += len(fa.get(img))
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched_faces = 0
+    for start in range(0, len(images), batch_size):
+        for faces in engine.run(images[start:start + batch_size]):
+            batched_faces += len(faces)
+    batched = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for img in images:
+        engine.run([img])
+    singles = time.perf_counter() - started
+
+    print(f"fa.get per image : {len(images) / single:.2f} images/sec ({single_faces} faces)")
+    print(f"engine, groups of 1 : {len(images) / singles:.2f} images/sec")
+    print(f"batched (n={batch_size}) : {len(images) / batched:.2f} images/sec ({batched_faces} faces)")
+
+
+if __name__ == "__main__":
+    main()
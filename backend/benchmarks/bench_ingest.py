@@ -0,0 +1,96 @@
+# face ingestion rows/sec: ORM bulk_save_objects vs multi-row INSERT vs binary COPY
+# usage: python -m benchmarks.bench_ingest [rows ...] [--batch 500] [--storage vector|dual|halfvec]
+# writes synthetic faces into a scratch copy of the faces table (in its own schema,
+# without foreign keys) in batches the size of a worker's write group
+import argparse
+import time
+import uuid
+import numpy as np
+from sqlalchemy import text, insert
+from sqlalchemy.orm import Session
+import vector_index
+from models import engine, Face
+from db import _face_row
+from pg_copy import copy_faces
+from benchmarks.bench_ann import synthetic_embeddings
+
+SCHEMA = "ingest_bench"
+
+
+def create_table():
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        # LIKE copies columns but not the id default, which would share public.faces' sequence
+        conn.execute(text(f"CREATE TABLE {SCHEMA}.faces (LIKE public.faces)"))
+        conn.execute(text(f"ALTER TABLE {SCHEMA}.faces DROP COLUMN id, ADD COLUMN id bigserial PRIMARY KEY"))
+
+
+def synthetic_rows(rows: int, faces_per_image: int = 4) -> list:
+    rng = np.random.default_rng(2)
+    vectors = synthetic_embeddings(rows)
+    image_ids = [str(uuid.uuid4()) for _ in range(rows // faces_per_image + 1)]
+    return [
+        _face_row(image_ids[i // faces_per_image], {
+            "face_index": i % faces_per_image,
+            "bbox": [int(v) for v in rng.integers(0, 4000, 4)],
+            "det_score": float(rng.uniform(0.6, 1.0)),
+            "face_size": int(rng.integers(32, 600)),
+            "yaw": float(rng.uniform(-60, 60)),
+            "pitch": float(rng.uniform(-40, 40)),
+            "roll": float(rng.uniform(-30, 30)),
+            "sharpness": float(rng.uniform(15, 400)),
+            "embedding": vectors[i].tolist(),
+        })
+        for i in range(rows)
+    ]
+
+
+def write_orm(conn, batch: list):
+    with Session(bind=conn) as session:
+        session.bulk_save_objects([Face(**row) for row in batch])
+        session.commit()
+
+
+def write_insert(conn, batch: list):
+    conn.execute(insert(Face), batch)
+    conn.commit()
+
+
+def write_copy(conn, batch: list):
+    copy_faces(conn.connection, batch, f"{SCHEMA}.faces")
+    conn.commit()
+
+
+def run(rows: int, batch_size: int):
+    data = synthetic_rows(rows)
+    print(f"\n{rows} faces, {batch_size} per transaction, storage={vector_index.EMBEDDING_STORAGE}")
+    for label, write in (("orm bulk_save_objects", write_orm), ("multi-row insert", write_insert), ("binary copy", write_copy)):
+        create_table()
+        with engine.connect().execution_options(schema_translate_map={None: SCHEMA}) as conn:
+            started = time.perf_counter()
+            for start in range(0, rows, batch_size):
+                write(conn, data[start:start + batch_size])
+            elapsed = time.perf_counter() - started
+            written = conn.execute(text(f"SELECT count(*) FROM {SCHEMA}.faces")).scalar()
+        print(f"  {label:<24} {written / elapsed:>10.0f} rows/sec ({elapsed:.2f}s)")
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", nargs="*", type=int, default=[20_000, 200_000])
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--storage", choices=["vector", "dual", "halfvec"], default=None)
+    args = parser.parse_args()
+    if args.storage:
+        # _face_row reads the storage mode at call time
+        vector_index.EMBEDDING_STORAGE = args.storage
+    for rows in args.rows:
+        run(rows, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# paged selfie search on a faces table shared by many projects
+# usage: python -m benchmarks.bench_paging [--faces 200000] [--projects 50] [--queries 20] [--limit 20] [--pages 3] [--dense 500]
+# runs helpers.search_similar_images against a scratch copy of images/faces (own schema, HNSW index)
+# and checks that a project's later pages are not empty while it still has matches under the threshold;
+# the dense pass pages all the way through one person photographed --dense times (every face of those
+# images close together) and checks no page comes back short before the last and no match is missed
+import argparse
+import io
+import time
+import uuid
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from models import engine
+from helpers import search_similar_images
+from benchmarks.bench_ann import synthetic_embeddings
+
+SCHEMA = "paging_bench"
+FACES_PER_IMAGE = 4
+
+
+def load(faces: int, projects: int, dense: int) -> tuple:
+    "returns (vectors, project id of every face, project ids, centre of the dense cluster)"
+    vectors = synthetic_embeddings(faces)
+    rng = np.random.default_rng(4)
+    centre = rng.standard_normal(vectors.shape[1]).astype(np.float32)
+    centre /= np.linalg.norm(centre)
+    crowd = centre + 0.02 * rng.standard_normal((dense * FACES_PER_IMAGE, vectors.shape[1])).astype(np.float32)
+    crowd /= np.linalg.norm(crowd, axis=1, keepdims=True)
+    project_ids = [str(uuid.uuid4()) for _ in range(projects)]
+    image_ids = [str(uuid.uuid4()) for _ in range(faces // FACES_PER_IMAGE + 1)]
+    image_project = [project_ids[i % projects] for i in range(len(image_ids))]
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        conn.execute(text(f"CREATE TABLE {SCHEMA}.images (LIKE public.images INCLUDING DEFAULTS)"))
+        conn.execute(text(f"CREATE TABLE {SCHEMA}.faces (LIKE public.faces)"))
+        conn.execute(text(f"ALTER TABLE {SCHEMA}.faces DROP COLUMN id, ADD COLUMN id bigserial PRIMARY KEY"))
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        buf = io.StringIO()
+        for image_id, project_id in zip(image_ids, image_project):
+            buf.write(f"{image_id}\t{project_id}\t{image_id}\tt\n")
+        buf.seek(0)
+        cur.copy_expert(f"COPY {SCHEMA}.images (id, project_id, drive_file_id, processed) FROM STDIN", buf)
+        for start in range(0, faces, 50_000):
+            buf = io.StringIO()
+            for i in range(start, min(faces, start + 50_000)):
+                vec = "[" + ",".join(f"{x:.6f}" for x in vectors[i]) + "]"
+                buf.write(f"{image_ids[i // FACES_PER_IMAGE]}\t{vec}\n")
+            buf.seek(0)
+            cur.copy_expert(f"COPY {SCHEMA}.faces (image_id, embedding) FROM STDIN", buf)
+        # the dense cluster's images all belong to the searched project
+        crowd_images = [str(uuid.uuid4()) for _ in range(dense)]
+        buf = io.StringIO()
+        for image_id in crowd_images:
+            buf.write(f"{image_id}\t{project_ids[0]}\t{image_id}\tt\n")
+        buf.seek(0)
+        cur.copy_expert(f"COPY {SCHEMA}.images (id, project_id, drive_file_id, processed) FROM STDIN", buf)
+        buf = io.StringIO()
+        for i, v in enumerate(crowd):
+            vec = "[" + ",".join(f"{x:.6f}" for x in v) + "]"
+            buf.write(f"{crowd_images[i // FACES_PER_IMAGE]}\t{vec}\n")
+        buf.seek(0)
+        cur.copy_expert(f"COPY {SCHEMA}.faces (image_id, embedding) FROM STDIN", buf)
+        raw.commit()
+    finally:
+        raw.close()
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SET maintenance_work_mem = '2GB'"))
+        conn.execute(text(f"CREATE INDEX ON {SCHEMA}.faces (image_id)"))
+        conn.execute(text(f"CREATE INDEX ON {SCHEMA}.images (project_id)"))
+        conn.execute(text(f"CREATE INDEX ON {SCHEMA}.faces USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"))
+        conn.execute(text(f"ANALYZE {SCHEMA}.faces"))
+        conn.execute(text(f"ANALYZE {SCHEMA}.images"))
+    face_project = [image_project[i // FACES_PER_IMAGE] for i in range(faces)]
+    return vectors, face_project, project_ids, centre
+
+
+def page_through_dense(centre: np.ndarray, project_id: str, limit: int, threshold: float) -> int:
+    "pages a query at the dense cluster's centre to the end; returns the number of problems found"
+    vec = "[" + ",".join(f"{x:.6f}" for x in centre) + "]"
+    with engine.connect().execution_options(schema_translate_map={None: SCHEMA}) as conn:
+        conn.execute(text("SET enable_indexscan = off"))
+        expected = conn.execute(text(
+            f"SELECT count(DISTINCT f.image_id) FROM {SCHEMA}.faces f JOIN {SCHEMA}.images i ON i.id = f.image_id "
+            f"WHERE i.project_id = :p AND f.embedding <=> CAST(:q AS vector) <= :t"
+        ), {"p": project_id, "q": vec, "t": threshold}).scalar()
+        conn.rollback()
+
+    seen, pages, short_pages, after = set(), 0, 0, None
+    while True:
+        with engine.connect().execution_options(schema_translate_map={None: SCHEMA}) as conn:
+            with Session(bind=conn) as db:
+                result = search_similar_images(db, centre, threshold=threshold, limit=limit, project_id=project_id, after=after)
+                db.rollback()
+        pages += 1
+        seen.update(item["image"]["id"] for item in result["images"])
+        after = result["next_after"]
+        if after is None:
+            break
+        if len(result["images"]) < limit:
+            short_pages += 1
+    missed = max(0, expected - len(seen))
+    print(f"dense cluster: {expected} images under {threshold}, {len(seen)} returned over {pages} pages, "
+          f"{short_pages} short pages before the last, {missed} missed")
+    return short_pages + missed
+
+
+def run(faces: int, projects: int, queries: int, limit: int, pages: int, threshold: float, dense: int,
+        dense_threshold: float):
+    vectors, face_project, project_ids, centre = load(faces, projects, dense)
+    target = project_ids[0]
+    own = np.array([i for i, p in enumerate(face_project) if p == target])
+    rng = np.random.default_rng(3)
+
+    empty_pages, timings = 0, []
+    for q in vectors[rng.choice(own, queries)]:
+        after = None
+        for page in range(pages):
+            with engine.connect().execution_options(schema_translate_map={None: SCHEMA}) as conn:
+                with Session(bind=conn) as db:
+                    started = time.perf_counter()
+                    result = search_similar_images(db, q, threshold=threshold, limit=limit, project_id=target, after=after)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    db.rollback()
+            if not result["images"]:
+                empty_pages += 1
+                print(f"  page {page + 1} came back empty")
+                break
+            after = result["next_after"]
+            if after is None:
+                break
+
+    ms = np.percentile(timings, [50, 99])
+    print(f"\n{faces} faces over {projects} projects ({len(own)} in the searched one): "
+          f"{len(timings)} pages p50={ms[0]:.1f}ms p99={ms[1]:.1f}ms, {empty_pages} empty")
+    dense_problems = page_through_dense(centre, target, limit, dense_threshold) if dense else 0
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    if empty_pages:
+        raise SystemExit(f"{empty_pages} queries got an empty page while the project still had matches")
+    if dense_problems:
+        raise SystemExit("paging through the dense cluster came back short or missed matches")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faces", type=int, default=200_000)
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3)
+    # synthetic identities are far apart, so a loose threshold gives every query several pages of matches
+    parser.add_argument("--threshold", type=float, default=1.1)
+    parser.add_argument("--dense", type=int, default=500)
+    parser.add_argument("--dense-threshold", type=float, default=0.3)
+    args = parser.parse_args()
+    run(args.faces, args.projects, args.queries, args.limit, args.pages, args.threshold, args.dense, args.dense_threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# recall and size of compact embedding storage against the float32 path
+# usage: python -m benchmarks.bench_quantization [rows ...] [--queries 200] [--k 50] [--rerank 2 4 8 16]
+# loads synthetic embeddings into a scratch table with vector, halfvec and bit columns and compares
+#   exact float32 top-k  vs  halfvec HNSW  vs  bit HNSW hamming pre-filter + exact re-rank
+import argparse
+import time
+import numpy as np
+from sqlalchemy import text
+from models import engine
+from benchmarks.bench_ann import TABLE, synthetic_embeddings, load_table
+
+
+def add_compact_columns():
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"ALTER TABLE {TABLE} ADD COLUMN embedding_half halfvec(512), ADD COLUMN embedding_bits bit(512)"))
+        conn.execute(text(f"UPDATE {TABLE} SET embedding_half = embedding::halfvec(512), embedding_bits = binary_quantize(embedding)::bit(512)"))
+        conn.execute(text("SET maintenance_work_mem = '2GB'"))
+        started = time.perf_counter()
+        conn.execute(text(f"CREATE INDEX ON {TABLE} USING hnsw (embedding_half halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"))
+        half_s = time.perf_counter() - started
+        started = time.perf_counter()
+        conn.execute(text(f"CREATE INDEX ON {TABLE} USING hnsw (embedding_bits bit_hamming_ops) WITH (m = 16, ef_construction = 64)"))
+        bits_s = time.perf_counter() - started
+        conn.execute(text(f"VACUUM ANALYZE {TABLE}"))
+    print(f"index build: halfvec {half_s:.1f}s, bits {bits_s:.1f}s")
+
+
+def column_sizes() -> dict:
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            f"SELECT sum(pg_column_size(embedding)) AS f, sum(pg_column_size(embedding_half)) AS h, "
+            f"sum(pg_column_size(embedding_bits)) AS b FROM {TABLE}"
+        )).one()
+        indexes = conn.execute(text(
+            f"SELECT indexrelid::regclass::text AS name, pg_relation_size(indexrelid) AS bytes "
+            f"FROM pg_index WHERE indrelid = '{TABLE}'::regclass"
+        )).all()
+    return {"float32": row.f, "halfvec": row.h, "bits": row.b, "indexes": {r.name: r.bytes for r in indexes}}
+
+
+def timed(conn, sql: str, params: dict) -> tuple:
+    started = time.perf_counter()
+    ids = conn.execute(text(sql), params).scalars().all()
+    return set(ids), (time.perf_counter() - started) * 1000
+
+
+def report(label: str, results: list, exact: list, k: int):
+    recall = np.mean([len(a & e) / max(1, len(e)) for (a, _), (e, _) in zip(results, exact)])
+    ms = np.percentile([ms for _, ms in results], [50, 99])
+    print(f"  {label:<28} recall@{k}={recall:.3f} p50={ms[0]:.1f}ms p99={ms[1]:.1f}ms")
+
+
+def run(rows: int, queries: int, k: int, rerank: list):
+    vectors = synthetic_embeddings(rows)
+    load_table(vectors)
+    add_compact_columns()
+    sizes = column_sizes()
+    mb = lambda b: (b or 0) / 1024 / 1024
+    print(f"\n{rows} rows: float32 {mb(sizes['float32']):.0f}MB, halfvec {mb(sizes['halfvec']):.0f}MB, bits {mb(sizes['bits']):.0f}MB")
+    for name, size in sizes["indexes"].items():
+        print(f"  index {name}: {mb(size):.0f}MB")
+
+    rng = np.random.default_rng(1)
+    picks = vectors[rng.integers(0, rows, queries)]
+    query_set = [
+        "[" + ",".join(f"{x:.6f}" for x in q) + "]"
+        for q in picks + 0.3 * rng.standard_normal(picks.shape).astype(np.float32)
+    ]
+
+    with engine.connect() as conn:
+        conn.execute(text("SET enable_indexscan = off"))
+        exact = [timed(conn, f"SELECT id FROM {TABLE} ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k", {"q": q, "k": k}) for q in query_set]
+        conn.rollback()
+    report("exact float32", exact, exact, k)
+
+    with engine.connect() as conn:
+        conn.execute(text("SET hnsw.ef_search = 100"))
+        half = [timed(conn, f"SELECT id FROM {TABLE} ORDER BY embedding_half <=> CAST(:q AS halfvec(512)) LIMIT :k", {"q": q, "k": k}) for q in query_set]
+        conn.rollback()
+    report("halfvec hnsw", half, exact, k)
+
+    for factor in rerank:
+        sql = (
+            f"SELECT id FROM (SELECT id, embedding FROM {TABLE} "
+            f"ORDER BY embedding_bits <~> binary_quantize(CAST(:q AS vector))::bit(512) LIMIT :n) c "
+            f"ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k"
+        )
+        with engine.connect() as conn:
+            conn.execute(text(f"SET hnsw.ef_search = {max(40, k * factor)}"))
+            results = [timed(conn, sql, {"q": q, "n": k * factor, "k": k}) for q in query_set]
+            conn.rollback()
+        report(f"bits + re-rank x{factor}", results, exact, k)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", nargs="*", type=int, default=[100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--rerank", nargs="*", type=int, default=[2, 4, 8, 16])
+    args = parser.parse_args()
+    for rows in args.rows:
+        run(rows, args.queries, args.k, args.rerank)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# time full demosaic vs embedded preview vs half-size demosaic per RAW extension
+# usage: python -m benchmarks.bench_raw /path/to/raw/samples
+import os
+import sys
+import time
+from collections import defaultdict
+from io import BytesIO
+import rawpy
+from helpers import RAW_EXTENSIONS, extract_raw_preview
+
+
+def time_call(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    folder = sys.argv[1]
+    timings = defaultdict(lambda: defaultdict(list))
+    previews_used = defaultdict(int)
+
+    for name in sorted(os.listdir(folder)):
+        ext = name.rsplit(".", 1)[-1].lower()
+        if ext not in RAW_EXTENSIONS:
+            continue
+        with open(os.path.join(folder, name), "rb") as f:
+            raw_bytes = f.read()
+
+        def full():
+            with rawpy.imread(BytesIO(raw_bytes)) as raw:
+                raw.postprocess()
+
+        def half():
+            with rawpy.imread(BytesIO(raw_bytes)) as raw:
+                raw.postprocess(half_size=True, use_camera_wb=True)
+
+        def preview():
+            with rawpy.imread(BytesIO(raw_bytes)) as raw:
+                if extract_raw_preview(raw) is not None:
+                    previews_used[ext] += 1
+
+        timings[ext]["full"].append(time_call(full))
+        timings[ext]["half"].append(time_call(half))
+        timings[ext]["preview"].append(time_call(preview))
+
+    for ext, modes in sorted(timings.items()):
+        count = len(modes["full"])
+        avg = {mode: sum(values) / len(values) * 1000 for mode, values in modes.items()}
+        print(
+            f"{ext:>4} ({count} files): full={avg['full']:.0f}ms half={avg['half']:.0f}ms "
+            f"preview={avg['preview']:.0f}ms (usable preview in {previews_used[ext]}/{count})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# p50/p99 latency of /guest/upload-selfie against a running server
+# usage: python -m benchmarks.bench_selfie <selfie.jpg> <project_id> [requests] [base_url]
+import sys
+import time
+import requests
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def main():
+    selfie_path = sys.argv[1]
+    project_id = sys.argv[2]
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    base_url = sys.argv[4] if len(sys.argv) > 4 else "http://localhost:8000"
+
+    with open(selfie_path, "rb") as f:
+        selfie = f.read()
+
+    session = requests.Session()
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        resp = session.post(
+            f"{base_url}/guest/upload-selfie",
+            data={"project_id": project_id},
+            files={"file": ("selfie.jpg", selfie, "image/jpeg")},
+            timeout=120,
+        )
+        timings.append((time.perf_counter() - started) * 1000)
+        resp.raise_for_status()
+
+    print(f"{count} requests: p50={percentile(timings, 50):.0f}ms p99={percentile(timings, 99):.0f}ms max={max(timings):.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
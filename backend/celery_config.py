@@ -23,6 +23,18 @@ celery.conf.task_default_queue = "folder_tasks"
 # route by task name
 celery.conf.task_routes = {
     "tasks.list_folder_and_enqueue": {"queue": "folder_tasks"},
+    "tasks.maintain_face_index": {"queue": "folder_tasks"},
+    "tasks.cluster_project_faces": {"queue": "folder_tasks"},
+    "tasks.sweep_dispatch": {"queue": "folder_tasks"},
     "tasks.process_image": {"queue": "image_tasks"},
+    "tasks.process_image_batch": {"queue": "image_tasks"},
+    "tasks.ingest_image_batch": {"queue": "image_tasks"},
     "tasks.generate_thumbnail": {"queue": "thumbnail_tasks"},
-}
\ No newline at end of file
+}
+
+# run with a single beat (celery -A celery_config worker -B, or celery -A celery_config beat)
+# so chunks whose worker died are requeued even when no batch finishes to trigger a refill
+DISPATCH_SWEEP_SECONDS = int(os.getenv("DISPATCH_SWEEP_SECONDS", "60"))
+celery.conf.beat_schedule = {
+    "sweep-dispatch": {"task": "tasks.sweep_dispatch", "schedule": DISPATCH_SWEEP_SECONDS},
+}
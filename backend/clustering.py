@@ -0,0 +1,92 @@
+# group a project's faces into person identities
+import os
+import numpy as np
+
+# cosine distance under which a face joins an existing identity
+CLUSTER_THRESHOLD = float(os.getenv("CLUSTER_THRESHOLD", "0.5"))
+CLUSTER_REFINE_ITERS = int(os.getenv("CLUSTER_REFINE_ITERS", "2"))
+CLUSTER_CHUNK = 2048
+
+
+def _normalize(rows: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(rows, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return rows / norms
+
+
+def _centroids(embeddings: np.ndarray, labels: np.ndarray, k: int) -> np.ndarray:
+    sums = np.zeros((k, embeddings.shape[1]), dtype=np.float32)
+    np.add.at(sums, labels, embeddings)
+    return _normalize(sums)
+
+
+def cluster_embeddings(embeddings: np.ndarray, threshold: float = CLUSTER_THRESHOLD, refine_iters: int = CLUSTER_REFINE_ITERS):
+    """
+    Leader clustering followed by a few k-means style refinement passes.
+    Runs in O(n * k) with chunked matrix products, so 50k faces with a few
+    thousand identities stays in the seconds range without an n x n matrix.
+
+    returns (labels, centroids) with labels[i] indexing into centroids
+    """
+    n = len(embeddings)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, embeddings.shape[1] if embeddings.ndim == 2 else 512), dtype=np.float32)
+    x = _normalize(np.asarray(embeddings, dtype=np.float32))
+    min_sim = 1.0 - threshold
+
+    labels = np.full(n, -1, dtype=np.int64)
+    # grow-by-doubling buffers so adding an identity doesn't copy every centroid
+    sums = np.zeros((256, x.shape[1]), dtype=np.float32)
+    cents = np.zeros_like(sums)
+    k = 0
+
+    def _add(idx: int, vec: np.ndarray):
+        sums[idx] += vec
+        cents[idx] = sums[idx] / (np.linalg.norm(sums[idx]) or 1.0)
+
+    for start in range(0, n, CLUSTER_CHUNK):
+        chunk = x[start:start + CLUSTER_CHUNK]
+        if k:
+            sims = chunk @ cents[:k].T
+            nearest = sims.argmax(axis=1)
+            matched = sims[np.arange(len(chunk)), nearest] >= min_sim
+        else:
+            nearest = np.zeros(len(chunk), dtype=np.int64)
+            matched = np.zeros(len(chunk), dtype=bool)
+        labels[start:start + len(chunk)][matched] = nearest[matched]
+        np.add.at(sums, nearest[matched], chunk[matched])
+        if matched.any():
+            touched = np.unique(nearest[matched])
+            cents[touched] = _normalize(sums[touched])
+
+        # faces that matched nothing seed new identities one at a time, so
+        # two unmatched faces of the same person in this chunk end up together
+        for i in np.nonzero(~matched)[0]:
+            vec = chunk[i]
+            if k:
+                sims = cents[:k] @ vec
+                best = int(sims.argmax())
+                if sims[best] >= min_sim:
+                    labels[start + i] = best
+                    _add(best, vec)
+                    continue
+            if k == len(sums):
+                sums = np.vstack([sums, np.zeros_like(sums)])
+                cents = np.vstack([cents, np.zeros_like(cents)])
+            _add(k, vec)
+            labels[start + i] = k
+            k += 1
+
+    centroids = cents[:k].copy()
+    for _ in range(refine_iters):
+        new_labels = np.empty(n, dtype=np.int64)
+        for start in range(0, n, CLUSTER_CHUNK):
+            new_labels[start:start + CLUSTER_CHUNK] = (x[start:start + CLUSTER_CHUNK] @ centroids.T).argmax(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        centroids = _centroids(x, labels, k)
+
+    # drop identities that lost every face during refinement and compact the labels
+    used, labels = np.unique(labels, return_inverse=True)
+    return labels, _centroids(x, labels, len(used))
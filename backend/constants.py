@@ -4,4 +4,25 @@ TOTAL_THUMBNAILS_KEY = "total_thumbnails"
 IMAGES_PROCESSED_KEY = "images_processed"
 TOTAL_IMAGE_COUNT_KEY = "total_image_count"
 PREPARING_IMAGE_COUNT = "preparing_image_count"
-PREPARING_TOTAL_COUNT = "preparing_total_count"
\ No newline at end of file
+PREPARING_TOTAL_COUNT = "preparing_total_count"
+DISPATCH_BACKLOG_KEY = "dispatch_backlog"
+# sorted set of slot leases; a new name so counters left by the old dispatcher are never read as one
+DISPATCH_INFLIGHT_KEY = "dispatch_leases"
+# per-project hash of lease id -> the chunk it carries, so a lapsed lease's chunk can be requeued
+DISPATCH_CHUNKS_KEY = "dispatch_chunks"
+# projects with dispatch work queued or outstanding, for the periodic sweep
+DISPATCH_PROJECTS_KEY = "dispatch_projects"
+PROJECT_FACES_VERSION_KEY = "project_faces_version"
+PROJECT_FACES_RESET_KEY = "project_faces_reset"
+FACE_QUALITY_STATS_KEY = "face_quality"
+# one hash per project holding the counters above as fields
+PROJECT_PROGRESS_KEY = "project_progress"
+# pub/sub channel prefix workers publish to whenever a project's progress hash changes
+PROJECT_PROGRESS_CHANNEL = "project_progress_events"
+# per-project hash of completions per time bucket, fields "<stage>:<bucket start>"
+PROJECT_RATE_KEY = "project_rate"
+# sorted sets of worker ids scored by their last completion, per project and across all projects
+PROJECT_WORKERS_KEY = "project_workers"
+INGEST_WORKERS_KEY = "ingest_workers"
+# projects scored by their last completion, so the autoscaler only looks at live ones
+INGEST_ACTIVE_PROJECTS_KEY = "ingest_active_projects"
@@ -1,13 +1,17 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 from models import SessionLocal
-from typing import List, Dict, Any, Optional, Generator
-from models import User, OAuthToken, Project, Image, Task, Face, AccessRequest, ProcessingRequest
+from typing import List, Dict, Any, Optional, Generator, Callable, Tuple
+from models import User, OAuthToken, Project, Image, Task, Face, AccessRequest, ProcessingRequest, PersonCluster
 from datetime import datetime
 import uuid
 from s3 import upload_file_to_s3_folder
 from sqlalchemy.orm import noload
 from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy import select, insert, update, delete
+from vector_index import embedding_columns, stored_embedding
+from pg_copy import FACE_INSERT_METHOD, copy_faces
 
 
 def get_db() -> Generator:
@@ -116,6 +120,13 @@ def mark_image_processed(db: Session, image_id: str):
 def get_unprocessed_images(db: Session, project_id: str) -> List[Image]:
     return db.query(Image).filter(Image.project_id == project_id, Image.processed == False).all()
 
+def get_processed_image_ids(db: Session, image_ids: List[str]) -> set:
+    "the subset of image_ids already marked processed"
+    if not image_ids:
+        return set()
+    rows = db.query(Image.id).filter(Image.id.in_(image_ids), Image.processed == True).all()
+    return {str(r[0]) for r in rows}
+
 def get_project(db: Session, project_id: str) -> Optional[Project]:
     return db.query(Project).options(noload(Project.images)).filter(Project.id == project_id).one_or_none()
 
@@ -144,6 +155,10 @@ def set_project_folder_id(db: Session, project_id: str, drive_folder_id: str) ->
     return project
 
 def clear_project_images(db:Session, project_id:str):
+    "drop the project's images with everything derived from them: person clusters and faces"
+    image_ids = select(Image.id).where(Image.project_id == project_id)
+    db.execute(delete(PersonCluster).where(PersonCluster.project_id == project_id))
+    db.execute(delete(Face).where(Face.image_id.in_(image_ids)))
     db.query(Image).filter(Image.project_id == project_id).delete()
     db.commit()
 
@@ -177,6 +192,54 @@ def add_image(
     db.refresh(img)
     return img
 
+def add_images_bulk(
+    db: Session,
+    project_id: str,
+    drive_file_ids: List[str],
+    batch_size: int = 1000,
+    on_batch: Optional[Callable[[int], None]] = None,
+) -> List[Tuple[str, str]]:
+    """
+    Register many images with one multi-row INSERT ... ON CONFLICT DO NOTHING per batch.
+    Rows that already exist (uq_project_drivefile) are skipped by Postgres instead of
+    raising, so there is no per-row commit/rollback.
+    on_batch(n) is called after each committed batch with the number of rows it inserted.
+    returns (image_id, drive_file_id) for every newly inserted row
+    """
+    inserted = []
+    for start in range(0, len(drive_file_ids), batch_size):
+        chunk = drive_file_ids[start:start + batch_size]
+        rows = [
+            {
+                "id": gen_uuid(),
+                "project_id": project_id,
+                "drive_file_id": key,
+                "name": key,
+                "mime_type": "",
+                "download_url": "",
+                "thumbnail_link": "",
+                "processed": False,
+                "created_at": datetime.utcnow(),
+            }
+            for key in chunk
+        ]
+        stmt = (
+            pg_insert(Image)
+            .values(rows)
+            .on_conflict_do_nothing(constraint="uq_project_drivefile")
+            .returning(Image.id, Image.drive_file_id)
+        )
+        try:
+            result = db.execute(stmt).all()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        inserted.extend((r.id, r.drive_file_id) for r in result)
+        if on_batch:
+            on_batch(len(result))
+    return inserted
+
 
 def create_task(db: Session, project_id: Optional[str], user_id: Optional[str], image_id: Optional[str]) -> Task:
     t = Task(id=gen_uuid(), project_id=project_id, user_id=user_id, image_id=image_id, status="queued", progress=0)
@@ -202,36 +265,137 @@ def update_task_status(db: Session, task_id: str, status: str, progress: Optiona
 
 
 # # FACES / EMBEDDINGS
-def insert_faces(db: Session, image_id: str, faces: List[Dict[str, Any]]) -> List[Face]:
+def _face_row(image_id: str, f: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "image_id": image_id,
+        "face_index": f.get("face_index"),
+        "bbox": [int(v) for v in f["bbox"]] if f.get("bbox") is not None else None,
+        "det_score": f.get("det_score"),
+        "face_size": f.get("face_size"),
+        "yaw": f.get("yaw"),
+        "pitch": f.get("pitch"),
+        "roll": f.get("roll"),
+        "sharpness": f.get("sharpness"),
+        **embedding_columns(f.get("embedding")),
+    }
+
+def save_processed_images(db: Session, results: List[Tuple[str, List[Dict[str, Any]]]]) -> int:
     """
-    faces: list of dicts with keys: face_index(int), bbox(list[int]), embedding(list[float]), metadata(dict)
+    results: list of (image_id, faces); faces are dicts with keys face_index(int),
+    bbox(list[int]), embedding(list[float]) and optionally det_score, face_size,
+    yaw, pitch, roll, sharpness.
+    Inserts every face with one multi-row insert (or one binary COPY when
+    FACE_INSERT_METHOD is "copy") and flips Image.processed for
+    all the images in the same transaction, so an image is never marked done
+    without its faces (or the other way round). Nothing is read back.
+    Returns the number of faces written.
     """
-    objs = []
-    for f in faces:
-        obj = Face(
-            image_id=image_id,
-            embedding=f.get("embedding"),
+    if not results:
+        return 0
+    rows = [_face_row(image_id, f) for image_id, faces in results for f in faces]
+    try:
+        if rows and FACE_INSERT_METHOD == "copy":
+            # same transaction as the UPDATE below, on the session's own connection
+            copy_faces(db.connection().connection, rows, Face.__tablename__)
+        elif rows:
+            db.execute(insert(Face), rows)
+        db.execute(
+            update(Image)
+            .where(Image.id.in_([image_id for image_id, _ in results]))
+            .values(processed=True)
+            .execution_options(synchronize_session=False)
         )
-        objs.append(obj)
-    db.bulk_save_objects(objs)
-    print(f"Inserting {len(objs)} faces for image {image_id}")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    print(f"Saved {len(rows)} faces for {len(results)} images")
+    return len(rows)
+
+# PERSON CLUSTERS
+def get_project_face_embeddings(db: Session, project_id: str) -> List[Tuple[int, str, Any]]:
+    "(face_id, image_id, embedding) for every face in the project"
+    stmt = (
+        select(Face.id, Face.image_id, stored_embedding())
+        .join(Image, Image.id == Face.image_id)
+        .where(Image.project_id == project_id)
+        .order_by(Face.id)
+    )
+    return db.execute(stmt).all()
+
+def replace_project_clusters(
+    db: Session,
+    project_id: str,
+    face_ids: List[int],
+    image_ids: List[str],
+    labels: List[int],
+    centroids: List[List[float]],
+    cover_face_ids: List[int],
+) -> int:
+    """
+    Swap a project's person clusters for a freshly computed set in one transaction.
+    labels[i] is the index into centroids for face_ids[i].
+    returns the number of clusters written
+    """
     try:
+        old = select(PersonCluster.id).where(PersonCluster.project_id == project_id)
+        db.execute(update(Face).where(Face.cluster_id.in_(old)).values(cluster_id=None))
+        db.execute(delete(PersonCluster).where(PersonCluster.project_id == project_id))
+
+        face_counts = [0] * len(centroids)
+        images = [set() for _ in centroids]
+        for image_id, label in zip(image_ids, labels):
+            face_counts[label] += 1
+            images[label].add(image_id)
+
+        rows = [
+            {
+                "project_id": project_id,
+                "centroid": centroid,
+                "face_count": face_counts[i],
+                "image_count": len(images[i]),
+                "cover_face_id": cover_face_ids[i],
+                "created_at": datetime.utcnow(),
+            }
+            for i, centroid in enumerate(centroids)
+        ]
+        cluster_ids = db.execute(pg_insert(PersonCluster).returning(PersonCluster.id, sort_by_parameter_order=True), rows).scalars().all() if rows else []
+
+        # executemany UPDATE keyed on primary key
+        db.execute(
+            update(Face),
+            [{"id": face_id, "cluster_id": cluster_ids[label]} for face_id, label in zip(face_ids, labels)],
+        )
         db.commit()
     except Exception:
         db.rollback()
         raise
-    # refresh returned objects
-    return db.query(Face).filter(Face.image_id == image_id)
+    return len(cluster_ids)
+
+def get_project_people(db: Session, project_id: str, min_images: int = 1) -> List[PersonCluster]:
+    return (
+        db.query(PersonCluster)
+        .filter(PersonCluster.project_id == project_id, PersonCluster.image_count >= min_images)
+        .order_by(PersonCluster.image_count.desc(), PersonCluster.id)
+        .all()
+    )
 
-def mark_image_processed(db: Session, image_id: str):
-    img = db.query(Image).filter(Image.id == image_id).one_or_none()
-    if not img:
-        raise ValueError("image not found")
-    img.processed = True
-    db.add(img)
-    db.commit()
-    db.refresh(img)
-    return img
+def get_person_images(db: Session, project_id: str, cluster_id: int) -> List[Image]:
+    return (
+        db.query(Image)
+        .join(Face, Face.image_id == Image.id)
+        .filter(Image.project_id == project_id, Face.cluster_id == cluster_id)
+        .distinct()
+        .order_by(Image.id)
+        .all()
+    )
+
+def get_faces_by_ids(db: Session, face_ids: List[int]) -> List[Tuple[int, str]]:
+    "(face_id, drive_file_id) for the given faces"
+    if not face_ids:
+        return []
+    stmt = select(Face.id, Image.drive_file_id).join(Image, Image.id == Face.image_id).where(Face.id.in_(face_ids))
+    return db.execute(stmt).all()
 
 # auth methods 
 def has_given_drive_permission(db:Session, user_id: str):
@@ -0,0 +1,155 @@
+# windowed, chunked dispatch of ingest work to the image workers
+import json
+import os
+import uuid
+from celery_config import celery
+from redisClient import redis_client
+from constants import DISPATCH_BACKLOG_KEY, DISPATCH_INFLIGHT_KEY, DISPATCH_CHUNKS_KEY, DISPATCH_PROJECTS_KEY
+
+DISPATCH_CHUNK_SIZE = int(os.getenv("DISPATCH_CHUNK_SIZE", "16"))   # images per broker message
+DISPATCH_WINDOW = int(os.getenv("DISPATCH_WINDOW", "8"))            # outstanding messages per project
+# a window slot is a lease; one whose worker died without releasing it (SIGKILL, OOM) lapses
+# after this long instead of shrinking the window for good. Keep it above the slowest batch.
+DISPATCH_LEASE_SECONDS = int(os.getenv("DISPATCH_LEASE_SECONDS", str(15 * 60)))
+
+# slots are a sorted set of lease ids scored by deadline, and the chunk each lease carries is
+# kept in a hash until it is released. Lapsed leases put their chunk back at the head of the
+# backlog; then, if the window has room and work is queued, a new lease takes the next chunk.
+# Returns {chunk or "", lapsed}.
+_CLAIM_LUA = """
+local now = tonumber(redis.call('TIME')[1])
+local lapsed = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now)
+for _, lease in ipairs(lapsed) do
+    local chunk = redis.call('HGET', KEYS[3], lease)
+    if chunk then
+        redis.call('LPUSH', KEYS[2], chunk)
+        redis.call('HDEL', KEYS[3], lease)
+    end
+    redis.call('ZREM', KEYS[1], lease)
+end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return {'', #lapsed}
+end
+local chunk = redis.call('LPOP', KEYS[2])
+if not chunk then
+    return {'', #lapsed}
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+redis.call('HSET', KEYS[3], ARGV[3], chunk)
+return {chunk, #lapsed}
+"""
+_claim = redis_client.register_script(_CLAIM_LUA)
+
+# give a lease back, optionally returning its chunk to the head of the backlog
+_RELEASE_LUA = """
+local chunk = redis.call('HGET', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+if chunk and ARGV[2] == '1' then
+    redis.call('LPUSH', KEYS[2], chunk)
+end
+return 1
+"""
+_release_lease = redis_client.register_script(_RELEASE_LUA)
+
+# stop sweeping a project once nothing is queued or outstanding
+_RETIRE_LUA = """
+if redis.call('LLEN', KEYS[2]) == 0 and redis.call('ZCARD', KEYS[1]) == 0 then
+    redis.call('HDEL', KEYS[4], ARGV[1])
+    return 1
+end
+return 0
+"""
+_retire = redis_client.register_script(_RETIRE_LUA)
+
+
+def _backlog_key(project_id: str) -> str:
+    return f"{DISPATCH_BACKLOG_KEY}:{project_id}"
+
+
+def _inflight_key(project_id: str) -> str:
+    return f"{DISPATCH_INFLIGHT_KEY}:{project_id}"
+
+
+def _chunks_key(project_id: str) -> str:
+    return f"{DISPATCH_CHUNKS_KEY}:{project_id}"
+
+
+def _keys(project_id: str) -> list:
+    return [_inflight_key(project_id), _backlog_key(project_id), _chunks_key(project_id), DISPATCH_PROJECTS_KEY]
+
+
+def start_project(project_id: str, items: list):
+    """
+    Replace the project's backlog with `items` (image_id, download_url, project_drive_folder, project_id)
+    and send the first window. The rest stays in a Redis list until batches finish.
+    """
+    redis_client.delete_key(_backlog_key(project_id))
+    redis_client.delete_key(_inflight_key(project_id))
+    redis_client.delete_key(_chunks_key(project_id))
+    chunks = [
+        json.dumps(items[start:start + DISPATCH_CHUNK_SIZE])
+        for start in range(0, len(items), DISPATCH_CHUNK_SIZE)
+    ]
+    redis_client.push_list(_backlog_key(project_id), chunks)
+    # lets sweep() find the project if every worker holding one of its leases dies
+    redis_client.set_hash(DISPATCH_PROJECTS_KEY, {project_id: 1})
+    return top_up(project_id)
+
+
+def _release(project_id: str, lease: str, requeue: bool = False):
+    redis_client.run_script(_release_lease, keys=_keys(project_id), args=[lease, "1" if requeue else "0"])
+
+
+def top_up(project_id: str) -> int:
+    "send queued chunks until the project has DISPATCH_WINDOW messages outstanding, returns how many were sent"
+    sent = 0
+    while True:
+        # claim a slot first so concurrent workers can't overshoot the window
+        lease = uuid.uuid4().hex
+        chunk, lapsed = redis_client.run_script(
+            _claim, keys=_keys(project_id), args=[DISPATCH_WINDOW, DISPATCH_LEASE_SECONDS, lease],
+        )
+        if lapsed:
+            print(f"Requeued {lapsed} lapsed dispatch chunks for project {project_id}")
+        if not chunk:
+            break
+        items = json.loads(chunk)
+        try:
+            async_result = celery.send_task("tasks.ingest_image_batch", args=(items,), kwargs={"lease": lease}, queue="image_tasks")
+            print(f"Dispatched {len(items)} images for project {project_id}, task id: {async_result.id}")
+            sent += 1
+        except Exception as e:
+            # put the chunk back so it isn't lost, and give the slot back
+            _release(project_id, lease, requeue=True)
+            print(f"Failed to dispatch chunk for project {project_id}: {e}")
+            break
+    return sent
+
+
+def batch_done(project_id: str, lease: str | None = None):
+    """
+    release the finished message's slot and refill the window. A lease that is
+    already gone (lapsed, or reset by a resync) is simply not there to remove;
+    messages sent before leases existed carry none and let theirs lapse.
+    """
+    if lease:
+        _release(project_id, lease)
+    top_up(project_id)
+
+
+def sweep() -> int:
+    """
+    Periodic pass over every project still dispatching: requeues chunks whose
+    lease lapsed and refills the window, so a project whose workers all died
+    keeps going without a finishing batch to trigger top_up. Returns chunks sent.
+    """
+    sent = 0
+    for project_id in redis_client.hash_keys(DISPATCH_PROJECTS_KEY):
+        sent += top_up(project_id)
+        redis_client.run_script(_retire, keys=_keys(project_id), args=[project_id])
+    return sent
+
+
+def pending_chunks(project_id: str) -> int:
+    return redis_client.list_length(_backlog_key(project_id))
@@ -0,0 +1,206 @@
+# streaming, cached proxy for Google Drive files
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from fastapi import HTTPException
+from http_client import get_session, DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT
+from redisClient import redis_client
+
+DRIVE_CACHE_DIR = os.getenv("DRIVE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "drive-img-cache"))
+DRIVE_CACHE_MAX_BYTES = int(os.getenv("DRIVE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# how long file metadata (and so the cache key / ETag) is trusted before asking Drive again
+DRIVE_META_TTL = int(os.getenv("DRIVE_META_TTL", "60"))
+DRIVE_API = "https://www.googleapis.com/drive/v3/files"
+STREAM_CHUNK = 256 * 1024
+
+_drive_meta_namespace = "drive_meta"
+
+
+class DriveAuthError(Exception):
+    "Drive rejected the access token (401); refresh it and retry"
+
+
+def with_token_refresh(creds, refresh, call):
+    "call(token) with the user's token, refreshing it once if Drive says it has expired"
+    try:
+        return call(creds.token)
+    except DriveAuthError:
+        return call(refresh().token)
+
+
+def drive_metadata(file_id: str, user_id: str, token: str) -> dict:
+    """
+    name, mimeType, modifiedTime and size, briefly cached in Redis per user: a cache
+    entry means this user's token could read the file within the last DRIVE_META_TTL
+    seconds, which is what lets the disk cache serve them without asking Drive.
+    """
+    key = f"{_drive_meta_namespace}:{user_id}:{file_id}"
+    cached = redis_client.get_key(key)
+    if cached:
+        return json.loads(cached)
+    resp = get_session().get(
+        f"{DRIVE_API}/{file_id}",
+        params={"fields": "name,mimeType,modifiedTime,size", "supportsAllDrives": "true"},
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT),
+    )
+    if resp.status_code == 401:
+        raise DriveAuthError(file_id)
+    if resp.status_code != 200:
+        raise HTTPException(status_code=404, detail=f"File not found or inaccessible: {resp.status_code}")
+    meta = resp.json()
+    redis_client.set_key(key, json.dumps(meta), exp=DRIVE_META_TTL)
+    return meta
+
+
+def etag_for(file_id: str, meta: dict) -> str:
+    return '"' + hashlib.sha1(f"{file_id}:{meta.get('modifiedTime')}".encode()).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def parse_range(header: str | None, size: int) -> tuple | None:
+    """
+    (start, end) inclusive for a single `bytes=` range, None to send the whole body.
+    Multi-range requests are answered with the whole body, which RFC 9110 allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+class DriveFileCache:
+    """
+    Bounded on-disk LRU of proxied Drive files keyed by (file id, modifiedTime),
+    so an edited file gets a new entry. Entries are written to a temp file and
+    renamed in, which keeps them safe to share between server processes; reads
+    touch the mtime and eviction drops the stalest files once over budget.
+    """
+
+    def __init__(self, root: str = DRIVE_CACHE_DIR, max_bytes: int = DRIVE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, file_id: str, modified: str | None) -> str:
+        return os.path.join(self.root, hashlib.sha1(f"{file_id}:{modified}".encode()).hexdigest())
+
+    def lookup(self, file_id: str, modified: str | None) -> str | None:
+        path = self.path_for(file_id, modified)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def tee(self, chunks, file_id: str, modified: str | None):
+        "pass chunks through while copying them into the cache; only a complete body is kept"
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".part-")
+        complete = False
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                os.replace(tmp, self.path_for(file_id, modified))
+                self.evict()
+            else:
+                try:
+                    os.unlink(tmp)
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.root):
+                if entry.name.startswith(".part-"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+
+def iter_file(path: str, start: int = 0, end: int | None = None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(STREAM_CHUNK if remaining is None else min(STREAM_CHUNK, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def open_upstream(file_id: str, token: str, range_header: str | None = None):
+    "start streaming the file's bytes from Drive, the caller closes the response"
+    headers = {"Authorization": f"Bearer {token}"}
+    if range_header:
+        headers["Range"] = range_header
+    resp = get_session().get(
+        f"{DRIVE_API}/{file_id}",
+        params={"alt": "media", "supportsAllDrives": "true"},
+        headers=headers,
+        stream=True,
+        timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT),
+    )
+    if resp.status_code == 401:
+        resp.close()
+        raise DriveAuthError(file_id)
+    if resp.status_code not in (200, 206):
+        resp.close()
+        raise HTTPException(status_code=502, detail=f"Drive download failed: {resp.status_code}")
+    return resp
+
+
+def iter_upstream(resp):
+    try:
+        for chunk in resp.iter_content(chunk_size=STREAM_CHUNK):
+            if chunk:
+                yield chunk
+    finally:
+        resp.close()
+
+
+drive_cache = DriveFileCache()
@@ -0,0 +1,114 @@
+# content-addressed cache of detected faces, so re-uploaded files skip inference
+import base64
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import redis
+from redisClient import redis_client
+
+FACE_MODEL_VERSION = os.getenv("FACE_MODEL_VERSION", "buffalo_l:" + os.getenv("DET_SIZE", "640,640"))
+# everything else that changes the faces produced for the same bytes: how RAW files are
+# rendered and which faces get aligned from a full-resolution decode
+FACE_CACHE_VERSION = ":".join([
+    FACE_MODEL_VERSION,
+    "raw=" + os.getenv("RAW_MODE", "preview"),
+    "align=" + os.getenv("ALIGN_MIN_FACE_PX", "112"),
+])
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_cache_namespace = "face_cache"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _encode_faces(faces: list) -> str:
+    return json.dumps([
+        {
+            "face_index": f["face_index"],
+            "bbox": f["bbox"],
+            "det_score": f.get("det_score"),
+            "sharpness": f.get("sharpness"),
+            "kps": np.asarray(f["kps"], dtype=np.float32).tolist() if f.get("kps") is not None else None,
+            "embedding": base64.b64encode(np.asarray(f["embedding"], dtype=np.float32).tobytes()).decode("ascii"),
+        }
+        for f in faces
+    ])
+
+
+def _decode_faces(raw: bytes) -> list:
+    faces = json.loads(raw)
+    for f in faces:
+        f["embedding"] = np.frombuffer(base64.b64decode(f["embedding"]), dtype=np.float32)
+        if f.get("kps") is not None:
+            f["kps"] = np.asarray(f["kps"], dtype=np.float32)
+    return faces
+
+
+class EmbeddingCache:
+    """
+    Faces per content hash in Redis, keyed by model version so a model change
+    never serves stale embeddings. A sorted set tracks last use and a counter
+    tracks stored bytes; the least recently used entries are dropped once the
+    total goes over `max_bytes` (entries of older model versions age out the same way).
+    """
+
+    def __init__(self, client: redis.Redis, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES, model_version: str = FACE_CACHE_VERSION):
+        self.client = client
+        self.max_bytes = max_bytes
+        self.model_version = model_version
+        self._lru_key = f"{_cache_namespace}:lru"
+        self._size_key = f"{_cache_namespace}:bytes"
+
+    def _key(self, digest: str) -> str:
+        return f"{_cache_namespace}:{self.model_version}:{digest}"
+
+    def get(self, digest: str) -> list | None:
+        key = self._key(digest)
+        try:
+            raw = self.client.get(key)
+            if raw is None:
+                return None
+            self.client.zadd(self._lru_key, {key: time.time()})
+        except redis.exceptions.RedisError as e:
+            print(f"Embedding cache read failed for {digest}: {e}")
+            return None
+        return _decode_faces(raw)
+
+    def put(self, digest: str, faces: list):
+        key = self._key(digest)
+        payload = _encode_faces(faces)
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(key, payload, nx=True)
+            pipe.zadd(self._lru_key, {key: time.time()})
+            stored, _ = pipe.execute()
+            if stored:
+                total = self.client.incrby(self._size_key, len(payload))
+                if total > self.max_bytes:
+                    self._evict()
+        except redis.exceptions.RedisError as e:
+            print(f"Embedding cache write failed for {digest}: {e}")
+
+    def _evict(self, batch: int = 100):
+        "drop least recently used entries until the cache fits its budget again"
+        while int(self.client.get(self._size_key) or 0) > self.max_bytes:
+            oldest = self.client.zrange(self._lru_key, 0, batch - 1)
+            if not oldest:
+                self.client.set(self._size_key, 0)
+                return
+            pipe = self.client.pipeline()
+            for key in oldest:
+                pipe.strlen(key)
+            sizes = pipe.execute()
+            pipe = self.client.pipeline()
+            pipe.delete(*oldest)
+            pipe.zrem(self._lru_key, *oldest)
+            pipe.decrby(self._size_key, sum(sizes))
+            pipe.execute()
+
+
+embedding_cache = EmbeddingCache(redis_client.client)
@@ -0,0 +1,90 @@
+# decide which detected faces are worth indexing
+import math
+import os
+import cv2
+import numpy as np
+
+# off: index every face. log: index every face but count the ones the gate would drop
+# (see /get-face-stats) so recall can be checked first. enforce: drop them.
+_gate = os.getenv("FACE_QUALITY_GATE", "log")
+FACE_QUALITY_GATE = {"0": "off", "1": "enforce"}.get(_gate, _gate)  # earlier on/off values still work
+if FACE_QUALITY_GATE not in ("off", "log", "enforce"):
+    # a typo would otherwise quietly index every face while the stats claim the gate is on
+    raise RuntimeError(f"FACE_QUALITY_GATE must be off, log or enforce (or 0/1), got {_gate!r}")
+FACE_MIN_SIZE = int(os.getenv("FACE_MIN_SIZE", "32"))              # shorter bbox side, full-res pixels
+FACE_MIN_DET_SCORE = float(os.getenv("FACE_MIN_DET_SCORE", "0.6"))
+FACE_MAX_YAW = float(os.getenv("FACE_MAX_YAW", "70"))              # degrees, 0 = frontal
+FACE_MAX_PITCH = float(os.getenv("FACE_MAX_PITCH", "60"))
+FACE_MIN_SHARPNESS = float(os.getenv("FACE_MIN_SHARPNESS", "15"))  # laplacian variance of the aligned crop
+
+REJECT_REASONS = ("small", "score", "pose", "blur")
+
+
+def sharpness(crop: np.ndarray) -> float:
+    "variance of the laplacian of the aligned crop; low values mean motion or focus blur"
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def estimate_pose(kps) -> tuple:
+    """
+    Rough (yaw, pitch, roll) in degrees from the detector's five landmarks
+    (left eye, right eye, nose, left mouth corner, right mouth corner).
+    Good enough to tell frontal from profile without running the 3D landmark model.
+    """
+    le, re, nose, lm, rm = np.asarray(kps, dtype=np.float64)[:5]
+    eye_vec = re - le
+    eye_dist = float(np.hypot(*eye_vec)) or 1.0
+    roll = math.atan2(eye_vec[1], eye_vec[0])
+
+    # undo the roll so yaw/pitch are measured along the face's own axes
+    cos_r, sin_r = math.cos(-roll), math.sin(-roll)
+    rot = np.array([[cos_r, -sin_r], [sin_r, cos_r]])
+    eye_mid = (le + re) / 2
+    nose_r = rot @ (nose - eye_mid)
+    mouth_r = rot @ ((lm + rm) / 2 - eye_mid)
+
+    midline_x = mouth_r[0] / 2
+    yaw = math.asin(float(np.clip((nose_r[0] - midline_x) / (eye_dist / 2), -1.0, 1.0)))
+    # on a frontal face the nose tip sits a little over half way from the eye line to the mouth
+    ratio = nose_r[1] / mouth_r[1] if mouth_r[1] > 0 else 0.55
+    pitch = math.asin(float(np.clip((ratio - 0.55) / 0.45, -1.0, 1.0)))
+    return math.degrees(yaw), math.degrees(pitch), math.degrees(roll)
+
+
+def describe(face: dict) -> dict:
+    "fill in face_size and pose for a face dict from the engine or the embedding cache"
+    x1, y1, x2, y2 = face["bbox"]
+    face["face_size"] = int(min(x2 - x1, y2 - y1))
+    if face.get("kps") is not None:
+        face["yaw"], face["pitch"], face["roll"] = estimate_pose(face["kps"])
+    return face
+
+
+def reject_reason(face: dict) -> str | None:
+    if face["face_size"] < FACE_MIN_SIZE:
+        return "small"
+    if face.get("det_score") is not None and face["det_score"] < FACE_MIN_DET_SCORE:
+        return "score"
+    if face.get("yaw") is not None and (abs(face["yaw"]) > FACE_MAX_YAW or abs(face["pitch"]) > FACE_MAX_PITCH):
+        return "pose"
+    if face.get("sharpness") is not None and face["sharpness"] < FACE_MIN_SHARPNESS:
+        return "blur"
+    return None
+
+
+def gate_faces(faces: list) -> tuple:
+    """
+    returns (kept, rejected) where rejected counts faces per reason. In log mode
+    the rejected faces are counted but still kept.
+    Every face is described either way so the kept ones carry their metadata.
+    """
+    kept, rejected = [], {}
+    for face in faces:
+        describe(face)
+        reason = reject_reason(face) if FACE_QUALITY_GATE != "off" else None
+        if reason is not None:
+            rejected[reason] = rejected.get(reason, 0) + 1
+        if reason is None or FACE_QUALITY_GATE != "enforce":
+            kept.append(face)
+    return kept, rejected
@@ -7,16 +7,19 @@ from fastapi.responses import RedirectResponse
 from redisClient import RedisClient
 from db import get_oauth_token, get_db
 import os 
-from insightface.app import FaceAnalysis
+from model_pool import face_pool
+from vector_index import set_search_params, cosine_distance, hamming_distance, HNSW_EF_SEARCH, IVFFLAT_PROBES, SEARCH_QUANTIZATION, BINARY_RERANK_FACTOR, HNSW_EF_SEARCH_MAX, ANN_ITERATIVE_SCAN
 import cv2
 import numpy as np 
 from sqlalchemy.orm import Session
-from models import Face, Image
-from sqlalchemy import select, func , cast 
+from models import Face, Image, PersonCluster
+from sqlalchemy import select, func , cast, or_, and_, exists, true
+from sqlalchemy.orm import aliased
 from pgvector.sqlalchemy import Vector
 from PIL import Image as PILImage
 import io
-import requests  
+from datetime import datetime
+from http_client import download_bytes
 import rawpy 
 from io import BytesIO
 
@@ -30,6 +33,18 @@ _oauth_states_namespace = "oauth_states"
 _user_tokens_namespace = "user_tokens"
 _project_folder_namespace = "project_folder"
 
+# "preview" = embedded JPEG when big enough, else half-size demosaic; "full" = full postprocess
+RAW_MODE = os.getenv("RAW_MODE", "preview")
+RAW_PREVIEW_MIN_SIZE = int(os.getenv("RAW_PREVIEW_MIN_SIZE", "1280"))
+RAW_EXTENSIONS = ['arw', 'nef', 'cr2', 'raw', 'dng', 'rw2']
+# faces fetched from the ANN index per requested image (an image can match on several faces)
+SEARCH_CANDIDATE_FACTOR = int(os.getenv("SEARCH_CANDIDATE_FACTOR", "4"))
+# widest window a short page is retried with before giving up on filling it
+SEARCH_CANDIDATE_MAX = int(os.getenv("SEARCH_CANDIDATE_MAX", "5000"))
+# person clusters probed per selfie, and how much looser than the face threshold a centroid may match
+CLUSTER_PROBE = int(os.getenv("CLUSTER_PROBE", "5"))
+CLUSTER_MATCH_MARGIN = float(os.getenv("CLUSTER_MATCH_MARGIN", "0.15"))
+
 
 
 
@@ -64,28 +79,46 @@ def credentials_for_user(user_id: str, redis_client: RedisClient) -> Credentials
         client_id=CLIENT_ID,
         client_secret=CLIENT_SECRET,
         scopes=SCOPES,
+        expiry=_stored_expiry(tok.get("expires_in")),
     )
     # print(creds)
     # refresh if expired
     if creds.expired and creds.refresh_token:
-        try:
-            print("Credentials Expired: Refreshing...")
-            creds.refresh(Request())
-            # persist refreshed access token and expiry info
-            redis_client.set_dict(f"{_user_tokens_namespace}:{user_id}", {
-                "access_token": creds.token,
-                "refresh_token": tok.get("refresh_token"),
-                "expires_in": getattr(creds, "expiry", None),
-                "scope": tok.get("scope"),
-            })
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"failed to refresh token: {e}")
+        print("Credentials Expired: Refreshing...")
+        refresh_user_credentials(user_id, creds, redis_client)
     return creds
 
-def process_image(img_bytes):
+def _stored_expiry(value) -> datetime | None:
+    "expiry persisted by refresh_user_credentials (naive UTC, ISO format); older entries have none"
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def refresh_user_credentials(user_id: str, creds: Credentials, redis_client: RedisClient) -> Credentials:
+    """
+    Refresh the access token in place and persist it (with its expiry) back to Redis.
+    Also used when Google rejects a token we thought was still valid.
+    """
+    if not creds.refresh_token:
+        raise HTTPException(status_code=401, detail="google access expired, sign in again")
+    try:
+        creds.refresh(Request())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"failed to refresh token: {e}")
+    key = f"{_user_tokens_namespace}:{user_id}"
+    tok = redis_client.get_dict(key)
+    tok.update({
+        "access_token": creds.token,
+        "refresh_token": creds.refresh_token,
+        "expires_in": creds.expiry.isoformat() if creds.expiry else None,
+    })
+    redis_client.set_dict(key, tok)
+    return creds
 
-    fa = FaceAnalysis(allowed_modules=['detection', 'recognition'], providers=[ 'CPUExecutionProvider'])
-    fa.prepare(ctx_id=0, det_size=(640, 640))
+def process_image(img_bytes):
 
     nparr = np.frombuffer(img_bytes, np.uint8) 
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -93,7 +126,9 @@ def process_image(img_bytes):
     if img is None:
         raise ValueError("Could not decode image")
     
-    faces = fa.get(img)  # list of face objects
+    # borrow a pre-warmed model instead of loading the ONNX files per request
+    with face_pool.acquire() as fa:
+        faces = fa.get(img)  # list of face objects
     embeddings = []
     for i, f in enumerate(faces, start=1):
         print("bbox:", f.bbox)           # bounding box
@@ -109,42 +144,174 @@ def process_image(img_bytes):
     
 
 
-def find_similar_images(
+def search_similar_images(
     db: Session,
     query_embedding: np.ndarray,
     threshold: float = 0.6,
-    limit: int = 10,
+    limit: int = 50,
     project_id: str | None = None,
-):
-    """Find images whose faces are similar to the query embedding."""
-    query_vector = query_embedding.tolist()
-    vector_cast = cast(query_vector, Vector(512))
+    after: tuple | None = None,
+    ef_search: int | None = HNSW_EF_SEARCH,
+    probes: int | None = IVFFLAT_PROBES,
+    cluster_ids: list[int] | None = None,
+) -> dict:
+    """
+    Index-friendly top-K search: the inner query is a plain ORDER BY embedding <=> q LIMIT n
+    over faces, which pgvector answers from the ANN index; the outer query collapses those
+    candidate faces to distinct images under the threshold. With SEARCH_QUANTIZATION=binary
+    the candidates are first pre-filtered by hamming distance on the bit signatures.
 
-    # Compute cosine distance per face, group by image
-    stmt = (
-        select(
-            Image,
-            func.min(func.cosine_distance(Face.embedding, vector_cast)).label("best_distance")
+    after: (best_distance, image_id) of the last image on the previous page
+    cluster_ids: only consider faces in these person clusters (plus faces not clustered yet)
+    returns {"images": [{"image": {...}, "distance": d}], "next_after": (d, image_id) | None}
+    """
+    distance = cosine_distance(query_embedding)
+    filters = []
+    if project_id:
+        filters.append(Image.project_id == project_id)
+    if cluster_ids is not None:
+        filters.append(or_(Face.cluster_id.in_(cluster_ids), Face.cluster_id.is_(None)))
+    if after:
+        filters.append(distance >= after[0])
+
+    # faces of images shown on earlier pages can fill the whole window (a dense cluster several
+    # pages deep), so a short page whose window was full and still under the threshold is retried wider
+    candidates = limit * SEARCH_CANDIDATE_FACTOR
+    while True:
+        rows, candidate_count, candidate_max = _search_window(
+            db, query_embedding, distance, filters, threshold, limit, project_id, after, candidates, ef_search, probes,
         )
-        .join(Face, Face.image_id == Image.id)
+        window_full = candidate_count == candidates and candidate_max is not None and candidate_max <= threshold
+        if len(rows) == limit or not window_full or candidates >= SEARCH_CANDIDATE_MAX:
+            break
+        candidates = min(candidates * 2, SEARCH_CANDIDATE_MAX)
+
+    images = [
+        {"image": {"id": r.id, "drive_file_id": r.drive_file_id}, "distance": float(r.best_distance)}
+        for r in rows
+    ]
+
+    # more pages exist if this one is full, or the widest window was used up while still under the threshold
+    has_more = bool(rows) and (len(rows) == limit or window_full)
+    next_after = (float(rows[-1].best_distance), rows[-1].id) if has_more else None
+    return {"images": images, "next_after": next_after}
+
+
+def _search_window(db: Session, query_embedding: np.ndarray, distance, filters: list, threshold: float, limit: int,
+                   project_id: str | None, after: tuple | None, candidates: int, ef_search: int | None,
+                   probes: int | None) -> tuple:
+    "one page out of the `candidates` nearest faces: (rows, faces in the window, farthest of them)"
+    coarse_limit = candidates * BINARY_RERANK_FACTOR
+    if ANN_ITERATIVE_SCAN == "off":
+        # without iterative scan the bit index can't return more than ef_search rows
+        coarse_limit = max(candidates, min(coarse_limit, HNSW_EF_SEARCH_MAX))
+    set_search_params(
+        db, ef_search=ef_search, probes=probes, filtered=bool(filters),
+        limit=coarse_limit if SEARCH_QUANTIZATION == "binary" else candidates,
     )
 
+    cand = select(Face.image_id.label("image_id"), distance.label("distance"))
     if project_id:
-        stmt = stmt.where(Image.project_id == project_id)
+        cand = cand.join(Image, Image.id == Face.image_id)
+    if SEARCH_QUANTIZATION == "binary":
+        # stage one walks the bit index by hamming distance; stage two re-ranks only those rows exactly
+        coarse = select(Face.id).join(Image, Image.id == Face.image_id).where(*filters)
+        coarse = coarse.order_by(hamming_distance(query_embedding)).limit(coarse_limit)
+        cand = cand.where(Face.id.in_(coarse.scalar_subquery()))
+    else:
+        cand = cand.where(*filters)
+    cand = cand.order_by(distance).limit(candidates).cte("candidates")
+
+    best = (
+        select(cand.c.image_id, func.min(cand.c.distance).label("best_distance"))
+        .where(cand.c.distance <= threshold)
+        .group_by(cand.c.image_id)
+        .subquery()
+    )
+    page = select(Image.id, Image.drive_file_id, best.c.best_distance).join(best, best.c.image_id == Image.id)
+    if after:
+        last_distance, last_id = after
+        earlier = aliased(Face)
+        page = page.where(
+            or_(best.c.best_distance > last_distance, and_(best.c.best_distance == last_distance, Image.id > last_id)),
+            # images with any face closer than the cursor were already on an earlier page
+            ~exists().where(earlier.image_id == Image.id, cosine_distance(query_embedding, earlier) < last_distance),
+        )
+    page = page.order_by(best.c.best_distance, Image.id).limit(limit).subquery()
 
+    # the window stats come back even when no image on this page survives the cursor
+    stats = (
+        select(func.count().label("candidate_count"), func.max(cand.c.distance).label("candidate_max"))
+        .select_from(cand)
+        .subquery()
+    )
     stmt = (
-        stmt.where(func.cosine_distance(Face.embedding, vector_cast) <= threshold)
-        .group_by(Image.id)
-        .order_by("best_distance")
-        
+        select(stats.c.candidate_count, stats.c.candidate_max, page.c.id, page.c.drive_file_id, page.c.best_distance)
+        .select_from(stats)
+        .outerjoin(page, true())
+        .order_by(page.c.best_distance, page.c.id)
     )
+    result = db.execute(stmt).all()
+    rows = [r for r in result if r.id is not None]
+    return rows, result[0].candidate_count, result[0].candidate_max
 
-    results = db.execute(stmt).all()
 
-    # results = [(Image, best_distance), ...]
-    # images = [{"image": image, "best_distance": dist} for image, dist in results]
-    images = [{"image":{"drive_file_id":image.drive_file_id}} for image, dist in results]
-    return images
+def find_similar_images(
+    db: Session,
+    query_embedding: np.ndarray,
+    threshold: float = 0.6,
+    limit: int = 10,
+    project_id: str | None = None,
+    ef_search: int | None = HNSW_EF_SEARCH,
+    probes: int | None = IVFFLAT_PROBES,
+):
+    """Find images whose faces are similar to the query embedding (first page only).
+    ef_search / probes tune the ANN index's recall for this query only."""
+    return search_similar_images(
+        db=db,
+        query_embedding=query_embedding,
+        threshold=threshold,
+        limit=limit,
+        project_id=project_id,
+        ef_search=ef_search,
+        probes=probes,
+    )["images"]
+
+
+def search_via_clusters(
+    db: Session,
+    query_embedding: np.ndarray,
+    project_id: str,
+    threshold: float = 0.6,
+    limit: int = 50,
+    after: tuple | None = None,
+    probe: int = CLUSTER_PROBE,
+) -> dict | None:
+    """
+    Two-step search over a clustered project: rank the project's person centroids
+    (a few hundred rows), then search only the faces of the closest few.
+    returns None when the project has not been clustered so callers can fall back.
+    """
+    vector_cast = cast(np.asarray(query_embedding, dtype=np.float32).tolist(), Vector(512))
+    distance = PersonCluster.centroid.cosine_distance(vector_cast)
+    rows = db.execute(
+        select(PersonCluster.id, distance.label("distance"))
+        .where(PersonCluster.project_id == project_id)
+        .order_by(distance)
+        .limit(probe)
+    ).all()
+    if not rows:
+        return None
+    cluster_ids = [r.id for r in rows if r.distance <= threshold + CLUSTER_MATCH_MARGIN]
+    return search_similar_images(
+        db=db,
+        query_embedding=query_embedding,
+        threshold=threshold,
+        limit=limit,
+        project_id=project_id,
+        after=after,
+        cluster_ids=cluster_ids,
+    )
 
 def get_drive_images(folder_id: str, creds: Credentials) -> list[dict]:
     
@@ -185,6 +352,20 @@ def create_thumbnail(img_bytes, size=(200,200), quality=70) -> bytes:
     image.save(output, format="JPEG", quality=quality)
     return output.getvalue()
 
+def create_thumbnail_from_array(img: np.ndarray, size=(200,200), quality=70) -> bytes:
+    """
+    Same output as create_thumbnail, but built from an already decoded BGR array
+    so the fused ingest stage doesn't have to re-decode the original.
+    """
+    h, w = img.shape[:2]
+    scale = min(size[0] / w, size[1] / h, 1.0)
+    new_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    thumb = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode thumbnail")
+    return buf.tobytes()
+
 def download_file_from_presigned_url(url):
     """
     Downloads a file from a pre-signed URL and returns the file content as bytes.
@@ -192,12 +373,8 @@ def download_file_from_presigned_url(url):
     :param url: The pre-signed URL to download the file from
     :return: The file content as bytes
     """
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        return response.content  # Return the content as bytes
-    else:
-        raise Exception(f"Failed to download file. Status code: {response.status_code}")
+    # pooled keep-alive session, streamed with a size cap and retried with jitter
+    return download_bytes(url)
 
 
 def is_raw_image(image_bytes):
@@ -214,19 +391,42 @@ def is_raw_image(image_bytes):
     
     return False
 
-def process_raw_image_from_bytes(raw_bytes):
+def extract_raw_preview(raw, min_size=RAW_PREVIEW_MIN_SIZE):
+    """
+    Return the camera's embedded JPEG preview if its long side is at least min_size, else None.
+    """
+    try:
+        thumb = raw.extract_thumb()
+    except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+        return None
+    if thumb.format != rawpy.ThumbFormat.JPEG:
+        return None
+    width, height = PILImage.open(BytesIO(thumb.data)).size
+    if max(width, height) < min_size:
+        return None
+    return bytes(thumb.data)
+
+def process_raw_image_from_bytes(raw_bytes, mode=RAW_MODE):
     """
     Process raw image bytes using rawpy and return the image in bytes.
+    mode "preview" uses the embedded JPEG when it's big enough and falls back to a
+    half-size demosaic; mode "full" always runs the full postprocess.
     """
     # Print first few bytes to debug
     print(f"Processing raw image with {len(raw_bytes)} bytes.")
     
     try:
         with rawpy.imread(BytesIO(raw_bytes)) as raw:
-            rgb_image = raw.postprocess()
+            if mode == "preview":
+                preview = extract_raw_preview(raw)
+                if preview is not None:
+                    return preview
+                rgb_image = raw.postprocess(half_size=True, use_camera_wb=True)
+            else:
+                rgb_image = raw.postprocess()
 
-        # Convert the image to bytes (e.g., JPEG or PNG)
-        _, img_bytes = cv2.imencode('.jpg', rgb_image)  # You can choose PNG or JPG here
+        # rawpy gives RGB, cv2 encodes BGR
+        _, img_bytes = cv2.imencode('.jpg', cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR))
         return img_bytes.tobytes()
     except Exception as e:
         print(f"Error processing ARW image: {e}")
@@ -0,0 +1,169 @@
+# shared download client: keep-alive pooling, streaming with a size cap, retries and ranged fetches
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError
+
+DOWNLOAD_POOL_SIZE = int(os.getenv("DOWNLOAD_POOL_SIZE", "16"))
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "5"))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "60"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+# objects bigger than this are fetched as parallel byte ranges (0 disables)
+RANGED_THRESHOLD = int(os.getenv("RANGED_THRESHOLD", str(32 * 1024 * 1024)))
+RANGED_PARTS = int(os.getenv("RANGED_PARTS", "4"))
+
+CHUNK_SIZE = 1024 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+    pass
+
+
+class TruncatedBody(Exception):
+    "the connection ended before the advertised length arrived; retried like a dropped connection"
+
+
+def get_session() -> requests.Session:
+    "one pooled session per process (celery forks workers after import, so sockets must not be shared)"
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+                _session_pid = os.getpid()
+    return _session
+
+
+def _backoff(attempt: int):
+    # exponential backoff with full jitter so retrying workers don't stampede
+    time.sleep(random.uniform(0, 0.5 * (2 ** attempt)))
+
+
+def _with_retries(fn):
+    last_error = None
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            return fn()
+        # bodies cut off mid-stream surface as ChunkedEncodingError / ProtocolError, the
+        # most common failure on large S3 and Drive bodies
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                ProtocolError, TruncatedBody) as e:
+            last_error = e
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in RETRY_STATUSES:
+                raise
+            last_error = e
+        if attempt < DOWNLOAD_RETRIES:
+            _backoff(attempt)
+    raise DownloadError(f"Download failed after {DOWNLOAD_RETRIES + 1} attempts: {last_error}")
+
+
+def _read_into(resp: requests.Response, buf: bytearray, offset: int, max_bytes: int) -> int:
+    "stream the body into buf starting at offset, returns the number of bytes written"
+    written = 0
+    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+        end = offset + written + len(chunk)
+        if end > max_bytes:
+            raise DownloadError(f"Download exceeds the {max_bytes} byte cap")
+        if end > len(buf):
+            buf.extend(b"\0" * (end - len(buf)))
+        buf[offset + written:end] = chunk
+        written += len(chunk)
+    return written
+
+
+def _fetch_range(url: str, headers: dict, buf: bytearray, start: int, end: int):
+    def _once():
+        range_headers = dict(headers, Range=f"bytes={start}-{end}")
+        with get_session().get(url, headers=range_headers, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as resp:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise DownloadError("Server ignored the Range header")
+            if _read_into(resp, buf, start, end + 1) != end - start + 1:
+                raise TruncatedBody(f"bytes {start}-{end} of {url.split('?')[0]}")
+    _with_retries(_once)
+
+
+def _read_whole(resp: requests.Response, max_bytes: int) -> bytearray:
+    "a plain (non-ranged) body, preallocated when its length is known"
+    length = int(resp.headers.get("Content-Length") or 0)
+    if length > max_bytes:
+        raise DownloadError(f"Object is {length} bytes, over the {max_bytes} byte cap")
+    buf = bytearray(length)
+    written = _read_into(resp, buf, 0, max_bytes)
+    if length and written < length and not resp.headers.get("Content-Encoding"):
+        raise TruncatedBody(f"{written} of {length} bytes")
+    if written < len(buf):
+        del buf[written:]
+    return buf
+
+
+def _get_whole(url: str, headers: dict, max_bytes: int) -> bytearray:
+    def _once():
+        with get_session().get(url, headers=headers, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as resp:
+            resp.raise_for_status()
+            return _read_whole(resp, max_bytes)
+    return _with_retries(_once)
+
+
+def download_bytes(url: str, headers: dict | None = None, max_bytes: int = DOWNLOAD_MAX_BYTES) -> bytearray:
+    """
+    Download url over the pooled session and return the body.
+    Bodies are streamed straight into a preallocated buffer. With RANGED_THRESHOLD
+    set, the first request asks for only that many bytes: smaller objects arrive
+    whole in it, and for larger ones its Content-Range gives the size, so the rest
+    is fetched as RANGED_PARTS parallel ranges without a separate probe and
+    without abandoning a half-read connection.
+    """
+    headers = headers or {}
+    if RANGED_THRESHOLD <= 0:
+        return _get_whole(url, headers, max_bytes)
+
+    def _first():
+        first_headers = dict(headers, Range=f"bytes=0-{RANGED_THRESHOLD - 1}")
+        with get_session().get(url, headers=first_headers, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as resp:
+            if resp.status_code == 416:
+                # nothing to range over: an empty object
+                return 0, bytearray()
+            resp.raise_for_status()
+            total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+            if resp.status_code != 206 or not total.isdigit() or resp.headers.get("Content-Encoding"):
+                # Range ignored: this is the whole body. An encoded or unsized partial body can't be
+                # stitched together, so that one is fetched again without a Range
+                return None, (_read_whole(resp, max_bytes) if resp.status_code != 206 else None)
+            total = int(total)
+            if total > max_bytes:
+                raise DownloadError(f"Object is {total} bytes, over the {max_bytes} byte cap")
+            buf = bytearray(total)
+            expected = min(total, RANGED_THRESHOLD)
+            if _read_into(resp, buf, 0, max_bytes) != expected:
+                raise TruncatedBody(f"first {expected} of {total} bytes")
+            return total, buf
+
+    total, buf = _with_retries(_first)
+    if buf is None:
+        return _get_whole(url, headers, max_bytes)
+    if total is None or total <= RANGED_THRESHOLD:
+        return buf
+
+    remaining = total - RANGED_THRESHOLD
+    part = -(-remaining // RANGED_PARTS)
+    ranges = [(start, min(start + part, total) - 1) for start in range(RANGED_THRESHOLD, total, part)]
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        for fut in [pool.submit(_fetch_range, url, headers, buf, start, end) for start, end in ranges]:
+            fut.result()
+    return buf
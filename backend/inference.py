@@ -0,0 +1,153 @@
+# batched face inference used by the image workers
+import io
+import os
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+from insightface.utils import face_align
+from face_quality import sharpness
+
+REC_BATCH_SIZE = int(os.getenv("REC_BATCH_SIZE", "32"))
+DET_SIZE = tuple(map(int, os.getenv("DET_SIZE", "640,640").split(",")))
+# faces at least this wide in the reduced image are aligned from it; smaller ones from a full-res decode
+ALIGN_MIN_FACE_PX = int(os.getenv("ALIGN_MIN_FACE_PX", "112"))
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class DecodedImage:
+    """
+    A detection-sized decode of an image plus a lazy full-resolution decode.
+    `scale` maps coordinates in `img` back to the full-resolution image.
+    """
+
+    def __init__(self, img: np.ndarray, img_bytes: bytes | None = None, scale: float = 1.0):
+        self.img = img
+        self.scale = scale
+        self.content_hash = None
+        # faces from the embedding cache; img is None when the load skipped decoding for them
+        self.cached_faces = None
+        self._img_bytes = img_bytes
+        self._full = img if scale == 1.0 else None
+
+    def full(self) -> np.ndarray:
+        if self._full is None:
+            self._full = cv2.imdecode(np.frombuffer(self._img_bytes, np.uint8), cv2.IMREAD_COLOR)
+        return self._full
+
+    def release(self):
+        "drop the full-res buffer and source bytes once the faces are aligned"
+        self._img_bytes = None
+        if self.scale != 1.0:
+            self._full = None
+
+
+def reduction_factor(width: int, height: int, det_size: tuple = DET_SIZE) -> int:
+    "largest DCT reduction that still leaves the long side at or above the detector's input size"
+    long_side = max(width, height)
+    target = max(det_size)
+    for factor in (8, 4, 2):
+        if long_side // factor >= target:
+            return factor
+    return 1
+
+
+def decode_for_detection(img_bytes: bytes, det_size: tuple = DET_SIZE) -> DecodedImage | None:
+    """
+    Decode at reduced resolution (libjpeg scales in the DCT domain, so a 1/4 decode
+    of a 45 MP JPEG never materialises the full bitmap). Detection resizes to
+    det_size anyway, so nothing it uses is lost.
+    """
+    try:
+        width, height = PILImage.open(io.BytesIO(img_bytes)).size  # header only
+    except Exception:
+        width = height = 0
+    factor = reduction_factor(width, height, det_size) if width and height else 1
+
+    img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), _REDUCED_FLAGS[factor])
+    if img is None:
+        return None
+    if factor == 1:
+        return DecodedImage(img)
+    scale = max(width, height) / max(img.shape[:2])
+    return DecodedImage(img, img_bytes=img_bytes, scale=scale)
+
+
+class FaceBatchEngine:
+    """
+    Runs detection and recognition over a group of decoded images.
+
+    Detection runs per image (the packaged SCRFD graph has a fixed batch of 1),
+    then every aligned face crop from the whole group is stacked and sent to the
+    recognition model in batches of `rec_batch_size`, so ONNX Runtime sees one
+    large call instead of one call per face.
+    """
+
+    def __init__(self, fa, rec_batch_size: int = REC_BATCH_SIZE):
+        self.fa = fa
+        self.det_model = fa.det_model
+        self.rec_model = fa.models["recognition"]
+        self.rec_batch_size = max(1, rec_batch_size)
+
+    def detect(self, img: np.ndarray):
+        "returns (bboxes, kpss) for a single image"
+        return self.det_model.detect(img, max_num=0, metric="default")
+
+    def embed(self, crops: list) -> np.ndarray:
+        "embed aligned crops in stacked batches, returns an (n, 512) array"
+        if not crops:
+            return np.empty((0, 512), dtype=np.float32)
+        out = []
+        for start in range(0, len(crops), self.rec_batch_size):
+            chunk = crops[start:start + self.rec_batch_size]
+            out.append(self.rec_model.get_feat(chunk))
+        return np.concatenate(out, axis=0)
+
+    def run(self, images: list) -> list:
+        """
+        images: list of DecodedImage or BGR ndarrays (None entries are skipped and get no faces)
+        returns one list of face dicts per input image, in the same order:
+            {"face_index", "bbox", "kps", "det_score", "sharpness", "embedding"}
+        bbox and kps are always in full-resolution coordinates.
+        """
+        results = [[] for _ in images]
+        crops = []
+        owners = []
+        image_size = self.rec_model.input_size[0]
+
+        for idx, decoded in enumerate(images):
+            if decoded is None:
+                continue
+            if isinstance(decoded, np.ndarray):
+                decoded = DecodedImage(decoded)
+            bboxes, kpss = self.detect(decoded.img)
+            for i in range(bboxes.shape[0]):
+                kps = kpss[i]
+                face_width = bboxes[i, 2] - bboxes[i, 0]
+                if decoded.scale == 1.0 or face_width >= ALIGN_MIN_FACE_PX:
+                    crop = face_align.norm_crop(decoded.img, landmark=kps, image_size=image_size)
+                else:
+                    # too small in the reduced decode, align from the full-resolution pixels
+                    crop = face_align.norm_crop(decoded.full(), landmark=kps * decoded.scale, image_size=image_size)
+                results[idx].append({
+                    "face_index": i + 1,
+                    "bbox": list(map(int, bboxes[i, 0:4] * decoded.scale)),
+                    "kps": kps * decoded.scale,
+                    "det_score": float(bboxes[i, 4]),
+                    "sharpness": sharpness(crop),
+                    "embedding": None,
+                })
+                crops.append(crop)
+                owners.append((idx, len(results[idx]) - 1))
+            decoded.release()
+
+        embeddings = self.embed(crops)
+        for (idx, pos), emb in zip(owners, embeddings):
+            results[idx][pos]["embedding"] = emb.flatten()
+
+        return results
@@ -0,0 +1,53 @@
+# management command for the faces.embedding ANN index
+# usage:
+#   python manage_index.py build [--method hnsw|ivfflat] [--m 16] [--ef-construction 64] [--lists N]
+#   python manage_index.py reindex [--method hnsw|ivfflat]
+#   python manage_index.py maintain [--method hnsw|ivfflat]
+#   python manage_index.py status
+#   python manage_index.py compact [--drop-float]
+import argparse
+import json
+from vector_index import (
+    FACE_INDEX_METHOD, build_index, reindex, maintain_after_ingest, index_status,
+    backfill_compact, build_compact_indexes, drop_float_embeddings,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and maintain the faces.embedding vector index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="create the index concurrently")
+    build.add_argument("--method", choices=["hnsw", "ivfflat"], default=FACE_INDEX_METHOD)
+    build.add_argument("--m", type=int, default=16)
+    build.add_argument("--ef-construction", type=int, default=64)
+    build.add_argument("--lists", type=int, default=None, help="ivfflat lists, defaults to rows/1000 (sqrt above 1M)")
+
+    for name, help_text in (("reindex", "rebuild the existing index concurrently"), ("maintain", "post-ingest maintenance")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--method", choices=["hnsw", "ivfflat"], default=FACE_INDEX_METHOD)
+
+    sub.add_parser("status", help="show index sizes and validity")
+
+    compact = sub.add_parser("compact", help="backfill halfvec/bit embeddings and index them")
+    compact.add_argument("--drop-float", action="store_true",
+                         help="afterwards NULL the float32 column; only once readers run with EMBEDDING_STORAGE=halfvec")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index(args.method, m=args.m, ef_construction=args.ef_construction, lists=args.lists)
+    elif args.command == "reindex":
+        reindex(args.method)
+    elif args.command == "maintain":
+        print(maintain_after_ingest(args.method))
+    elif args.command == "compact":
+        print(f"Backfilled {backfill_compact()} faces")
+        build_compact_indexes()
+        if args.drop_float:
+            drop_float_embeddings()
+    else:
+        print(json.dumps(index_status(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# optional in-process selfie search over a per-project embedding matrix
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from models import Face, Image
+from redisClient import redis_client
+from constants import PROJECT_FACES_VERSION_KEY, PROJECT_FACES_RESET_KEY
+from vector_index import stored_embedding
+
+SELFIE_SEARCH_BACKEND = os.getenv("SELFIE_SEARCH_BACKEND", "postgres")  # postgres | memory | clusters
+MATRIX_CACHE_MAX_BYTES = int(os.getenv("MATRIX_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+MATRIX_DTYPE = np.float16 if os.getenv("MATRIX_DTYPE", "float32") == "float16" else np.float32
+
+
+def _normalize(rows: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(rows, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return rows / norms
+
+
+class ProjectMatrix:
+    """
+    One project's faces as a contiguous, L2-normalised matrix. Faces are grouped by
+    image, so `starts` marks where each image's rows begin and per-image best
+    distances are a single np.minimum.reduceat.
+    """
+
+    def __init__(self, image_ids: np.ndarray, drive_file_ids: np.ndarray, starts: np.ndarray, matrix: np.ndarray, max_face_id: int):
+        self.image_ids = image_ids
+        self.drive_file_ids = drive_file_ids
+        self.starts = starts
+        self.matrix = matrix
+        self.max_face_id = max_face_id
+        self.version = None
+        self.reset = None
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.starts.nbytes + self.image_ids.nbytes + self.drive_file_ids.nbytes
+
+    @classmethod
+    def from_rows(cls, rows: list) -> "ProjectMatrix":
+        "rows: (image_id, drive_file_id, face_id, embedding) ordered by image_id"
+        if not rows:
+            return cls(np.array([], dtype=object), np.array([], dtype=object), np.array([], dtype=np.int64),
+                       np.empty((0, 512), dtype=MATRIX_DTYPE), 0)
+        image_ids, drive_file_ids, starts = [], [], []
+        for pos, row in enumerate(rows):
+            if not image_ids or image_ids[-1] != row[0]:
+                image_ids.append(row[0])
+                drive_file_ids.append(row[1])
+                starts.append(pos)
+        matrix = _normalize(np.asarray([row[3] for row in rows], dtype=np.float32)).astype(MATRIX_DTYPE)
+        return cls(
+            np.array(image_ids, dtype=object),
+            np.array(drive_file_ids, dtype=object),
+            np.array(starts, dtype=np.int64),
+            np.ascontiguousarray(matrix),
+            max(row[2] for row in rows),
+        )
+
+    def extend(self, other: "ProjectMatrix") -> "ProjectMatrix":
+        merged = ProjectMatrix(
+            np.concatenate([self.image_ids, other.image_ids]),
+            np.concatenate([self.drive_file_ids, other.drive_file_ids]),
+            np.concatenate([self.starts, other.starts + len(self.matrix)]),
+            np.ascontiguousarray(np.concatenate([self.matrix, other.matrix])),
+            max(self.max_face_id, other.max_face_id),
+        )
+        return merged
+
+    def search(self, query: np.ndarray, threshold: float, limit: int, after: tuple | None = None) -> dict:
+        "same result shape as helpers.search_similar_images"
+        if len(self.matrix) == 0:
+            return {"images": [], "next_after": None}
+        q = _normalize(np.asarray(query, dtype=np.float32)).astype(MATRIX_DTYPE)
+        distances = 1.0 - (self.matrix @ q).astype(np.float32)
+        best = np.minimum.reduceat(distances, self.starts)
+
+        mask = best <= threshold
+        if after is not None:
+            last_distance, last_id = after
+            mask &= (best > last_distance) | ((best == last_distance) & (self.image_ids > last_id))
+        candidates = np.nonzero(mask)[0]
+
+        if len(candidates) > limit:
+            # +1 so we know whether another page exists
+            top = candidates[np.argpartition(best[candidates], limit)[:limit + 1]]
+        else:
+            top = candidates
+        order = top[np.lexsort((self.image_ids[top].astype(str), best[top]))]
+        has_more = len(order) > limit
+        page = order[:limit]
+
+        images = [
+            {"image": {"id": self.image_ids[i], "drive_file_id": self.drive_file_ids[i]}, "distance": float(best[i])}
+            for i in page
+        ]
+        next_after = (float(best[page[-1]]), self.image_ids[page[-1]]) if has_more else None
+        return {"images": images, "next_after": next_after}
+
+
+class MatrixSearchCache:
+    """
+    LRU of ProjectMatrix objects under a memory budget. Workers INCR the project's
+    faces version in Redis as they record images; on access a changed version
+    pulls only faces newer than the cached max face id, while a changed reset
+    marker (folder re-set, images cleared) forces a full reload. A face count
+    that still doesn't match afterwards means a transaction committed ids below
+    the watermark late, and also gets a full reload.
+    """
+
+    def __init__(self, max_bytes: int = MATRIX_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._projects = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_rows(db: Session, project_id: str, after_face_id: int = 0) -> list:
+        stmt = (
+            select(Image.id, Image.drive_file_id, Face.id, stored_embedding())
+            .join(Face, Face.image_id == Image.id)
+            .where(Image.project_id == project_id, Face.id > after_face_id)
+            .order_by(Image.id, Face.id)
+        )
+        return db.execute(stmt).all()
+
+    @staticmethod
+    def _face_count(db: Session, project_id: str) -> int:
+        stmt = select(func.count()).select_from(Face).join(Image, Image.id == Face.image_id).where(Image.project_id == project_id)
+        return db.execute(stmt).scalar()
+
+    def _versions(self, project_id: str) -> tuple:
+        return (
+            redis_client.get_key(f"{PROJECT_FACES_VERSION_KEY}:{project_id}"),
+            redis_client.get_key(f"{PROJECT_FACES_RESET_KEY}:{project_id}"),
+        )
+
+    def get(self, db: Session, project_id: str) -> ProjectMatrix:
+        version, reset = self._versions(project_id)
+        with self._lock:
+            cached = self._projects.get(project_id)
+            if cached is not None:
+                self._projects.move_to_end(project_id)
+        if cached is not None and cached.reset == reset and cached.version == version:
+            return cached
+
+        matrix = None
+        if cached is not None and cached.reset == reset:
+            new_rows = self._load_rows(db, project_id, after_face_id=cached.max_face_id)
+            matrix = cached.extend(ProjectMatrix.from_rows(new_rows)) if new_rows else cached
+            # face ids are handed out before commit, so a slower transaction can land ids below
+            # the watermark; that is rare, and the count catches it
+            if len(matrix.matrix) != self._face_count(db, project_id):
+                matrix = None
+        if matrix is None:
+            matrix = ProjectMatrix.from_rows(self._load_rows(db, project_id))
+        matrix.version, matrix.reset = version, reset
+
+        with self._lock:
+            self._projects[project_id] = matrix
+            self._projects.move_to_end(project_id)
+            self._evict()
+        return matrix
+
+    def _evict(self):
+        total = sum(m.nbytes for m in self._projects.values())
+        while total > self.max_bytes and len(self._projects) > 1:
+            _, evicted = self._projects.popitem(last=False)
+            total -= evicted.nbytes
+
+    def invalidate(self, project_id: str):
+        with self._lock:
+            self._projects.pop(project_id, None)
+
+    def search(self, db: Session, project_id: str, query: np.ndarray, threshold: float = 0.6, limit: int = 50, after: tuple | None = None) -> dict:
+        return self.get(db, project_id).search(query, threshold, limit, after)
+
+
+matrix_cache = MatrixSearchCache()
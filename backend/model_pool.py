@@ -0,0 +1,92 @@
+# process-wide pool of pre-warmed face models for the API server
+import os
+import queue
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+# models loaded in this process. The API server only uses it with SELFIE_PROCESSES=0; with
+# selfie processes each one holds a single model, so their count sets the concurrency instead
+FACE_POOL_SIZE = int(os.getenv("FACE_POOL_SIZE", "2"))
+FACE_POOL_TIMEOUT = float(os.getenv("FACE_POOL_TIMEOUT", "30"))
+DET_SIZE = tuple(map(int, os.getenv("DET_SIZE", "640,640").split(",")))
+
+
+class FaceModelPool:
+    """
+    Holds `size` prepared FaceAnalysis instances so requests only pay for inference.
+    Each instance is used by one request at a time (ONNX sessions are shared per
+    instance, and FaceAnalysis keeps per-call state on the detector).
+    """
+
+    def __init__(self, size: int = FACE_POOL_SIZE):
+        self.size = max(1, size)
+        self._models = queue.Queue()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._loading = False
+        self.error = None
+
+    def _build(self):
+        from insightface.app import FaceAnalysis
+        fa = FaceAnalysis(allowed_modules=['detection', 'recognition'], providers=['CPUExecutionProvider'])
+        fa.prepare(ctx_id=0, det_size=DET_SIZE)
+        # warm up the ORT sessions so the first real request doesn't pay for it
+        fa.get(np.zeros((DET_SIZE[1], DET_SIZE[0], 3), dtype=np.uint8))
+        return fa
+
+    def load(self):
+        "build and warm every model, safe to call more than once"
+        with self._lock:
+            if self._ready.is_set() or self._loading:
+                return
+            self._loading = True
+        try:
+            # only a complete set goes into the queue, so a failed load can be retried
+            # without leaving extra models (and their memory) behind from the last attempt
+            built = []
+            for i in range(self.size):
+                built.append(self._build())
+                print(f"Face model {i + 1}/{self.size} loaded")
+            for fa in built:
+                self._models.put(fa)
+            self.error = None
+            self._ready.set()
+        except Exception as e:
+            self.error = str(e)
+            print(f"Failed to load face models: {e}")
+        finally:
+            self._loading = False
+
+    def load_in_background(self):
+        threading.Thread(target=self.load, name="face-model-pool", daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "size": self.size,
+            "available": self._models.qsize(),
+            "error": self.error,
+        }
+
+    @contextmanager
+    def acquire(self, timeout: float = FACE_POOL_TIMEOUT):
+        "borrow a model for the duration of the block"
+        if not self.ready and not self._loading:
+            # scripts and workers that never ran the startup hook
+            self.load()
+        try:
+            fa = self._models.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError("no face model available")
+        try:
+            yield fa
+        finally:
+            self._models.put(fa)
+
+
+face_pool = FaceModelPool()
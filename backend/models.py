@@ -8,7 +8,7 @@ from sqlalchemy.dialects.postgresql import UUID, ARRAY, JSONB, TEXT
 from sqlalchemy.orm import relationship, declarative_base, mapped_column
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
 import os 
 from dotenv import load_dotenv
 
@@ -147,22 +147,53 @@ class Face(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     image_id = Column(UUID(as_uuid=False), ForeignKey("images.id"), nullable=False, index=True)
     # task_id = Column(UUID(as_uuid=False), ForeignKey("tasks.id"), nullable=True, index=True)
-    # face_index = Column(Integer, nullable=False)  # order in image
-    # bbox = Column(ARRAY(Integer), nullable=False)  # [x1,y1,x2,y2]
+    face_index = Column(Integer, nullable=True)  # order in image
+    bbox = Column(ARRAY(Integer), nullable=True)  # [x1,y1,x2,y2] in full-res pixels
+    det_score = Column(Float, nullable=True)
+    face_size = Column(Integer, nullable=True)  # shorter bbox side in pixels
+    yaw = Column(Float, nullable=True)  # degrees, estimated from the 5 detector landmarks
+    pitch = Column(Float, nullable=True)
+    roll = Column(Float, nullable=True)
+    sharpness = Column(Float, nullable=True)  # laplacian variance of the aligned crop
     # Option A: use pgvector for efficient similarity search (recommended)
     # from pgvector.sqlalchemy import Vector
     # embedding = Column(Vector(1536))  # adjust dim to your model (512, 1536, etc.)
     # Option B: fallback to float array
     embedding = mapped_column(Vector(512))
+    # compact storage (EMBEDDING_STORAGE=halfvec): 2 bytes per dim, and a 64-byte sign signature for hamming pre-filtering
+    embedding_half = mapped_column(HALFVEC(512), nullable=True)
+    embedding_bits = mapped_column(BIT(512), nullable=True)
     # embedding_norm = Column(Float, nullable=True)  # optional precomputed norm
     # metadata = Column(JSONB, nullable=True)  # any extra (landmarks, score)
+    cluster_id = Column(Integer, ForeignKey("person_clusters.id", ondelete="SET NULL"), nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     image = relationship("Image", back_populates="faces")
+    cluster = relationship("PersonCluster", back_populates="faces")
+
+class PersonCluster(Base):
+    """One identity in a project: the centroid of its faces, rebuilt after processing completes."""
+    __tablename__ = "person_clusters"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    project_id = Column(UUID(as_uuid=False), ForeignKey("projects.id"), nullable=False, index=True)
+    centroid = mapped_column(Vector(512))
+    face_count = Column(Integer, nullable=False, default=0)
+    image_count = Column(Integer, nullable=False, default=0)
+    cover_face_id = Column(Integer, nullable=True)  # face closest to the centroid, used as the avatar
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    faces = relationship("Face", back_populates="cluster")
 
 # helpful indexes for queries
 # Index("ix_faces_image_faceidx", Face.image_id, Face.face_index)
-# if using pgvector, create an index for vector search in migration: CREATE INDEX ON faces USING ivfflat (embedding vector_l2_ops) ...
+# ANN index for cosine search, built by migration b41d7e2c9a10 and maintained with manage_index.py
+Index(
+    "ix_faces_embedding_hnsw",
+    Face.embedding,
+    postgresql_using="hnsw",
+    postgresql_with={"m": 16, "ef_construction": 64},
+    postgresql_ops={"embedding": "vector_cosine_ops"},
+)
 
 def init_db():
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,124 @@
+# bulk face ingestion through COPY ... FROM STDIN (FORMAT BINARY)
+import io
+import os
+import struct
+import uuid
+from datetime import datetime
+import numpy as np
+
+# insert: multi-row INSERT, embeddings sent as text literals Postgres has to parse
+# copy: binary COPY, embeddings sent in pgvector's own wire format
+FACE_INSERT_METHOD = os.getenv("FACE_INSERT_METHOD", "insert")
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+_NULL = struct.pack(">i", -1)
+_PG_EPOCH = datetime(2000, 1, 1)
+_INT4_OID = 23
+
+
+def _uuid(value) -> bytes:
+    return uuid.UUID(str(value)).bytes
+
+
+def _int4(value) -> bytes:
+    return struct.pack(">i", int(value))
+
+
+def _float8(value) -> bytes:
+    return struct.pack(">d", float(value))
+
+
+def _int4_array(values) -> bytes:
+    "one-dimensional int4[] without NULLs: ndim, has-null, element oid, (length, lower bound), then (4, value) pairs"
+    if len(values) == 0:
+        return struct.pack(">iii", 0, 0, _INT4_OID)
+    body = [v for value in values for v in (4, int(value))]
+    return struct.pack(f">iiiii{len(body)}i", 1, 0, _INT4_OID, len(values), 1, *body)
+
+
+def _vector(values) -> bytes:
+    "pgvector vector_recv: int16 dim, int16 unused, dim big-endian float4"
+    arr = np.asarray(values, dtype=">f4").ravel()
+    return struct.pack(">hh", arr.size, 0) + arr.tobytes()
+
+
+def _halfvec(values) -> bytes:
+    "pgvector halfvec_recv: int16 dim, int16 unused, dim big-endian float2"
+    arr = np.asarray(values, dtype=">f2").ravel()
+    return struct.pack(">hh", arr.size, 0) + arr.tobytes()
+
+
+def _bit(value) -> bytes:
+    "varbit_recv: int32 bit length, then the bits packed most significant first"
+    if isinstance(value, str):
+        nbits = len(value)
+        packed = int(value, 2).to_bytes((nbits + 7) // 8, "big") if nbits else b""
+    else:
+        arr = np.asarray(value).ravel().astype(bool)
+        nbits, packed = arr.size, np.packbits(arr).tobytes()
+    return struct.pack(">i", nbits) + packed
+
+
+def _timestamp(value: datetime) -> bytes:
+    "timestamp without time zone: int64 microseconds since 2000-01-01"
+    delta = value - _PG_EPOCH
+    return struct.pack(">q", (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+
+
+# binary encoder for every faces column the write path fills in
+FACE_COLUMN_ENCODERS = {
+    "image_id": _uuid,
+    "face_index": _int4,
+    "bbox": _int4_array,
+    "det_score": _float8,
+    "face_size": _int4,
+    "yaw": _float8,
+    "pitch": _float8,
+    "roll": _float8,
+    "sharpness": _float8,
+    "embedding": _vector,
+    "embedding_half": _halfvec,
+    "embedding_bits": _bit,
+    "created_at": _timestamp,
+}
+
+
+def encode_rows(columns: list, rows: list) -> bytes:
+    "a complete binary COPY stream (header, tuples, trailer) for row dicts"
+    encoders = [FACE_COLUMN_ENCODERS[column] for column in columns]
+    field_count = struct.pack(">h", len(columns))
+    out = io.BytesIO()
+    out.write(COPY_HEADER)
+    for row in rows:
+        out.write(field_count)
+        for column, encode in zip(columns, encoders):
+            value = row.get(column)
+            if value is None:
+                out.write(_NULL)
+                continue
+            data = encode(value)
+            out.write(struct.pack(">i", len(data)))
+            out.write(data)
+    out.write(COPY_TRAILER)
+    return out.getvalue()
+
+
+def copy_faces(dbapi_conn, rows: list, table: str = "faces") -> int:
+    """
+    Streams face row dicts (as built for the INSERT path) into `table` with one
+    binary COPY on the given psycopg2 connection, inside whatever transaction it
+    has open; the caller commits. COPY skips python-side column defaults, so
+    created_at is filled in here. Returns the number of rows copied.
+    """
+    if not rows:
+        return 0
+    columns = list(rows[0].keys())
+    if "created_at" not in columns:
+        columns.append("created_at")
+        now = datetime.utcnow()
+        rows = [{**row, "created_at": now} for row in rows]
+    payload = encode_rows(columns, rows)
+    with dbapi_conn.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT BINARY)", io.BytesIO(payload))
+    return len(rows)
@@ -0,0 +1,276 @@
+# per-project ingest progress, kept in one Redis hash
+import os
+import socket
+from redisClient import redis_client
+from constants import (
+    PROJECT_PROGRESS_KEY, PROJECT_PROGRESS_CHANNEL, TOTAL_IMAGES_KEY, IMAGES_PROCESSED_KEY, THUMBNAILS_GENERATED_KEY,
+    TOTAL_THUMBNAILS_KEY, PREPARING_IMAGE_COUNT, PREPARING_TOTAL_COUNT, PROJECT_RATE_KEY, PROJECT_WORKERS_KEY,
+    INGEST_WORKERS_KEY, INGEST_ACTIVE_PROJECTS_KEY,
+)
+
+STATUS_FIELD = "status"
+THUMBNAIL_STAGE = "thumbnail"
+EMBEDDING_STAGE = "embedding"
+
+# throughput is completions over the last THROUGHPUT_WINDOW seconds, counted in
+# THROUGHPUT_BUCKET-second buckets so the window is a couple dozen hash fields
+# no matter how many images finish in it
+THROUGHPUT_WINDOW = int(os.getenv("THROUGHPUT_WINDOW", "120"))
+THROUGHPUT_BUCKET = int(os.getenv("THROUGHPUT_BUCKET", "5"))
+# rate and worker keys of a project nobody touches any more disappear after this
+THROUGHPUT_KEY_TTL = 24 * 60 * 60
+
+# shared by both completion scripts: bump the stage's current bucket (trimming
+# expired ones whenever a new bucket starts) and mark this worker and project
+# as active, all on the Redis clock so workers' own clocks don't matter.
+# KEYS[3..6] = rate hash, project workers, all workers, active projects;
+# ARGV[1..6] = stage, worker id, project id, bucket seconds, window seconds, key ttl
+_RECORD_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local size = tonumber(ARGV[4])
+local window = tonumber(ARGV[5])
+local bucket = math.floor(now / size) * size
+if redis.call('HINCRBY', KEYS[3], ARGV[1] .. ':' .. bucket, 1) == 1 then
+    for _, field in ipairs(redis.call('HKEYS', KEYS[3])) do
+        local start = tonumber(string.match(field, ':(%d+)$'))
+        if start and start + size < now - window then
+            redis.call('HDEL', KEYS[3], field)
+        end
+    end
+    redis.call('EXPIRE', KEYS[3], ARGV[6])
+    redis.call('ZREMRANGEBYSCORE', KEYS[5], '-inf', now - tonumber(ARGV[6]))
+    redis.call('ZREMRANGEBYSCORE', KEYS[6], '-inf', now - tonumber(ARGV[6]))
+end
+redis.call('ZADD', KEYS[4], now, ARGV[2])
+redis.call('ZADD', KEYS[5], now, ARGV[2])
+redis.call('ZADD', KEYS[6], now, ARGV[3])
+redis.call('EXPIRE', KEYS[4], ARGV[6])
+"""
+
+# increment the processed counter and, the first time it reaches the total, mark
+# the project completed and pin the counters; all in one round trip, so only one
+# worker ever sees the completion. Stream subscribers are notified in the same call.
+_IMAGE_DONE_LUA = _RECORD_LUA + """
+local processed = redis.call('HINCRBY', KEYS[1], ARGV[7], 1)
+local total = tonumber(redis.call('HGET', KEYS[1], ARGV[8]) or '0')
+local completed = 0
+if total > 0 and processed >= total and redis.call('HGET', KEYS[1], ARGV[9]) ~= 'completed' then
+    redis.call('HSET', KEYS[1], ARGV[9], 'completed', ARGV[7], total, ARGV[10], total)
+    completed = 1
+end
+redis.call('PUBLISH', KEYS[2], processed)
+return {processed, total, completed}
+"""
+_THUMBNAIL_DONE_LUA = _RECORD_LUA + """
+local generated = redis.call('HINCRBY', KEYS[1], ARGV[7], 1)
+redis.call('PUBLISH', KEYS[2], generated)
+return generated
+"""
+# everything a progress report needs in one round trip: counters, the rate
+# buckets, how many workers finished something inside the window, and the time
+SNAPSHOT_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local workers = redis.call('ZCOUNT', KEYS[3], now - tonumber(ARGV[1]), '+inf')
+return {redis.call('HGETALL', KEYS[1]), redis.call('HGETALL', KEYS[2]), workers, t[1], t[2]}
+"""
+_image_done = redis_client.register_script(_IMAGE_DONE_LUA)
+_thumbnail_done = redis_client.register_script(_THUMBNAIL_DONE_LUA)
+_snapshot = redis_client.register_script(SNAPSHOT_LUA)
+
+
+def progress_key(project_id: str) -> str:
+    return f"{PROJECT_PROGRESS_KEY}:{project_id}"
+
+
+def progress_channel(project_id: str) -> str:
+    return f"{PROJECT_PROGRESS_CHANNEL}:{project_id}"
+
+
+def rate_key(project_id: str) -> str:
+    return f"{PROJECT_RATE_KEY}:{project_id}"
+
+
+def workers_key(project_id: str) -> str:
+    return f"{PROJECT_WORKERS_KEY}:{project_id}"
+
+
+def _worker_id() -> str:
+    # resolved per call: prefork pool children share the parent's imported modules
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _record_keys(project_id: str) -> list:
+    return [
+        progress_key(project_id), progress_channel(project_id), rate_key(project_id),
+        workers_key(project_id), INGEST_WORKERS_KEY, INGEST_ACTIVE_PROJECTS_KEY,
+    ]
+
+
+def _record_args(stage: str, project_id: str) -> list:
+    return [stage, _worker_id(), project_id, THROUGHPUT_BUCKET, THROUGHPUT_WINDOW, THROUGHPUT_KEY_TTL]
+
+
+def snapshot_keys(project_id: str) -> list:
+    return [progress_key(project_id), rate_key(project_id), workers_key(project_id)]
+
+
+def _set(project_id: str, fields: dict):
+    redis_client.set_hash(progress_key(project_id), fields)
+    redis_client.publish(progress_channel(project_id), "1")
+
+
+def start_preparing(project_id: str, total: int):
+    _set(project_id, {PREPARING_TOTAL_COUNT: total, PREPARING_IMAGE_COUNT: 0})
+
+
+def set_prepared(project_id: str, count: int):
+    _set(project_id, {PREPARING_IMAGE_COUNT: count})
+
+
+def start_processing(project_id: str, total: int):
+    _set(project_id, {
+        TOTAL_IMAGES_KEY: total,
+        TOTAL_THUMBNAILS_KEY: total,
+        THUMBNAILS_GENERATED_KEY: 0,
+        IMAGES_PROCESSED_KEY: 0,
+        STATUS_FIELD: "processing" if total else "completed",
+    })
+
+
+def thumbnail_done(project_id: str):
+    redis_client.run_script(
+        _thumbnail_done,
+        keys=_record_keys(project_id),
+        args=_record_args(THUMBNAIL_STAGE, project_id) + [THUMBNAILS_GENERATED_KEY],
+    )
+
+
+def image_done(project_id: str) -> tuple:
+    "returns (processed, total, completed_now); completed_now is true for exactly one caller"
+    processed, total, completed = redis_client.run_script(
+        _image_done,
+        keys=_record_keys(project_id),
+        args=_record_args(EMBEDDING_STAGE, project_id) + [IMAGES_PROCESSED_KEY, TOTAL_IMAGES_KEY, STATUS_FIELD, THUMBNAILS_GENERATED_KEY],
+    )
+    return int(processed), int(total), bool(completed)
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def parse_counters(raw: dict) -> dict:
+    "hash fields (str or bytes) to ints; missing fields read as 0"
+    raw = {_text(k): _text(v) for k, v in raw.items()}
+    counters = {
+        field: int(raw.get(field) or 0)
+        for field in (TOTAL_IMAGES_KEY, IMAGES_PROCESSED_KEY, THUMBNAILS_GENERATED_KEY,
+                      TOTAL_THUMBNAILS_KEY, PREPARING_IMAGE_COUNT, PREPARING_TOTAL_COUNT)
+    }
+    counters[STATUS_FIELD] = raw.get(STATUS_FIELD)
+    return counters
+
+
+def get_progress(project_id: str) -> dict:
+    "every counter in one HGETALL"
+    return parse_counters(redis_client.get_hash(progress_key(project_id)))
+
+
+def throughput(buckets: dict, now: float) -> dict:
+    """
+    completions per second for each stage over the window. The rate is taken
+    over the part of the window the project has actually been running, so a
+    project that started 20 seconds ago isn't diluted by 100 idle ones.
+    """
+    cutoff = now - THROUGHPUT_WINDOW
+    counts, first = {}, {}
+    for field, count in buckets.items():
+        stage, _, start = _text(field).rpartition(":")
+        start = float(start)
+        if start + THROUGHPUT_BUCKET < cutoff:
+            continue
+        counts[stage] = counts.get(stage, 0) + int(count)
+        first[stage] = min(first.get(stage, start), start)
+    rates = {}
+    for stage in (THUMBNAIL_STAGE, EMBEDDING_STAGE):
+        if not counts.get(stage):
+            rates[stage] = 0.0
+            continue
+        span = max(now - max(first[stage], cutoff), THROUGHPUT_BUCKET)
+        rates[stage] = counts[stage] / span
+    return rates
+
+
+def _eta(remaining: int, rate: float) -> float | None:
+    if remaining <= 0:
+        return 0
+    return round(remaining / rate) if rate > 0 else None
+
+
+def parse_snapshot(project_id: str, raw: list) -> dict:
+    "the report for a SNAPSHOT_LUA result (sync or asyncio client)"
+    counters_flat, buckets_flat, workers, seconds, micros = raw
+    counters = parse_counters(dict(zip(counters_flat[::2], counters_flat[1::2])))
+    now = int(seconds) + int(micros) / 1_000_000
+    rates = throughput(dict(zip(buckets_flat[::2], buckets_flat[1::2])), now)
+    return report(project_id, counters, rates, int(workers))
+
+
+def get_report(project_id: str) -> dict:
+    raw = redis_client.run_script(_snapshot, keys=snapshot_keys(project_id), args=[THROUGHPUT_WINDOW])
+    return parse_snapshot(project_id, raw)
+
+
+def ingest_metrics() -> dict:
+    """
+    Live throughput across every project that finished an image or thumbnail
+    inside the window, for an autoscaler to size the image workers against.
+    """
+    now = redis_client.server_time()
+    projects = [get_report(project_id) for project_id in
+                redis_client.sorted_set_members(INGEST_ACTIVE_PROJECTS_KEY, now - THROUGHPUT_WINDOW)]
+    images_per_sec = sum(p["images_per_sec"] for p in projects)
+    remaining = sum(max(p["total_images"] - p["processed_images"], 0) for p in projects)
+    return {
+        "window_seconds": THROUGHPUT_WINDOW,
+        "active_workers": redis_client.sorted_set_count(INGEST_WORKERS_KEY, now - THROUGHPUT_WINDOW),
+        "active_projects": len(projects),
+        "images_per_sec": round(images_per_sec, 2),
+        "thumbnails_per_sec": round(sum(p["thumbnails_per_sec"] for p in projects), 2),
+        "remaining_images": remaining,
+        "eta_seconds": _eta(remaining, images_per_sec),
+        "projects": projects,
+    }
+
+
+def report(project_id: str, counters: dict, rates: dict | None = None, active_workers: int = 0) -> dict:
+    "the /get-progress response body, shared with the progress stream"
+    total = counters[TOTAL_IMAGES_KEY]
+    processed = counters[IMAGES_PROCESSED_KEY]
+    thumbnails = counters[THUMBNAILS_GENERATED_KEY]
+    preparing_total = counters[PREPARING_TOTAL_COUNT]
+    rates = rates or {THUMBNAIL_STAGE: 0.0, EMBEDDING_STAGE: 0.0}
+
+    image_processing_progress = (processed / total * 100) if total > 0 else 0
+    thumbnails_progress = (thumbnails / total * 100) if total > 0 else 0
+    preparation_progress = (counters[PREPARING_IMAGE_COUNT] / preparing_total * 100) if preparing_total > 0 else 0
+
+    return {
+        "project_id": project_id,
+        "total_images": total,
+        "processed_images": processed,
+        "thumbnails_generated": thumbnails,
+        "percent_complete": image_processing_progress,
+        "image_processing_progress": round(image_processing_progress, 1),
+        "thumbnails_progress": round(thumbnails_progress, 1),
+        "images_progress": round(image_processing_progress, 1),
+        "preparation_progress": round(preparation_progress, 1),
+        "status": counters[STATUS_FIELD],
+        "thumbnails_per_sec": round(rates[THUMBNAIL_STAGE], 2),
+        "images_per_sec": round(rates[EMBEDDING_STAGE], 2),
+        "thumbnails_eta_seconds": _eta(counters[TOTAL_THUMBNAILS_KEY] - thumbnails, rates[THUMBNAIL_STAGE]) if total > 0 else None,
+        "eta_seconds": _eta(total - processed, rates[EMBEDDING_STAGE]) if total > 0 else None,
+        "active_workers": active_workers,
+    }
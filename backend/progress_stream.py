@@ -0,0 +1,120 @@
+# server-sent progress events fed by worker pub/sub messages
+import asyncio
+import json
+import os
+import redis.asyncio as aioredis
+import progress
+from constants import PROJECT_PROGRESS_CHANNEL
+
+# at most one update per project per interval, however many images finish in it
+PROGRESS_STREAM_INTERVAL = float(os.getenv("PROGRESS_STREAM_INTERVAL", "1.0"))
+PROGRESS_STREAM_HEARTBEAT = float(os.getenv("PROGRESS_STREAM_HEARTBEAT", "15"))
+
+
+class ProgressHub:
+    """
+    One pattern subscription per server process for every project's progress
+    channel. Messages only mark a project dirty; a flush loop reads each dirty
+    project's snapshot once per interval and fans the same snapshot out to all of
+    its viewers, so viewers cost a queue each rather than a polling loop.
+    """
+
+    def __init__(self, redis_url: str, interval: float = PROGRESS_STREAM_INTERVAL):
+        self.redis_url = redis_url
+        self.interval = interval
+        self._viewers = {}
+        self._dirty = set()
+        self._redis = None
+        self._snapshot = None
+        self._tasks = []
+
+    def start(self):
+        self._redis = aioredis.from_url(self.redis_url)
+        self._snapshot = self._redis.register_script(progress.SNAPSHOT_LUA)
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._flush_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    async def _listen(self):
+        prefix = f"{PROJECT_PROGRESS_CHANNEL}:"
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.psubscribe(prefix + "*")
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    project_id = message["channel"].decode()[len(prefix):]
+                    if project_id in self._viewers:
+                        self._dirty.add(project_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Progress subscription dropped, reconnecting: {e}")
+                # anything may have changed while we were disconnected
+                self._dirty.update(self._viewers)
+                await asyncio.sleep(1)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            dirty, self._dirty = self._dirty, set()
+            for project_id in dirty:
+                if self._viewers.get(project_id):
+                    try:
+                        await self._publish(project_id, await self.snapshot(project_id))
+                    except Exception as e:
+                        print(f"Progress snapshot failed for {project_id}: {e}")
+
+    async def snapshot(self, project_id: str) -> dict:
+        raw = await self._snapshot(keys=progress.snapshot_keys(project_id), args=[progress.THROUGHPUT_WINDOW])
+        return progress.parse_snapshot(project_id, raw)
+
+    async def _publish(self, project_id: str, report: dict):
+        for queue in list(self._viewers.get(project_id, ())):
+            # a slow viewer only ever holds the latest snapshot
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(report)
+
+    def subscribe(self, project_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self._viewers.setdefault(project_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, project_id: str, queue: asyncio.Queue):
+        viewers = self._viewers.get(project_id)
+        if viewers is not None:
+            viewers.discard(queue)
+            if not viewers:
+                del self._viewers[project_id]
+
+    def viewer_count(self) -> int:
+        return sum(len(v) for v in self._viewers.values())
+
+    async def events(self, project_id: str, request):
+        "SSE body for one viewer: the current state, then coalesced updates until the client leaves"
+        queue = self.subscribe(project_id)
+        try:
+            report = await self.snapshot(project_id)
+            while True:
+                if report is not None:
+                    yield f"event: progress\ndata: {json.dumps(report)}\n\n"
+                else:
+                    # comment line keeps proxies from timing out an idle stream
+                    yield ": keepalive\n\n"
+                if await request.is_disconnected():
+                    return
+                try:
+                    report = await asyncio.wait_for(queue.get(), timeout=PROGRESS_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    report = None
+        finally:
+            self.unsubscribe(project_id, queue)
+
+
+progress_hub = ProgressHub(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
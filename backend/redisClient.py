@@ -65,6 +65,135 @@ class RedisClient:
         except redis.exceptions.RedisError as e:
             raise RuntimeError(f"Redis error when deleting key {key}: {e}") from e
 
+    def decrement(self, key:str):
+        try: 
+            return self.client.decr(key)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when decrementing key {key}: {e}") from e
+
+    def push_list(self, key: str, values: list, left: bool = False):
+        "append values to the right of a list (or the left, to put them back at the head)"
+        if not values:
+            return 0
+        try:
+            if left:
+                return self.client.lpush(key, *values)
+            return self.client.rpush(key, *values)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when pushing to list {key}: {e}") from e
+
+    def pop_list(self, key: str, count: int) -> list:
+        "pop up to count values from the left of a list"
+        try:
+            values = self.client.lpop(key, count)
+            return [v.decode('utf-8') for v in values] if values else []
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when popping from list {key}: {e}") from e
+
+    def list_length(self, key: str) -> int:
+        try:
+            return self.client.llen(key)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when reading length of list {key}: {e}") from e
+
+    def increment_hash(self, key: str, amounts: dict):
+        "HINCRBY several fields of a hash in one round trip"
+        amounts = {field: amount for field, amount in amounts.items() if amount}
+        if not amounts:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for field, amount in amounts.items():
+                pipe.hincrby(key, field, amount)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when incrementing hash {key}: {e}") from e
+
+    def get_hash(self, key: str) -> dict:
+        try:
+            value = self.client.hgetall(key)
+            return {k.decode('utf-8'): v.decode('utf-8') for k, v in value.items()}
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when reading hash {key}: {e}") from e
+
+    def publish(self, channel: str, message: str):
+        try:
+            return self.client.publish(channel, message)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when publishing to {channel}: {e}") from e
+
+    def register_script(self, lua: str):
+        "server-side Lua script, called through run_script"
+        return self.client.register_script(lua)
+
+    def run_script(self, script, keys: list, args: list):
+        try:
+            return script(keys=keys, args=args)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when running script on {keys}: {e}") from e
+
+    def set_hash(self, key: str, mapping: dict, batch: int = 5000):
+        "HSET many fields, pipelined in batches"
+        if not mapping:
+            return
+        try:
+            items = list(mapping.items())
+            pipe = self.client.pipeline(transaction=False)
+            for start in range(0, len(items), batch):
+                pipe.hset(key, mapping=dict(items[start:start + batch]))
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when setting hash {key}: {e}") from e
+
+    def delete_hash_fields(self, key: str, fields: list):
+        if not fields:
+            return 0
+        try:
+            return self.client.hdel(key, *fields)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when deleting fields of hash {key}: {e}") from e
+
+    def hash_length(self, key: str) -> int:
+        try:
+            return self.client.hlen(key)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when reading length of hash {key}: {e}") from e
+
+    def hash_keys(self, key: str) -> list:
+        try:
+            return [k.decode('utf-8') for k in self.client.hkeys(key)]
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when reading fields of hash {key}: {e}") from e
+
+    def sorted_set_members(self, key: str, min_score: float, max_score: float = float("inf")) -> list:
+        "members scored within [min_score, max_score]"
+        try:
+            return [m.decode('utf-8') for m in self.client.zrangebyscore(key, min_score, max_score)]
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when reading sorted set {key}: {e}") from e
+
+    def sorted_set_count(self, key: str, min_score: float, max_score: float = float("inf")) -> int:
+        try:
+            return self.client.zcount(key, min_score, max_score)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when counting sorted set {key}: {e}") from e
+
+    def remove_from_sorted_set(self, key: str, members: list) -> int:
+        if not members:
+            return 0
+        try:
+            return self.client.zrem(key, *members)
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when removing from sorted set {key}: {e}") from e
+
+    def server_time(self) -> float:
+        "the Redis clock, which every worker's timestamps are taken from"
+        try:
+            seconds, micros = self.client.time()
+            return seconds + micros / 1_000_000
+        except redis.exceptions.RedisError as e:
+            raise RuntimeError(f"Redis error when reading server time: {e}") from e
+
 redis_client = RedisClient()
 try:
     redis_client.connect()
@@ -241,6 +241,42 @@ def list_files_in_s3_folder(bucket, folder_path):
         return []
     
 
+def list_objects_in_s3_folder(bucket, folder_path, start_after=None):
+    """
+    List the objects under a folder with their size and ETag
+
+    :param bucket: Bucket name
+    :param folder_path: Folder path in S3 (e.g., "documents/proposals")
+    :param start_after: only return keys that sort after this key
+    :return: List of {"key", "size", "etag"} dicts, raises on S3 errors
+    """
+    if folder_path and not folder_path.endswith('/'):
+        folder_path += '/'
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+    params = {"Bucket": bucket, "Prefix": folder_path}
+    if start_after:
+        params["StartAfter"] = start_after
+
+    objects = []
+    for page in paginator.paginate(**params):
+        for obj in page.get('Contents', []):
+            if obj['Key'] != folder_path:
+                objects.append({"key": obj['Key'], "size": obj['Size'], "etag": obj['ETag'].strip('"')})
+    return objects
+
+def head_object_in_s3(bucket, object_name):
+    """
+    Size and ETag of a single object
+
+    :return: {"key", "size", "etag"} or None if the object does not exist
+    """
+    try:
+        response = s3_client.head_object(Bucket=bucket, Key=object_name)
+    except Exception:
+        return None
+    return {"key": object_name, "size": response['ContentLength'], "etag": response['ETag'].strip('"')}
+
 # presigned url generation
 def generate_presigned_url(bucket, object_name, expiration=3600):
     """
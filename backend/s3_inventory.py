@@ -0,0 +1,149 @@
+# per-folder inventory of S3 objects so page views and resyncs don't re-list the prefix
+import os
+import posixpath
+import time
+from redisClient import redis_client
+from s3 import list_objects_in_s3_folder, head_object_in_s3
+
+# a full listing (diffed against the known keys) at most this often
+S3_INVENTORY_FULL_TTL = int(os.getenv("S3_INVENTORY_FULL_TTL", str(60 * 60)))
+# announced uploads that never showed up are forgotten after this long
+S3_INVENTORY_PENDING_TTL = int(os.getenv("S3_INVENTORY_PENDING_TTL", str(2 * 60 * 60)))
+# past this many announced uploads a listing is cheaper than one HEAD each
+S3_INVENTORY_HEAD_LIMIT = int(os.getenv("S3_INVENTORY_HEAD_LIMIT", "50"))
+
+_inventory_namespace = "s3_inventory"
+_inventory_meta_namespace = "s3_inventory_meta"
+_inventory_pending_namespace = "s3_inventory_pending"
+# every folder that has an inventory, so uploads and events can find the ones a key belongs to
+_inventory_folders_key = "s3_inventory_folders"
+
+
+def _folder(path: str) -> str:
+    return (path or "").strip("/")
+
+
+def _ancestors(key: str) -> list:
+    "every folder above a key: a/b/c.jpg -> [a, a/b]"
+    parent = posixpath.dirname(key).strip("/")
+    if not parent:
+        return []
+    parts = parent.split("/")
+    return ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def _entry(obj: dict) -> str:
+    return f"{obj['size']}|{obj['etag']}"
+
+
+class S3Inventory:
+    """
+    Keys, sizes and ETags under one S3 folder, held in a Redis hash with a
+    last-synced marker.
+
+    Refreshes are incremental: uploads announced through record_uploads (every
+    presigned PUT we hand out) are confirmed with a HEAD, S3 event notifications
+    are applied directly, and a full paginated listing only runs when the
+    inventory is missing or older than S3_INVENTORY_FULL_TTL. Even then only the
+    difference against the known set is written back.
+    """
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+
+    def _keys(self, folder: str) -> tuple:
+        folder = _folder(folder)
+        return (
+            f"{_inventory_namespace}:{folder}",
+            f"{_inventory_meta_namespace}:{folder}",
+            f"{_inventory_pending_namespace}:{folder}",
+        )
+
+    def full_sync(self, folder: str) -> dict:
+        inventory_key, meta_key, pending_key = self._keys(folder)
+        objects = list_objects_in_s3_folder(self.bucket, _folder(folder))
+        known = redis_client.get_hash(inventory_key)
+        listed = {obj["key"]: _entry(obj) for obj in objects}
+
+        changed = {key: entry for key, entry in listed.items() if known.get(key) != entry}
+        removed = [key for key in known if key not in listed]
+        redis_client.set_hash(inventory_key, changed)
+        redis_client.delete_hash_fields(inventory_key, removed)
+        redis_client.delete_hash_fields(pending_key, [key for key in redis_client.hash_keys(pending_key) if key in listed])
+
+        now = time.time()
+        redis_client.set_dict(meta_key, {"synced_at": now, "full_synced_at": now, "count": len(listed)})
+        redis_client.set_hash(_inventory_folders_key, {_folder(folder): now})
+        print(f"S3 inventory for {folder}: {len(listed)} objects, {len(changed)} changed, {len(removed)} removed")
+        return {"added": len(changed), "removed": len(removed), "count": len(listed)}
+
+    def refresh(self, folder: str, force_full: bool = False) -> dict:
+        inventory_key, meta_key, pending_key = self._keys(folder)
+        meta = redis_client.get_dict(meta_key)
+        now = time.time()
+        if force_full or not meta or now - meta.get("full_synced_at", 0) > S3_INVENTORY_FULL_TTL:
+            return self.full_sync(folder)
+
+        pending = redis_client.get_hash(pending_key)
+        if len(pending) > S3_INVENTORY_HEAD_LIMIT:
+            return self.full_sync(folder)
+
+        found, done = {}, []
+        for key, announced_at in pending.items():
+            obj = head_object_in_s3(self.bucket, key)
+            if obj is not None:
+                found[key] = _entry(obj)
+                done.append(key)
+            elif now - float(announced_at) > S3_INVENTORY_PENDING_TTL:
+                done.append(key)
+        redis_client.set_hash(inventory_key, found)
+        redis_client.delete_hash_fields(pending_key, done)
+        if found or pending:
+            meta["synced_at"] = now
+            meta["count"] = redis_client.hash_length(inventory_key)
+            redis_client.set_dict(meta_key, meta)
+        return {"added": len(found), "removed": 0, "count": meta.get("count", 0)}
+
+    def _folders_for(self, key: str, known: set) -> list:
+        """
+        inventories a key belongs to. Listings are recursive, so that is every inventoried
+        folder above it (normally just the project folder), not only its direct parent.
+        Folders without an inventory yet are skipped; their first refresh lists everything.
+        """
+        return [folder for folder in _ancestors(key) if folder in known]
+
+    def record_uploads(self, keys: list):
+        "remember keys we issued upload urls for, so the next refresh only has to HEAD them"
+        now = str(time.time())
+        known = set(redis_client.hash_keys(_inventory_folders_key))
+        by_folder = {}
+        for key in keys:
+            for folder in self._folders_for(key, known):
+                by_folder.setdefault(folder, {})[key] = now
+        for folder, entries in by_folder.items():
+            redis_client.set_hash(self._keys(folder)[2], entries)
+
+    def apply_event(self, key: str, size: int | None, etag: str | None, removed: bool = False):
+        "one S3 event notification record"
+        known = set(redis_client.hash_keys(_inventory_folders_key))
+        for folder in self._folders_for(key, known):
+            inventory_key, _, pending_key = self._keys(folder)
+            if removed:
+                redis_client.delete_hash_fields(inventory_key, [key])
+            else:
+                redis_client.set_hash(inventory_key, {key: _entry({"size": size or 0, "etag": (etag or "").strip('"')})})
+                redis_client.delete_hash_fields(pending_key, [key])
+
+    def count(self, folder: str) -> int:
+        self.refresh(folder)
+        return redis_client.hash_length(self._keys(folder)[0])
+
+    def keys(self, folder: str, force_full: bool = False) -> list:
+        self.refresh(folder, force_full=force_full)
+        return sorted(redis_client.hash_keys(self._keys(folder)[0]))
+
+    def last_synced(self, folder: str) -> float | None:
+        return redis_client.get_dict(self._keys(folder)[1]).get("synced_at")
+
+
+s3_inventory = S3Inventory("researchconclave")
@@ -0,0 +1,137 @@
+# keeps selfie inference and vector search off the API server's event loop
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import HTTPException
+from model_pool import face_pool
+
+# inference processes, one model each, so this is the selfie concurrency and FACE_POOL_SIZE is
+# not used; 0 = run inference in-process on the thread pool with FACE_POOL_SIZE models
+SELFIE_PROCESSES = int(os.getenv("SELFIE_PROCESSES", "2"))
+SELFIE_DB_THREADS = int(os.getenv("SELFIE_DB_THREADS", "8"))
+SELFIE_MAX_PENDING = int(os.getenv("SELFIE_MAX_PENDING", "32"))  # requests admitted before we answer 429
+
+
+def _init_process(warmed):
+    # every inference process owns exactly one warmed model, and counts itself once it has it
+    face_pool.size = 1
+    face_pool.load()
+    if face_pool.ready:
+        with warmed.get_lock():
+            warmed.value += 1
+
+
+def _warm() -> dict:
+    return face_pool.status()
+
+
+def _embed(image_bytes: bytes):
+    from helpers import process_image
+    return process_image(image_bytes)
+
+
+class SelfieWorkers:
+    """
+    Bounded process pool for CPU-bound selfie inference plus a thread pool for the
+    synchronous DB search. Requests past `max_pending` are rejected with a 429
+    instead of piling up behind the pools.
+    """
+
+    def __init__(self, processes: int = SELFIE_PROCESSES, db_threads: int = SELFIE_DB_THREADS, max_pending: int = SELFIE_MAX_PENDING):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.pending = 0
+        self._threads = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix="selfie-db")
+        self._procs = None
+        # processes of the current pool that finished loading their model; a new counter per pool
+        self._warmed = None
+        self._restart_lock = threading.Lock()
+
+    def start(self):
+        if self.processes > 0:
+            if "FACE_POOL_SIZE" in os.environ:
+                print(f"FACE_POOL_SIZE is ignored with SELFIE_PROCESSES={self.processes}, each process loads one model")
+            self._start_processes()
+        else:
+            face_pool.load_in_background()
+
+    def _start_processes(self):
+        with self._restart_lock:
+            self._spawn()
+
+    def _spawn(self):
+        "new pool and warm-up; caller holds _restart_lock"
+        self._warmed = multiprocessing.Value("i", 0)
+        self._procs = ProcessPoolExecutor(max_workers=self.processes, initializer=_init_process, initargs=(self._warmed,))
+        # the executor starts processes as work arrives, so one task per process gets them all loading now
+        for _ in range(self.processes):
+            self._procs.submit(_warm)
+
+    def _restart_processes(self, broken):
+        "replace `broken` unless a concurrent request already did, so N failed requests make one new pool"
+        with self._restart_lock:
+            if self._procs is not broken:
+                return
+            print("Selfie process pool broken, restarting")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._spawn()
+
+    @property
+    def ready(self) -> bool:
+        "every inference process has its model loaded, not just the first to finish"
+        if self.processes > 0:
+            warmed = self._warmed
+            return warmed is not None and warmed.value >= self.processes
+        return face_pool.ready
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "processes": self.processes,
+            "processes_warm": self._warmed.value if self._warmed is not None else 0,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "model_pool": None if self.processes > 0 else face_pool.status(),
+        }
+
+    def shutdown(self):
+        if self._procs is not None:
+            self._procs.shutdown(wait=False, cancel_futures=True)
+        self._threads.shutdown(wait=False, cancel_futures=True)
+
+    @asynccontextmanager
+    async def admit(self, require_models: bool = True):
+        "reserve a slot for one selfie request or fail fast with 503/429"
+        if require_models and not self.ready:
+            raise HTTPException(status_code=503, detail="Face models are still loading", headers={"Retry-After": "5"})
+        if self.pending >= self.max_pending:
+            raise HTTPException(status_code=429, detail="Too many selfie searches in progress, try again shortly", headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    async def embed(self, image_bytes: bytes):
+        loop = asyncio.get_running_loop()
+        if self.processes == 0:
+            return await loop.run_in_executor(self._threads, _embed, image_bytes)
+        procs = self._procs
+        try:
+            return await loop.run_in_executor(procs, _embed, image_bytes)
+        except BrokenProcessPool:
+            # a worker died (OOM, segfault in native code); replace the pool and surface a retryable error
+            self._restart_processes(procs)
+            raise HTTPException(status_code=503, detail="Face inference restarting", headers={"Retry-After": "5"})
+
+    async def run_db(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._threads, partial(fn, *args, **kwargs))
+
+
+selfie_workers = SelfieWorkers()
@@ -1,24 +1,40 @@
 from contextlib import contextmanager
 from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.responses import RedirectResponse, StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import requests
+import re
 import uuid 
 import json 
+import base64
+import numpy as np
 from celery_config import celery
 from typing import Optional, Dict, Any
 from sqlalchemy.exc import IntegrityError
 
 # file imports 
 from redisClient import redis_client
-from db import save_oauth_token, SessionLocal, get_db, get_oauth_token, set_project_folder_id,get_number_of_images, get_project, clear_project_images, user_exists, check_project_exists
-from helpers import credentials_for_user, get_drive_images, find_similar_images, download_file_from_presigned_url
+from db import save_oauth_token, SessionLocal, get_db, get_oauth_token, set_project_folder_id,get_number_of_images, get_project, clear_project_images, user_exists, check_project_exists, get_project_people, get_person_images, get_faces_by_ids
+from helpers import credentials_for_user, refresh_user_credentials, get_drive_images, search_similar_images, search_via_clusters
 from clerk import set_public_user_id
+from selfie_workers import selfie_workers
+from matrix_search import matrix_cache, SELFIE_SEARCH_BACKEND
+from face_quality import REJECT_REASONS, FACE_QUALITY_GATE
+from vector_index import stored_bytes_per_face
 
 #google drive api imports 
-from constants import IMAGES_PROCESSED_KEY, THUMBNAILS_GENERATED_KEY, TOTAL_IMAGES_KEY, TOTAL_THUMBNAILS_KEY, TOTAL_IMAGE_COUNT_KEY, PREPARING_IMAGE_COUNT, PREPARING_TOTAL_COUNT
-from s3 import list_files_in_s3_folder, generate_presigned_url, get_upload_presigned_url
+from constants import IMAGES_PROCESSED_KEY, THUMBNAILS_GENERATED_KEY, TOTAL_IMAGES_KEY, TOTAL_THUMBNAILS_KEY, TOTAL_IMAGE_COUNT_KEY, PREPARING_IMAGE_COUNT, PREPARING_TOTAL_COUNT, PROJECT_FACES_RESET_KEY, FACE_QUALITY_STATS_KEY
+from s3 import list_files_in_s3_folder
+from s3_inventory import s3_inventory
+from urllib.parse import unquote_plus, urlparse
+from url_signer import url_signer
+from zip_stream import stream_zip
+import progress
+import dispatcher
+from progress_stream import progress_hub
+from drive_proxy import drive_cache, drive_metadata, with_token_refresh, etag_for, etag_matches, parse_range, iter_file, open_upstream, iter_upstream
 from typing import *
 import os 
 
@@ -69,10 +85,36 @@ def get_session():
         session.close()
 
 
+@app.on_event("startup")
+def load_face_models():
+    # warm the selfie models in the background; /health/ready flips once they're loaded
+    selfie_workers.start()
+
+@app.on_event("startup")
+async def start_progress_hub():
+    # one pub/sub subscription per process shared by every /progress/stream viewer
+    progress_hub.start()
+
+@app.on_event("shutdown")
+def stop_selfie_workers():
+    selfie_workers.shutdown()
+
+@app.on_event("shutdown")
+async def stop_progress_hub():
+    await progress_hub.stop()
+
+
 @app.get("/")
 def read_root():
     return {"status": "Server is running"}
 
+@app.get("/health/ready")
+def readiness():
+    status = selfie_workers.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
 # # HELPER FUNCTIONS
 # def credentials_for_user(user_id: str, redis_client: RedisClient, ) -> Credentials:
 #     """
@@ -250,6 +292,9 @@ def set_folder_id(user_id: str, folder_id: str, project_id: str):
     # first clear all the images related to the previous project id if any 
     with get_session() as db:
         clear_project_images(db=db, project_id=project_id)
+        # in-memory search matrices and cluster-routed searches for this project must reload from scratch
+        redis_client.increment(f"{PROJECT_FACES_RESET_KEY}:{project_id}")
+        redis_client.delete_key(f"{FACE_QUALITY_STATS_KEY}:{project_id}")
         # set the folder id in db as well
         set_project_folder_id(
             db=db,
@@ -324,8 +369,13 @@ def get_project_endpoint(project_id: str):
         redis_client.set_key(cache_key, str(total_image_count), exp=5 * 60)
 
         print("Total image count:", total_image_count)
-        images = list_files_in_s3_folder(bucket=_bucket_name, folder_path=project.drive_folder_id)
-        out_of_sync = len(images) != total_image_count
+        # inventory count is refreshed incrementally instead of listing the whole prefix per page view
+        try:
+            s3_count = s3_inventory.count(project.drive_folder_id) if project.drive_folder_id else 0
+        except Exception as e:
+            print(f"S3 inventory refresh failed for {project.drive_folder_id}: {e}")
+            s3_count = total_image_count
+        out_of_sync = s3_count != total_image_count
 
         
         project_data = {
@@ -337,7 +387,9 @@ def get_project_endpoint(project_id: str):
             "image_count": total_image_count,
             "created_at": project.created_at,
             "updated_at": project.updated_at,
-            "out_of_sync": out_of_sync 
+            "out_of_sync": out_of_sync,
+            "new_files": max(0, s3_count - total_image_count),
+            "inventory_synced_at": s3_inventory.last_synced(project.drive_folder_id) if project.drive_folder_id else None,
         }
     return {"status": "ok", "project": project_data}
 
@@ -496,6 +548,64 @@ def home_info(user_id: str):
     }
 
 # upload selfie endpoint 
+SELFIE_PAGE_SIZE = int(os.getenv("SELFIE_PAGE_SIZE", "100"))
+SELFIE_SEARCH_TTL = int(os.getenv("SELFIE_SEARCH_TTL", str(30 * 60)))
+_selfie_search_namespace = "selfie_search"
+
+def encode_search_cursor(search_id: str, after: tuple | None) -> str | None:
+    if after is None:
+        return None
+    payload = json.dumps({"s": search_id, "d": after[0], "i": after[1]})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_search_cursor(cursor: str) -> tuple:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return payload["s"], (float(payload["d"]), payload["i"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def thumbnail_key(drive_file_id: str) -> str:
+    return "thumbnails/" + drive_file_id + "_thumbnail.jpg"
+
+def add_image_urls(images: list):
+    "set download_url and thumbnail_url (valid for an hour) on dicts carrying a drive_file_id"
+    keys = [img["drive_file_id"] for img in images]
+    download_urls = url_signer.sign_many(_bucket_name, keys, expiration=3600)
+    thumbnail_urls = url_signer.sign_many(_bucket_name, [thumbnail_key(k) for k in keys], expiration=3600)
+    for img, download_url, thumbnail_url in zip(images, download_urls, thumbnail_urls):
+        img["download_url"] = download_url
+        img["thumbnail_url"] = thumbnail_url
+    return images
+
+def store_selfie_search(search_id: str, project_id: str, embedding):
+    "keep the query embedding around so \"load more\" doesn't need the selfie again"
+    redis_client.set_key(
+        f"{_selfie_search_namespace}:{search_id}",
+        json.dumps({"project_id": project_id, "embedding": embedding.tolist()}),
+        exp=SELFIE_SEARCH_TTL,
+    )
+
+def load_selfie_search(search_id: str) -> dict | None:
+    stored = redis_client.get_key(f"{_selfie_search_namespace}:{search_id}")
+    return json.loads(stored) if stored else None
+
+def search_selfie_matches(project_id: str, embedding, after: tuple | None = None):
+    "one page of vector search plus presigned urls, runs on the selfie thread pool"
+    with get_session() as db:
+        page = None
+        if SELFIE_SEARCH_BACKEND == "memory":
+            page = matrix_cache.search(db=db, project_id=project_id, query=embedding, limit=SELFIE_PAGE_SIZE, after=after)
+        elif SELFIE_SEARCH_BACKEND == "clusters":
+            # None until the project has been clustered
+            page = search_via_clusters(db=db, query_embedding=embedding, project_id=project_id, limit=SELFIE_PAGE_SIZE, after=after)
+        if page is None:
+            page = search_similar_images(db=db, query_embedding=embedding, project_id=project_id, limit=SELFIE_PAGE_SIZE, after=after)
+    matching_images = page["images"]
+    # originals and thumbnails signed in one pass, mostly served from the signer's cache
+    add_image_urls([img["image"] for img in matching_images])
+    return matching_images, page["next_after"]
+
 @app.post("/guest/upload-selfie")
 async def upload_selfie(
     project_id: str = Form(...),
@@ -503,117 +613,208 @@ async def upload_selfie(
 ):
     # Read file bytes
     image_bytes = await file.read()
-    from helpers import process_image, find_similar_images
 
-    # Convert to cv2 image and process
-    try:
-        print(f"Processing uploaded selfie for project {project_id}, filename: {file.filename}")
-        embeddings = process_image(image_bytes)
+    # inference runs in the selfie process pool and the search on its thread pool,
+    # so the event loop only awaits; past the pending limit we answer 429
+    async with selfie_workers.admit():
+        try:
+            print(f"Processing uploaded selfie for project {project_id}, filename: {file.filename}")
+            embeddings = await selfie_workers.embed(image_bytes)
+
+            if not embeddings:
+                return {
+                    "status": "ok",
+                    "matching_images_count": 0,
+                    "matching_images": [],
+                    "next_cursor": None
+                }
+            matching_images, next_after = await selfie_workers.run_db(search_selfie_matches, project_id, embeddings[0])
+
+            search_id = str(uuid.uuid4())
+            if next_after is not None:
+                # redis calls are blocking, so they go through the thread pool like the search
+                await selfie_workers.run_db(store_selfie_search, search_id, project_id, embeddings[0])
 
-        if not embeddings:
             return {
                 "status": "ok",
-                "matching_images_count": 0,
-                "matching_images": []
+                "matching_images_count": len(matching_images),
+                "matching_images": matching_images,
+                "next_cursor": encode_search_cursor(search_id, next_after)
             }
-        # print("Embedding: ", embeddings)
-        with get_session() as db:
-            matching_images = find_similar_images(db=db, query_embedding=embeddings[0], project_id=project_id)
-        # loop through images to get new presigned urls valid for one hour 
-        # print(matching_images)
-        for img in matching_images:
-            # print(img)
-            presigned_url = generate_presigned_url(bucket=_bucket_name, object_name=img['image']["drive_file_id"], expiration=3600)
-            img["image"]["download_url"] = presigned_url
-            img['image']['thumbnail_url'] = generate_presigned_url(bucket=_bucket_name, object_name="thumbnails/"+img['image']["drive_file_id"]+"_thumbnail.jpg", expiration=3600)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Image processing failed: {str(e)}")
 
-        return {
-            "status": "ok",
-            "matching_images_count": len(matching_images),
-            "matching_images": matching_images
-        }
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Image processing failed: {str(e)}")
-    
-from googleapiclient.http import MediaIoBaseDownload
-from io import BytesIO
-from fastapi import Response
-
-@app.get("/drive-img/{file_id}")
-def get_drive_image(file_id: str, user_id: str, download: Optional[bool] = False):
-    """Serve a Google Drive image through your backend with caching + download support."""
+@app.get("/guest/search-more")
+async def search_more(cursor: str):
+    """
+    Next page of a selfie search, using the cursor returned by /guest/upload-selfie.
+    """
+    search_id, after = decode_search_cursor(cursor)
+
+    async with selfie_workers.admit(require_models=False):
+        search = await selfie_workers.run_db(load_selfie_search, search_id)
+        if search is None:
+            raise HTTPException(status_code=410, detail="Search expired, upload the selfie again")
+        matching_images, next_after = await selfie_workers.run_db(
+            search_selfie_matches, search["project_id"], np.asarray(search["embedding"], dtype=np.float32), after
+        )
+    return {
+        "status": "ok",
+        "matching_images_count": len(matching_images),
+        "matching_images": matching_images,
+        "next_cursor": encode_search_cursor(search_id, next_after)
+    }
 
-    # 1️⃣ Get OAuth credentials for the user
-    creds = credentials_for_user(user_id, redis_client)
-    service = build("drive", "v3", credentials=creds)
+PEOPLE_MIN_IMAGES = int(os.getenv("PEOPLE_MIN_IMAGES", "2"))
 
-    # 2️⃣ Fetch file metadata (for MIME type + name)
-    try:
-        file = service.files().get(fileId=file_id, fields="mimeType,name").execute()
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"File not found or inaccessible: {e}")
+@app.get("/get-people")
+def get_people(project_id: str):
+    """
+    People found in a project by the clustering stage, most photographed first.
+    Each person carries a thumbnail of the image holding their most typical face.
+    """
+    with get_session() as db:
+        people = get_project_people(db, project_id, min_images=PEOPLE_MIN_IMAGES)
+        covers = dict(get_faces_by_ids(db, [p.cover_face_id for p in people if p.cover_face_id]))
+        cover_keys = [thumbnail_key(covers[p.cover_face_id]) if p.cover_face_id in covers else None for p in people]
+        signed = iter(url_signer.sign_many(_bucket_name, [k for k in cover_keys if k], expiration=3600))
+        result = [
+            {
+                "cluster_id": person.id,
+                "face_count": person.face_count,
+                "image_count": person.image_count,
+                "cover_thumbnail_url": next(signed) if key else None,
+            }
+            for person, key in zip(people, cover_keys)
+        ]
+    return {"status": "ok", "people_count": len(result), "people": result}
 
-    mime_type = file.get("mimeType", "application/octet-stream")
-    file_name = file.get("name", "download")
+@app.get("/get-person-images")
+def get_person_images_endpoint(project_id: str, cluster_id: int):
+    """
+    Every image one person from /get-people appears in.
+    """
+    with get_session() as db:
+        images = get_person_images(db, project_id, cluster_id)
+        result = add_image_urls([{"id": img.id, "drive_file_id": img.drive_file_id} for img in images])
+    return {"status": "ok", "matching_images_count": len(result), "matching_images": result}
 
-    # 3️⃣ Download file content
-    request = service.files().get_media(fileId=file_id)
-    buf = BytesIO()
-    downloader = MediaIoBaseDownload(buf, request)
-    done = False
-    while not done:
-        _, done = downloader.next_chunk()
+from fastapi import Response, Request
 
-    buf.seek(0)
+@app.get("/drive-img/{file_id}")
+def get_drive_image(file_id: str, user_id: str, request: Request, download: Optional[bool] = False):
+    """
+    Serve a Google Drive image through the backend. Bytes are streamed as they
+    arrive, repeated views come from a local disk cache keyed by modifiedTime,
+    and Range / If-None-Match are honoured.
+    """
+    creds = credentials_for_user(user_id, redis_client)
+    # the stored token carries no expiry, so an expired one only shows up as a 401 from Drive
+    refresh = lambda: refresh_user_credentials(user_id, creds, redis_client)
+    meta = with_token_refresh(creds, refresh, lambda token: drive_metadata(file_id, user_id, token))
+    mime_type = meta.get("mimeType", "application/octet-stream")
+    file_name = meta.get("name", "download")
+    modified = meta.get("modifiedTime")
+    etag = etag_for(file_id, meta)
 
     disposition = "attachment" if download else "inline"
-
-
-    # 4️⃣ Return with proper headers
     headers = {
         "Cache-Control": "public, max-age=86400",  # cache 1 day
-        "Content-Disposition": f'{disposition}; filename="{file_name}"'  # or attachment for forced download
+        "Content-Disposition": f'{disposition}; filename="{file_name}"',
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    cached = drive_cache.lookup(file_id, modified)
+    if cached:
+        size = os.path.getsize(cached)
+        byte_range = parse_range(range_header, size)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(iter_file(cached, start, end), status_code=206, media_type=mime_type, headers=headers)
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file(cached), media_type=mime_type, headers=headers)
+
+    if range_header:
+        # partial reads of uncached files go straight through without filling the cache
+        upstream = with_token_refresh(creds, refresh, lambda token: open_upstream(file_id, token, range_header))
+        for name in ("Content-Range", "Content-Length"):
+            if name in upstream.headers and not upstream.headers.get("Content-Encoding"):
+                headers[name] = upstream.headers[name]
+        return StreamingResponse(iter_upstream(upstream), status_code=upstream.status_code, media_type=mime_type, headers=headers)
+
+    upstream = with_token_refresh(creds, refresh, lambda token: open_upstream(file_id, token))
+    # requests decodes any transfer compression, so the upstream length only holds for identity bodies
+    if "Content-Length" in upstream.headers and not upstream.headers.get("Content-Encoding"):
+        headers["Content-Length"] = upstream.headers["Content-Length"]
+    return StreamingResponse(drive_cache.tee(iter_upstream(upstream), file_id, modified), media_type=mime_type, headers=headers)
+
+@app.get("/get-face-stats")
+def get_face_stats(project_id: str):
+    """
+    How many detected faces were indexed vs. dropped by the quality gate, and the
+    approximate vector storage the dropped ones would have cost. With the gate in
+    log mode nothing is dropped; would_filter shows what enforcing it would drop.
+    """
+    stats = {k: int(v) for k, v in redis_client.get_hash(f"{FACE_QUALITY_STATS_KEY}:{project_id}").items()}
+    filtered = stats.get("filtered", 0)
+    detected = stats.get("indexed", 0) + filtered
+    return {
+        "status": "ok",
+        "detected": detected,
+        "indexed": stats.get("indexed", 0),
+        "filtered": filtered,
+        "filtered_by_reason": {reason: stats.get(f"filtered_{reason}", 0) for reason in REJECT_REASONS},
+        "filtered_ratio": round(filtered / detected, 4) if detected else 0.0,
+        "estimated_bytes_saved": filtered * stored_bytes_per_face(),
+        "gate": FACE_QUALITY_GATE,
+        "would_filter": stats.get("would_filter", 0),
+        "would_filter_by_reason": {reason: stats.get(f"would_filter_{reason}", 0) for reason in REJECT_REASONS},
     }
-
-    return Response(content=buf.read(), media_type=mime_type, headers=headers)
 
 @app.get("/get-progress")
 def get_progress(project_id: str):
-    
-    total_images = redis_client.get_key(f"{TOTAL_IMAGES_KEY}:{project_id}")
-    processed_images = redis_client.get_key(f"{IMAGES_PROCESSED_KEY}:{project_id}")
-    thumbnails_generated = redis_client.get_key(f"{THUMBNAILS_GENERATED_KEY}:{project_id}")
-    preparing_images_count = redis_client.get_key(f"{PREPARING_IMAGE_COUNT}:{project_id}")
-    total_preparing_count = redis_client.get_key(f"{PREPARING_TOTAL_COUNT}:{project_id}")
-    
-    # Convert to int with safe defaults
-    total = int(total_images) if total_images else 0
-    processed = int(processed_images) if processed_images else 0
-    thumbnails = int(thumbnails_generated) if thumbnails_generated else 0
-   
-    image_processing_progress = (processed / total * 100) if total > 0 else 0
-    thumbnails_progress = (thumbnails / total * 100) if total > 0 else 0
-    preparation_progress = (int(preparing_images_count) / int(total_preparing_count) * 100) if total > 0 else 0
+    # counters, throughput and active workers come back from a single script call
+    return progress.get_report(project_id)
 
-    
-    return {
-        "project_id": project_id,
-        "total_images": total,
-        "processed_images": processed,
-        "thumbnails_generated": thumbnails,
-        "percent_complete": image_processing_progress,
-        "image_processing_progress": round(image_processing_progress, 1),
-        "thumbnails_progress": round(thumbnails_progress, 1),
-        "images_progress": round(image_processing_progress, 1),
-        "preparation_progress": round(preparation_progress, 1)
-    }
+@app.get("/ingest-metrics")
+def ingest_metrics():
+    """
+    Throughput, ETA and active workers across all projects being ingested, plus
+    the broker messages still waiting in each project's dispatch backlog; meant
+    for an autoscaler sizing the image_tasks workers.
+    """
+    metrics = progress.ingest_metrics()
+    for project in metrics["projects"]:
+        project["queued_chunks"] = dispatcher.pending_chunks(project["project_id"])
+    metrics["queued_chunks"] = sum(project["queued_chunks"] for project in metrics["projects"])
+    return metrics
+
+@app.get("/progress/stream")
+async def progress_stream(project_id: str, request: Request):
+    """
+    Server-Sent Events version of /get-progress: the current state on connect,
+    then at most one update per PROGRESS_STREAM_INTERVAL while images finish.
+    """
+    return StreamingResponse(
+        progress_hub.events(project_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/resync-drive-folder")
-def resync_drive_folder(user_id: str, project_id: str):
-    # get all unprocessed images from the db 
+def resync_drive_folder(user_id: str, project_id: str, full_rescan: bool = False):
+    # full_rescan re-lists the whole folder; otherwise the cached S3 inventory is refreshed incrementally
     async_result = celery.send_task(
         "tasks.list_folder_and_enqueue",
-        args=(project_id, user_id),
+        args=(project_id, user_id, full_rescan),
         queue="folder_tasks",
     )
     return {"status": "Folder resyncing started.", "folder_task_id": async_result.id}
@@ -624,39 +825,63 @@ class PresignedURLRequest(BaseModel):
 @app.post("/get-presigned-urls")
 def get_presigned_url_to_upload(object_name:PresignedURLRequest):
     try:
-        presigned_urls = []
-        for object_name in object_name.object_names:
-            presigned_url = get_upload_presigned_url(bucket=_bucket_name, object_name=object_name)
-            presigned_urls.append(presigned_url)
+        presigned_urls = url_signer.sign_many(_bucket_name, object_name.object_names, expiration=3600, method="PUT")
+        s3_inventory.record_uploads(object_name.object_names)
         return {"status": "ok", "presigned_urls": presigned_urls}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate presigned URL: {str(e)}")
     
 
+S3_EVENTS_TOKEN = os.getenv("S3_EVENTS_TOKEN")
+SNS_HOST = re.compile(r"sns\.[a-z0-9-]+\.amazonaws\.com(\.cn)?")
+
+@app.post("/s3-events")
+async def s3_events(request: Request, token: str):
+    """
+    S3 event notifications (directly or wrapped in an SNS envelope) keep the
+    folder inventories current without listing. Disabled unless S3_EVENTS_TOKEN is set.
+    """
+    if not S3_EVENTS_TOKEN or token != S3_EVENTS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    payload = json.loads(await request.body())
+    # confirming the subscription and updating the inventories both block, so they run on the thread pool
+    return await run_in_threadpool(handle_s3_event, payload)
+
+def handle_s3_event(payload: dict) -> dict:
+    if payload.get("Type") == "SubscriptionConfirmation":
+        # the body is unsigned as far as we check, so only ever call back into SNS itself
+        subscribe_url = urlparse(payload.get("SubscribeURL", ""))
+        if subscribe_url.scheme != "https" or not SNS_HOST.fullmatch(subscribe_url.hostname or ""):
+            raise HTTPException(status_code=400, detail="SubscribeURL is not an SNS endpoint")
+        requests.get(subscribe_url.geturl(), timeout=10, allow_redirects=False)
+        return {"status": "subscribed"}
+    if payload.get("Type") == "Notification":
+        payload = json.loads(payload["Message"])
+
+    applied = 0
+    for record in payload.get("Records", []):
+        obj = record.get("s3", {}).get("object", {})
+        if not obj.get("key"):
+            continue
+        s3_inventory.apply_event(
+            unquote_plus(obj["key"]),
+            obj.get("size"),
+            obj.get("eTag"),
+            removed=record.get("eventName", "").startswith("ObjectRemoved"),
+        )
+        applied += 1
+    return {"status": "ok", "applied": applied}
+
 class FileNames(BaseModel): 
     file_names: List[str]
-import zipfile
 @app.post("/get-all-files-zip")
-async def download_all(file_names: FileNames):
-    # Create a buffer to store the ZIP file in memory
-    zip_buffer = BytesIO()
-
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for idx, file_key in enumerate(file_names.file_names):
-            try:
-                # Assuming file_key is a presigned URL
-                file_data = download_file_from_presigned_url(file_key)
-                file_name = os.path.basename(file_key.split("?")[0])
-                zip_file.writestr(file_name, file_data)  # Store using file name
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Error downloading file {file_key}: {str(e)}")
-
-    # Seek to the beginning of the BytesIO buffer for the response
-    zip_buffer.seek(0)
-
-    # Return the ZIP file as a StreamingResponse
+def download_all(file_names: FileNames):
+    # file_names are presigned URLs; members download concurrently and are
+    # streamed out as they arrive, so the archive never sits in server memory
+    if not file_names.file_names:
+        raise HTTPException(status_code=400, detail="No files requested")
     return StreamingResponse(
-        zip_buffer,
+        stream_zip(file_names.file_names),
         media_type="application/zip",
         headers={"Content-Disposition": "attachment; filename=files.zip"}
     )
@@ -3,22 +3,32 @@
 from celery_config import celery
 from contextlib import contextmanager
 import os
-import requests
+from http_client import download_bytes
 import numpy as np
 import cv2
 import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request as GoogleRequest
 from redisClient import redis_client
-from db import add_image, get_project, get_db, insert_faces, update_project_status_if_done, mark_image_processed, update_project_status, get_unprocessed_images
+import dispatcher
+import progress
+from inference import DecodedImage, decode_for_detection
+from embedding_cache import embedding_cache, content_hash
+from s3_inventory import s3_inventory
+from vector_index import maintain_after_ingest
+from clustering import cluster_embeddings
+from face_quality import gate_faces, FACE_QUALITY_GATE
+from db import add_images_bulk, get_project, get_db, save_processed_images, get_processed_image_ids, update_project_status_if_done, update_project_status, get_project_face_embeddings, replace_project_clusters
 from fastapi.responses import RedirectResponse
 from fastapi import HTTPException
 from googleapiclient.discovery import build
-from helpers import credentials_for_user, get_drive_images, create_thumbnail, download_file_from_presigned_url, process_image_from_bytes
+from helpers import credentials_for_user, get_drive_images, create_thumbnail_from_array, download_file_from_presigned_url, process_image_from_bytes, RAW_EXTENSIONS
 from sqlalchemy.exc import IntegrityError
 import os 
 from s3 import list_files_in_s3_folder, upload_file_to_s3_folder, generate_presigned_url, upload_file_to_s3_folder_memory, check_file_exists_in_s3_folder
-from constants import THUMBNAILS_GENERATED_KEY, TOTAL_IMAGES_KEY, TOTAL_THUMBNAILS_KEY, IMAGES_PROCESSED_KEY, PREPARING_IMAGE_COUNT, PREPARING_TOTAL_COUNT
+from constants import THUMBNAILS_GENERATED_KEY, TOTAL_IMAGES_KEY, TOTAL_THUMBNAILS_KEY, IMAGES_PROCESSED_KEY, PREPARING_IMAGE_COUNT, PREPARING_TOTAL_COUNT, PROJECT_FACES_VERSION_KEY, FACE_QUALITY_STATS_KEY
 
 _project_folder_namespace = "project_folder"
 _bucket_name = "researchconclave"
@@ -52,64 +62,250 @@ def ensure_model():
         fa = FaceAnalysis(allowed_modules=["detection", "recognition"], providers=[ 'CPUExecutionProvider','CUDAExecutionProvider'])
         fa.prepare(ctx_id=ctx_id, det_size=det_size)
 
+# batched engine wrapping the lazy-loaded model
+engine = None
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+REGISTER_BATCH_SIZE = int(os.getenv("REGISTER_BATCH_SIZE", "1000"))
+# "image": one transaction per image; "batch": one transaction (and one multi-row insert) per inference group
+FACE_WRITE_MODE = os.getenv("FACE_WRITE_MODE", "image")
+
+def ensure_engine():
+    global engine
+    if engine is None:
+        ensure_model()
+        from inference import FaceBatchEngine
+        engine = FaceBatchEngine(fa)
+
 def download_image(download_url: str, access_token: str | None) -> np.ndarray:
     headers = {}
     if access_token:
         headers["Authorization"] = f"Bearer {access_token}"
-    resp = requests.get(download_url, headers=headers)
-    resp.raise_for_status()
-    img_array = np.frombuffer(resp.content, np.uint8)
+    img_array = np.frombuffer(download_bytes(download_url, headers=headers), np.uint8)
     img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
     return img
 
-@celery.task(name="tasks.process_image")
-def process_image(image_id: str, download_url: str, project_id: str):
-    try:
-        presigned_url = generate_presigned_url(bucket=_bucket_name, object_name=download_url, expiration=3600)
-        img_bytes = download_file_from_presigned_url(presigned_url)
+def load_image_for_inference(download_url: str, need_pixels: bool = True) -> DecodedImage | None:
+    """
+    download an S3 object, convert RAW formats and decode it at detection resolution.
+    need_pixels=False (faces only, no thumbnail): a file whose faces are already cached
+    comes back without RAW conversion or decode, carrying just the cached faces.
+    """
+    presigned_url = generate_presigned_url(bucket=_bucket_name, object_name=download_url, expiration=3600)
+    img_bytes = download_file_from_presigned_url(presigned_url)
+    # hash the original bytes so identical uploads share cached faces
+    digest = content_hash(img_bytes)
+    cached = embedding_cache.get(digest)
+    if cached is not None and not need_pixels:
+        skipped = DecodedImage(None)
+        skipped.content_hash = digest
+        skipped.cached_faces = cached
+        return skipped
 
-        # Fix: Use correct variable name
-        ext = download_url.split("/")[-1].split(".")[-1].lower()
-        if ext in ['arw', 'nef', 'cr2', 'raw', 'dng', 'rw2']:
-            img_bytes = process_image_from_bytes(img_bytes)  # Fix: use img_bytes
+    ext = download_url.split("/")[-1].split(".")[-1].lower()
+    if ext in RAW_EXTENSIONS:
+        img_bytes = process_image_from_bytes(img_bytes)
 
-        img_array = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-        ensure_model()
-        faces = fa.get(img)
-        
+    decoded = decode_for_detection(img_bytes)
+    if decoded is not None:
+        decoded.content_hash = digest
+        decoded.cached_faces = cached
+    return decoded
+
+
+def image_recorded(image_id: str, project_id: str, kept: int, rejected: dict):
+    "Redis-side bookkeeping once an image's faces are committed: quality stats, search cache version, progress"
+    # in log mode the gate only reports what it would have dropped; those faces are indexed too
+    dropped = "filtered" if FACE_QUALITY_GATE == "enforce" else "would_filter"
+    redis_client.increment_hash(f"{FACE_QUALITY_STATS_KEY}:{project_id}", {
+        "indexed": kept,
+        dropped: sum(rejected.values()),
+        **{f"{dropped}_{reason}": count for reason, count in rejected.items()},
+    })
+    # lets in-memory search matrices in the API server pick up the new faces
+    redis_client.increment(f"{PROJECT_FACES_VERSION_KEY}:{project_id}")
+
+    # atomic increment + completion check, so exactly one worker finishes the project
+    processed, total, completed = progress.image_done(project_id)
+    print(f"Image {image_id} processed. Progress: {processed}/{total}")
+
+    if completed:
+        print("Project Completed. Updating status.")
         with get_session() as db:
-            faces_data = []
-            for i, f in enumerate(faces, start=1):
-                faces_data.append({
-                    "face_index": i,
-                    "bbox": list(map(int, f.bbox)),
-                    "embedding": f.embedding
-                })
-            
-            if faces_data:
-                insert_faces(db=db, image_id=image_id, faces=faces_data)
-
-           
-            mark_image_processed(db, image_id)
-            redis_client.increment(f"{IMAGES_PROCESSED_KEY}:{project_id}")
-           
-            processed_str = redis_client.get_key(f'{IMAGES_PROCESSED_KEY}:{project_id}')
-            total_str = redis_client.get_key(f'{TOTAL_IMAGES_KEY}:{project_id}')
-            
-            processed = int(processed_str) if processed_str else 0
-            total = int(total_str) if total_str else 0
-            
-            print(f"Image {image_id} processed. Progress: {processed}/{total}")
+            update_project_status(db, project_id, "completed")
+        celery.send_task("tasks.maintain_face_index", queue="folder_tasks")
+        celery.send_task("tasks.cluster_project_faces", args=[project_id], queue="folder_tasks")
+
+
+def record_images_processed(results: list):
+    """
+    results: list of (image_id, project_id, faces_data)
+    Gates each image's faces, then writes faces and the processed flag in one
+    transaction per image, or in one transaction for the whole group when
+    FACE_WRITE_MODE is "batch". A failed batch falls back to per-image writes
+    so one bad image can't hold back the rest.
+    """
+    gated = []
+    for image_id, project_id, faces_data in results:
+        kept, rejected = gate_faces(faces_data or [])
+        gated.append((image_id, project_id, kept, rejected))
+
+    if FACE_WRITE_MODE == "batch" and len(gated) > 1:
+        try:
+            with get_session() as db:
+                save_processed_images(db, [(image_id, kept) for image_id, _, kept, _ in gated])
+        except Exception as e:
+            print(f"Batched face write failed, writing images one at a time: {e}")
+        else:
+            for image_id, project_id, kept, rejected in gated:
+                image_recorded(image_id, project_id, len(kept), rejected)
+            return
+
+    for image_id, project_id, kept, rejected in gated:
+        try:
+            with get_session() as db:
+                save_processed_images(db, [(image_id, kept)])
+            image_recorded(image_id, project_id, len(kept), rejected)
+        except Exception as e:
+            print("Error processing image:", e)
+
+
+def load_images_concurrently(download_urls: list, need_pixels: bool = True) -> list:
+    "load a group of images in parallel, failed downloads/decodes come back as None"
+    def _load(download_url):
+        try:
+            return load_image_for_inference(download_url, need_pixels=need_pixels)
+        except Exception as e:
+            print(f"Failed to load image {download_url}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(download_urls), DOWNLOAD_WORKERS))) as pool:
+        return list(pool.map(_load, download_urls))
+
+
+def run_inference_and_record(items: list, images: list):
+    """
+    items: list of (image_id, project_id), aligned with the decoded images
+    Runs the group through the batched engine and writes the faces back per image.
+    """
+    results = [None] * len(images)
+    misses = []
+    for idx, img in enumerate(images):
+        # looked up right after the download, before any RAW conversion or decode
+        cached = img.cached_faces if img is not None else None
+        if cached is not None:
+            results[idx] = cached
+        else:
+            misses.append(idx)
+    if len(misses) < len(images):
+        print(f"Embedding cache hits: {len(images) - len(misses)}/{len(images)}")
+
+    if misses:
+        ensure_engine()
+        for idx, faces in zip(misses, engine.run([images[idx] for idx in misses])):
+            results[idx] = faces
+            if images[idx] is not None and images[idx].content_hash:
+                embedding_cache.put(images[idx].content_hash, faces)
+
+    # images that failed to load stay unprocessed so a resync picks them up again
+    record_images_processed([
+        (image_id, project_id, faces)
+        for (image_id, project_id), img, faces in zip(items, images, results)
+        if img is not None
+    ])
+
+
+def upload_thumbnail(img: np.ndarray, download_url: str, project_drive_folder: str, image_id: str, project_id: str):
+    "build the thumbnail from an already decoded image, upload it and bump the thumbnail counter"
+    thumbnail = create_thumbnail_from_array(img)
+
+    base_name = download_url.split("/")[-1]
+    thumbnail_name = f"{base_name}_thumbnail.jpg"
+
+    if not check_file_exists_in_s3_folder(
+        bucket=_bucket_name,
+        folder_path=f"thumbnails/{project_drive_folder}",
+        object_name=thumbnail_name
+    ):
+        upload_file_to_s3_folder_memory(
+            file_content=thumbnail,
+            object_name=thumbnail_name,
+            bucket=_bucket_name,
+            folder_path=f"thumbnails/{project_drive_folder}"
+        )
+
+    print("Uploaded thumbnail for image", image_id)
+    progress.thumbnail_done(project_id)
+
+
+@celery.task(name="tasks.process_image_batch")
+def process_image_batch(items: list):
+    """
+    items: list of (image_id, download_url, project_id)
+    Downloads and decodes the whole group concurrently, runs it through the
+    batched inference engine and writes the faces back per image.
+    """
+    if not items:
+        return
+    started = time.perf_counter()
 
-            # Fix: Use correct processed value after increment
-            if total > 0 and processed >= total:
-                print("Project Completed. Updating status.")
-                update_project_status(db, project_id, "completed")
-                # Ensure final counts are correct
-                redis_client.set_key(f"{IMAGES_PROCESSED_KEY}:{project_id}", total)
-                redis_client.set_key(f"{THUMBNAILS_GENERATED_KEY}:{project_id}", total)
+    # no thumbnails here, so files whose faces are cached skip RAW conversion and decode too
+    images = load_images_concurrently([item[1] for item in items], need_pixels=False)
+    run_inference_and_record([(item[0], item[2]) for item in items], images)
 
+    elapsed = time.perf_counter() - started
+    print(f"Processed batch of {len(items)} images in {elapsed:.2f}s ({len(items) / elapsed:.2f} images/sec)")
+
+
+@celery.task(name="tasks.ingest_image_batch")
+def ingest_image_batch(items: list, lease: str | None = None):
+    """
+    items: list of (image_id, download_url, project_drive_folder, project_id)
+    lease: the dispatch window slot this message holds
+    Fused pipeline stage: every image is fetched and decoded once, and that one
+    buffer produces both the thumbnail and the face embeddings.
+    """
+    if not items:
+        return
+    started = time.perf_counter()
+    project_id = items[0][3]
+
+    try:
+        # a requeued chunk (its first worker died or overran the lease) may be partly done already
+        with get_session() as db:
+            done = get_processed_image_ids(db, [item[0] for item in items])
+        if done:
+            print(f"Skipping {len(done)} images of the batch that are already processed")
+            items = [item for item in items if item[0] not in done]
+        images = load_images_concurrently([item[1] for item in items])
+
+        for (image_id, download_url, project_drive_folder, project_id), img in zip(items, images):
+            if img is None:
+                continue
+            try:
+                upload_thumbnail(img.img, download_url, project_drive_folder, image_id, project_id)
+            except Exception as e:
+                print(f"Failed to generate thumbnail for {download_url}: {e}")
+
+        run_inference_and_record([(item[0], item[3]) for item in items], images)
+    finally:
+        # free this batch's dispatch slot even if it failed, otherwise the project stalls
+        dispatcher.batch_done(project_id, lease)
+
+    elapsed = time.perf_counter() - started
+    print(f"Ingested batch of {len(items)} images in {elapsed:.2f}s ({len(items) / elapsed:.2f} images/sec)")
+
+
+@celery.task(name="tasks.process_image")
+def process_image(image_id: str, download_url: str, project_id: str):
+    """
+    Single-image entry point kept for messages sent by the per-image flow
+    (generate_thumbnail). Nothing enqueues that flow any more (list_folder_and_enqueue
+    dispatches chunks to ingest_image_batch), so this only drains messages queued
+    before the upgrade. They run as a group of one; batched inference depends on
+    chunked dispatch (DISPATCH_CHUNK_SIZE).
+    """
+    try:
+        process_image_batch([(image_id, download_url, project_id)])
     except Exception as e:
         print("Error processing image:", e)
 
@@ -117,38 +313,12 @@ def process_image(image_id: str, download_url: str, project_id: str):
 @celery.task(name="tasks.generate_thumbnail")
 def generate_thumbnail(image_id: str, download_url: str, project_drive_folder: str, project_id: str):
     try:
-        download_presigned_url = generate_presigned_url(bucket=_bucket_name, object_name=download_url)
-        img_content = download_file_from_presigned_url(download_presigned_url)
-
-        ext = download_url.split("/")[-1].split(".")[-1].lower()
-        if ext in ['arw', 'nef', 'cr2', 'raw', 'dng', 'rw2']:
-            img_content = process_image_from_bytes(img_content)
-
-        thumbnail = create_thumbnail(img_content)
-        
-        # Fix: Use consistent thumbnail naming
-        base_name = download_url.split("/")[-1]
-        thumbnail_name = f"{base_name}_thumbnail.jpg"
-        
-        if not check_file_exists_in_s3_folder(
-            bucket=_bucket_name, 
-            folder_path=f"thumbnails/{project_drive_folder}", 
-            object_name=thumbnail_name
-        ):
-            upload_file_to_s3_folder_memory(
-                file_content=thumbnail, 
-                object_name=thumbnail_name,
-                bucket=_bucket_name,
-                folder_path=f"thumbnails/{project_drive_folder}"
-            )
-            
-        print("Uploaded thumbnail for image", image_id)
-        redis_client.increment(f"{THUMBNAILS_GENERATED_KEY}:{project_id}")
+        img = load_image_for_inference(download_url)
+        upload_thumbnail(img.img, download_url, project_drive_folder, image_id, project_id)
         
         # Debug: Show current progress
-        thumb_count = redis_client.get_key(f'{THUMBNAILS_GENERATED_KEY}:{project_id}')
-        total_count = redis_client.get_key(f'{TOTAL_THUMBNAILS_KEY}:{project_id}')
-        print(f"Thumbnail Progress: {thumb_count}/{total_count}")
+        counters = progress.get_progress(project_id)
+        print(f"Thumbnail Progress: {counters[THUMBNAILS_GENERATED_KEY]}/{counters[TOTAL_THUMBNAILS_KEY]}")
             
         async_result = celery.send_task(
             "tasks.process_image",
@@ -162,7 +332,7 @@ def generate_thumbnail(image_id: str, download_url: str, project_drive_folder: s
 
 
 @celery.task(name="tasks.list_folder_and_enqueue")
-def list_folder_and_enqueue(project_id: str, user_id: str):
+def list_folder_and_enqueue(project_id: str, user_id: str, full_rescan: bool = False):
     """
     Orchestrator worker: reads Image rows for project_id (created earlier by server),
     refreshes user's Google access token, and enqueues process_image tasks to image_tasks queue.
@@ -177,75 +347,105 @@ def list_folder_and_enqueue(project_id: str, user_id: str):
         try:
             update_project_status(db=db, project_id=project_id, status="processing")
             print("Marked project as processing")
-            images = list_files_in_s3_folder(bucket=_bucket_name, folder_path=proj.drive_folder_id)
+            images = s3_inventory.keys(proj.drive_folder_id, force_full=full_rescan)
 
          
             # get the list of images already in db to avoid duplicates
-            # use object key as drive_file_id
-            db_images = db.query(Image.drive_file_id).filter(Image.project_id == project_id).all()
+            # use object key as drive_file_id; the same query gives us the unprocessed ones to re-enqueue
+            db_images = db.query(Image.id, Image.drive_file_id, Image.processed).filter(Image.project_id == project_id).all()
             existing_drive_file_ids = set([img.drive_file_id for img in db_images])
-            unprocessed_count = len(images) - len(existing_drive_file_ids)
-            # print(existing_drive_file_ids)
-            redis_client.set_key(f"{PREPARING_TOTAL_COUNT}:{project_id}", str(unprocessed_count))
-            redis_client.set_key(f"{PREPARING_IMAGE_COUNT}:{project_id}", '0')
-            for img in images:
-                try:
-                    # deduplication check 
-                    if img in existing_drive_file_ids:
-                        continue
-                                       
-
-                    add_image(
-                        db=db,
-                        project_id=project_id,
-                        drive_file_id=img,
-                        name=img,
-                        mime_type="",
-                        download_url="",
-                        thumbnail_link="",
-                    )
-
-                    print("Added image to DB: ", img)
-                    redis_client.increment(f"{PREPARING_IMAGE_COUNT}:{project_id}")
-                    print(f"Preparing images for processing: {redis_client.get_key(f"{PREPARING_IMAGE_COUNT}:{project_id}")}/{redis_client.get_key(f"{PREPARING_TOTAL_COUNT}:{project_id}")}")
-
-                except IntegrityError as e:
-                    db.rollback()
-                    # image already exists, skip
-                    continue
-
-            # now get all unprocessed images from the db and put them on the processing queue 
-            unprocessed_db_images = get_unprocessed_images(db=db, project_id=project_id)
+            new_keys = [img for img in dict.fromkeys(images) if img not in existing_drive_file_ids]
+
+            progress.start_preparing(project_id, len(new_keys))
+
+            prepared = 0
+            def _on_batch(count: int):
+                nonlocal prepared
+                prepared += count
+                progress.set_prepared(project_id, prepared)
+                print(f"Preparing images for processing: {prepared}/{len(new_keys)}")
+
+            inserted = add_images_bulk(
+                db=db,
+                project_id=project_id,
+                drive_file_ids=new_keys,
+                batch_size=REGISTER_BATCH_SIZE,
+                on_batch=_on_batch,
+            )
+
+            # everything we just inserted plus rows left unprocessed by an earlier run
+            unprocessed_db_images = [(img.id, img.drive_file_id) for img in db_images if not img.processed] + inserted
 
 
             if len(unprocessed_db_images) == 0:
                 update_project_status(db=db, project_id=project_id, status="completed")
                 print("0 images found in project, marking it processed!")
 
-               # set stats in redis 
-            redis_client.set_key(f"{TOTAL_IMAGES_KEY}:{project_id}", len(unprocessed_db_images))
-            redis_client.set_key(f"{TOTAL_THUMBNAILS_KEY}:{project_id}", len(unprocessed_db_images))
-            redis_client.set_key(f"{THUMBNAILS_GENERATED_KEY}:{project_id}", 0)
-            redis_client.set_key(f"{IMAGES_PROCESSED_KEY}:{project_id}", 0)
-            
-            for img in unprocessed_db_images:
-                try:
-                    async_result = celery.send_task(
-                            "tasks.generate_thumbnail",
-                            args=(
-                                img.id,
-                                img.drive_file_id,
-                                proj.drive_folder_id,
-                                project_id
-                                )
-                            )
-                    print(f"Enqueued image {img.drive_file_id} for thumbnail generation task id: {async_result.id}")
-                except Exception as e:
-                    print(f"Failed to enqueue image {img.drive_file_id}: {e}")
-                    continue
-                
+            # set stats in redis
+            progress.start_processing(project_id, len(unprocessed_db_images))
             
-            return {"status": "ok", "count": len(unprocessed_db_images), "images": unprocessed_db_images}
+            # one message per DISPATCH_CHUNK_SIZE images, with at most DISPATCH_WINDOW of them
+            # outstanding per project; finished batches top the window back up
+            sent = dispatcher.start_project(project_id, [
+                (image_id, drive_file_id, proj.drive_folder_id, project_id)
+                for image_id, drive_file_id in unprocessed_db_images
+            ])
+            print(f"Dispatched {sent} batches for project {project_id}, {dispatcher.pending_chunks(project_id)} waiting")
+
+            return {"status": "ok", "count": len(unprocessed_db_images), "images": [image_id for image_id, _ in unprocessed_db_images]}
         except Exception as e:
             print("Error: ", e)
-            
\ No newline at end of file
+
+
+@celery.task(name="tasks.sweep_dispatch")
+def sweep_dispatch():
+    "beat task: requeue lapsed dispatch chunks and refill every project's window"
+    try:
+        sent = dispatcher.sweep()
+        if sent:
+            print(f"Dispatch sweep sent {sent} batches")
+    except Exception as e:
+        print(f"Dispatch sweep failed: {e}")
+
+
+@celery.task(name="tasks.maintain_face_index")
+def maintain_face_index():
+    "refresh planner stats, and rebuild ivfflat lists once faces has grown enough, after a bulk ingest"
+    try:
+        result = maintain_after_ingest()
+        print(f"Face index maintenance: {result}")
+    except Exception as e:
+        print(f"Face index maintenance failed: {e}")
+
+
+@celery.task(name="tasks.cluster_project_faces")
+def cluster_project_faces(project_id: str):
+    "group a completed project's faces into person identities for centroid-first search and people browsing"
+    started = time.time()
+    with get_session() as db:
+        try:
+            rows = get_project_face_embeddings(db, project_id)
+            if not rows:
+                print(f"No faces to cluster for project {project_id}")
+                return
+            face_ids = [r[0] for r in rows]
+            image_ids = [r[1] for r in rows]
+            embeddings = np.asarray([r[2] for r in rows], dtype=np.float32)
+            labels, centroids = cluster_embeddings(embeddings)
+
+            # cover face: the member closest to its centroid
+            normed = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            sims = np.einsum("ij,ij->i", normed, centroids[labels])
+            best = np.full(len(centroids), -2.0, dtype=np.float32)
+            cover = [0] * len(centroids)
+            for i, (label, sim) in enumerate(zip(labels.tolist(), sims.tolist())):
+                if sim > best[label]:
+                    best[label] = sim
+                    cover[label] = face_ids[i]
+
+            count = replace_project_clusters(
+                db, project_id, face_ids, image_ids, labels.tolist(), centroids.tolist(), cover,
+            )
+            print(f"Clustered {len(face_ids)} faces into {count} people for project {project_id} in {time.time() - started:.1f}s")
+        except Exception as e:
+            print(f"Clustering failed for project {project_id}: {e}")
@@ -0,0 +1,133 @@
+# fast, cached S3 presigned urls for the request path
+import datetime
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+from s3 import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, s3_config, s3_client
+
+# a cached url is handed out only while it still has at least this long to live
+PRESIGN_CACHE_MARGIN = int(os.getenv("PRESIGN_CACHE_MARGIN", "600"))
+PRESIGN_CACHE_MAX_ENTRIES = int(os.getenv("PRESIGN_CACHE_MAX_ENTRIES", "200000"))
+AWS_SESSION_TOKEN = os.getenv("AWS_SESSION_TOKEN")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+
+
+def _uri_encode(value: str, safe: str = "") -> str:
+    "SigV4 encoding: everything but unreserved characters (and `safe`) percent-encoded"
+    return quote(value, safe=safe + "-_.~")
+
+
+class UrlSigner:
+    """
+    SigV4 query-string signing with the static credentials resolved once at import.
+    The derived signing key is cached per UTC day, so each url is one sha256 and
+    one HMAC instead of a trip through botocore's event and endpoint machinery.
+
+    GET urls are cached per (bucket, key) and reused until PRESIGN_CACHE_MARGIN
+    before they expire, which also keeps urls stable so browsers can cache
+    thumbnails across searches. Upload (PUT) urls are signed fresh every time:
+    they grant write access, so each caller gets its own full expiry window.
+    """
+
+    def __init__(self, access_key: str, secret_key: str, region: str, session_token: str | None = None,
+                 max_entries: int = PRESIGN_CACHE_MAX_ENTRIES, margin: int = PRESIGN_CACHE_MARGIN):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.session_token = session_token
+        self.max_entries = max_entries
+        self.margin = margin
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._signing_key = (None, None)
+
+    def _key_for(self, datestamp: str) -> bytes:
+        day, key = self._signing_key
+        if day != datestamp:
+            key = hmac.new(("AWS4" + self.secret_key).encode(), datestamp.encode(), hashlib.sha256).digest()
+            for part in (self.region, "s3", "aws4_request"):
+                key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+            self._signing_key = (datestamp, key)
+        return key
+
+    def _boto_sign(self, method: str, bucket: str, key: str, expiration: int) -> str | None:
+        client_method = "put_object" if method == "PUT" else "get_object"
+        try:
+            return s3_client.generate_presigned_url(client_method, Params={"Bucket": bucket, "Key": key}, ExpiresIn=expiration)
+        except Exception as e:
+            print(f"Failed to generate presigned URL for {bucket}/{key}: {e}")
+            return None
+
+    def _sign(self, method: str, bucket: str, key: str, expiration: int, now: datetime.datetime) -> str | None:
+        if S3_ENDPOINT_URL or "." in bucket:
+            # custom endpoints and dotted bucket names need botocore's addressing rules
+            return self._boto_sign(method, bucket, key, expiration)
+
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        datestamp = amz_date[:8]
+        scope = f"{datestamp}/{self.region}/s3/aws4_request"
+        host = f"{bucket}.s3.{self.region}.amazonaws.com"
+        path = "/" + _uri_encode(key, safe="/")
+
+        params = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expiration),
+            "X-Amz-SignedHeaders": "host",
+        }
+        if self.session_token:
+            params["X-Amz-Security-Token"] = self.session_token
+        query = "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in sorted(params.items()))
+
+        canonical = f"{method}\n{path}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+        to_sign = f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n{hashlib.sha256(canonical.encode()).hexdigest()}"
+        signature = hmac.new(self._key_for(datestamp), to_sign.encode(), hashlib.sha256).hexdigest()
+        return f"https://{host}{path}?{query}&X-Amz-Signature={signature}"
+
+    def sign_many(self, bucket: str, keys: list, expiration: int = 3600, method: str = "GET") -> list:
+        "presigned urls for keys, in order; cached GET urls are reused, the rest signed in one pass"
+        wall = time.time()
+        urls = [None] * len(keys)
+        if method != "GET":
+            now = datetime.datetime.fromtimestamp(int(wall), datetime.timezone.utc)
+            return [self._sign(method, bucket, key, expiration, now) for key in keys]
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._cache.get((method, bucket, key))
+                if entry is not None and entry[1] - self.margin > wall:
+                    self._cache.move_to_end((method, bucket, key))
+                    urls[i] = entry[0]
+                else:
+                    missing.append(i)
+        if not missing:
+            return urls
+
+        # cache entries shorter than the margin would never be served again
+        cacheable = expiration > self.margin
+        now = datetime.datetime.fromtimestamp(int(wall), datetime.timezone.utc)
+        signed = []
+        for i in missing:
+            url = self._sign(method, bucket, keys[i], expiration, now)
+            urls[i] = url
+            if url is not None and cacheable:
+                signed.append(((method, bucket, keys[i]), (url, int(wall) + expiration)))
+        if signed:
+            with self._lock:
+                for cache_key, entry in signed:
+                    self._cache[cache_key] = entry
+                    self._cache.move_to_end(cache_key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return urls
+
+    def sign(self, bucket: str, key: str, expiration: int = 3600, method: str = "GET") -> str | None:
+        return self.sign_many(bucket, [key], expiration, method)[0]
+
+
+url_signer = UrlSigner(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, s3_config.region_name, AWS_SESSION_TOKEN)
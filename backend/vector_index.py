@@ -0,0 +1,263 @@
+# build, tune and maintain the ANN index on faces.embedding
+import os
+import numpy as np
+from sqlalchemy import text, cast
+from sqlalchemy.orm import Session
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
+from models import engine, Face
+from redisClient import redis_client
+
+FACE_INDEX_NAME = "ix_faces_embedding_hnsw"
+IVFFLAT_INDEX_NAME = "ix_faces_embedding_ivfflat"
+FACE_INDEX_METHOD = os.getenv("FACE_INDEX_METHOD", "hnsw")  # hnsw | ivfflat
+# floor for the HNSW candidate list; set_search_params raises it to each query's LIMIT,
+# since an HNSW scan never returns more than ef_search rows
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+HNSW_EF_SEARCH_MAX = 1000  # pgvector rejects anything larger
+# filters (project, page cursor, clusters) apply after the index scan. pgvector >= 0.8 keeps
+# scanning until enough rows pass them (relaxed_order, or strict_order for hnsw). "off" is for
+# older servers: filtered queries then get the widest candidate list the index allows instead
+ANN_ITERATIVE_SCAN = os.getenv("ANN_ITERATIVE_SCAN", "relaxed_order")
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+# ivfflat centroids go stale as rows are added; rebuild once the table has grown by this factor
+IVFFLAT_REBUILD_GROWTH = float(os.getenv("IVFFLAT_REBUILD_GROWTH", "2.0"))
+INDEX_BUILD_MEM = os.getenv("INDEX_BUILD_MEM", "1GB")
+
+# vector: float32 faces.embedding only
+# dual: also write embedding_half/embedding_bits (while backfilling, before switching reads)
+# halfvec: write and read embedding_half + embedding_bits, faces.embedding left NULL
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "vector")
+# binary: hamming pre-filter on embedding_bits, exact cosine re-rank of the survivors
+SEARCH_QUANTIZATION = os.getenv("SEARCH_QUANTIZATION", "none")  # none | binary
+BINARY_RERANK_FACTOR = int(os.getenv("BINARY_RERANK_FACTOR", "8"))
+if SEARCH_QUANTIZATION == "binary" and EMBEDDING_STORAGE == "vector":
+    # embedding_bits is never written in vector mode, so every binary search would come back empty
+    raise RuntimeError(
+        "SEARCH_QUANTIZATION=binary needs EMBEDDING_STORAGE=dual or halfvec "
+        "(and `manage_index compact` run to backfill embedding_bits)"
+    )
+COMPACT_BACKFILL_BATCH = int(os.getenv("COMPACT_BACKFILL_BATCH", "10000"))
+HALF_INDEX_NAME = "ix_faces_embedding_half_hnsw"
+BITS_INDEX_NAME = "ix_faces_embedding_bits_hnsw"
+
+_index_rows_key = "face_index_rows"
+
+
+def index_name(method: str = FACE_INDEX_METHOD) -> str:
+    return FACE_INDEX_NAME if method == "hnsw" else IVFFLAT_INDEX_NAME
+
+
+def ivfflat_lists(rows: int) -> int:
+    "pgvector's guidance: rows/1000 up to 1M rows, sqrt(rows) above"
+    if rows <= 1_000_000:
+        return max(10, rows // 1000)
+    return int(rows ** 0.5)
+
+
+def binary_signature(embedding) -> str:
+    "sign bits of the embedding as a bit string, the same as pgvector's binary_quantize()"
+    return "".join("1" if x > 0 else "0" for x in np.asarray(embedding, dtype=np.float32).ravel())
+
+
+def stored_bytes_per_face() -> int:
+    "approximate heap + HNSW index bytes one face's vectors cost under the storage mode"
+    float_bytes = 4 * 512 + 8
+    compact_bytes = (2 * 512 + 8) + (512 // 8 + 8)
+    if EMBEDDING_STORAGE == "halfvec":
+        per_copy = compact_bytes
+    elif EMBEDDING_STORAGE == "dual":
+        per_copy = float_bytes + compact_bytes
+    else:
+        per_copy = float_bytes
+    # the HNSW graph keeps its own copy of each vector next to the neighbour lists
+    return per_copy * 2 + 16 * 2 * 6
+
+
+def embedding_columns(embedding) -> dict:
+    "Face column values for one embedding under the configured storage mode"
+    if embedding is None:
+        return {"embedding": None}
+    columns = {}
+    if EMBEDDING_STORAGE != "halfvec":
+        columns["embedding"] = embedding
+    if EMBEDDING_STORAGE in ("dual", "halfvec"):
+        columns["embedding_half"] = embedding
+        columns["embedding_bits"] = binary_signature(embedding)
+    return columns
+
+
+def stored_embedding(face=Face):
+    "full-precision column to read embeddings back from, as a vector"
+    if EMBEDDING_STORAGE == "halfvec":
+        return cast(face.embedding_half, Vector(512))
+    return face.embedding
+
+
+def cosine_distance(query_embedding, face=Face):
+    "cosine distance expression that matches the ANN index of the storage mode"
+    values = np.asarray(query_embedding, dtype=np.float32).tolist()
+    if EMBEDDING_STORAGE == "halfvec":
+        return face.embedding_half.cosine_distance(cast(values, HALFVEC(512)))
+    return face.embedding.cosine_distance(cast(values, Vector(512)))
+
+
+def hamming_distance(query_embedding, face=Face):
+    return face.embedding_bits.hamming_distance(cast(binary_signature(query_embedding), BIT(512)))
+
+
+def set_search_params(db: Session, ef_search: int | None = None, probes: int | None = None,
+                      limit: int | None = None, filtered: bool = False):
+    """
+    Per-query recall/latency knobs. SET LOCAL only lasts until the current
+    transaction ends, so it never leaks to other users of the pooled connection.
+
+    limit: the LIMIT the query will ask the index for. ef_search is raised to it
+    (capped at HNSW_EF_SEARCH_MAX), otherwise the scan silently returns fewer rows.
+    filtered: the query drops rows after the index scan; see ANN_ITERATIVE_SCAN.
+    """
+    iterative = ANN_ITERATIVE_SCAN != "off" and (filtered or (limit is not None and limit > HNSW_EF_SEARCH_MAX))
+    if ef_search is not None:
+        if limit is not None:
+            ef_search = max(ef_search, limit)
+        if filtered and not iterative:
+            # no iterative scan to fall back on: give the filter as many rows as the index can return
+            ef_search = HNSW_EF_SEARCH_MAX
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {min(int(ef_search), HNSW_EF_SEARCH_MAX)}"))
+    if probes is not None:
+        db.execute(text(f"SET LOCAL ivfflat.probes = {int(probes)}"))
+    if iterative:
+        db.execute(text(f"SET LOCAL hnsw.iterative_scan = {ANN_ITERATIVE_SCAN}"))
+        if FACE_INDEX_METHOD == "ivfflat":
+            db.execute(text("SET LOCAL ivfflat.iterative_scan = relaxed_order"))
+
+
+def count_faces(conn) -> int:
+    return conn.execute(text("SELECT count(*) FROM faces")).scalar() or 0
+
+
+def build_index(method: str = FACE_INDEX_METHOD, m: int = 16, ef_construction: int = 64, lists: int | None = None):
+    "create the index CONCURRENTLY (faces stays writable), dropping the other method's index"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        rows = count_faces(conn)
+        conn.execute(text(f"SET maintenance_work_mem = '{INDEX_BUILD_MEM}'"))
+        if method == "hnsw":
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {FACE_INDEX_NAME} ON faces "
+                f"USING hnsw (embedding vector_cosine_ops) WITH (m = {int(m)}, ef_construction = {int(ef_construction)})"
+            ))
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {IVFFLAT_INDEX_NAME}"))
+        else:
+            lists = lists or ivfflat_lists(rows)
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {IVFFLAT_INDEX_NAME} ON faces "
+                f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {int(lists)})"
+            ))
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {FACE_INDEX_NAME}"))
+        conn.execute(text("ANALYZE faces"))
+    redis_client.set_key(_index_rows_key, str(rows), exp=None)
+    print(f"Built {method} index on faces ({rows} rows)")
+
+
+def reindex(method: str = FACE_INDEX_METHOD):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        rows = count_faces(conn)
+        conn.execute(text(f"REINDEX INDEX CONCURRENTLY {index_name(method)}"))
+        conn.execute(text("ANALYZE faces"))
+    redis_client.set_key(_index_rows_key, str(rows), exp=None)
+    print(f"Reindexed {index_name(method)} ({rows} rows)")
+
+
+def maintain_after_ingest(method: str = FACE_INDEX_METHOD) -> str:
+    """
+    Called after bulk ingestion. HNSW is maintained incrementally, so only the
+    planner statistics are refreshed; ivfflat is rebuilt once the table has grown
+    past IVFFLAT_REBUILD_GROWTH since the last build so its lists stay balanced.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        rows = count_faces(conn)
+        conn.execute(text("ANALYZE faces"))
+    if method != "ivfflat":
+        return "analyzed"
+    built_rows = int(redis_client.get_key(_index_rows_key) or 0)
+    if built_rows == 0 or rows >= built_rows * IVFFLAT_REBUILD_GROWTH:
+        # resize the lists for the new row count and recluster without dropping the index
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"ALTER INDEX {IVFFLAT_INDEX_NAME} SET (lists = {ivfflat_lists(rows)})"))
+        reindex("ivfflat")
+        return "rebuilt"
+    return "analyzed"
+
+
+def index_status() -> dict:
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT indexrelid::regclass::text AS name, pg_relation_size(indexrelid) AS bytes, indisvalid AS valid "
+            "FROM pg_index WHERE indrelid = 'faces'::regclass"
+        )).all()
+        faces = count_faces(conn)
+    return {
+        "faces": faces,
+        "indexes": [{"name": r.name, "bytes": r.bytes, "valid": r.valid} for r in rows],
+        "rows_at_last_build": int(redis_client.get_key(_index_rows_key) or 0),
+    }
+
+
+def backfill_compact(batch: int = COMPACT_BACKFILL_BATCH) -> int:
+    "fill embedding_half/embedding_bits for rows written before the compact columns existed"
+    total = 0
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        while True:
+            updated = conn.execute(text(
+                "UPDATE faces SET embedding_half = embedding::halfvec(512), "
+                "embedding_bits = binary_quantize(embedding)::bit(512) "
+                "WHERE id IN (SELECT id FROM faces WHERE embedding_half IS NULL AND embedding IS NOT NULL "
+                "ORDER BY id LIMIT :batch)"
+            ), {"batch": batch}).rowcount
+            total += updated
+            if updated:
+                print(f"Backfilled {total} faces")
+            if updated < batch:
+                break
+    return total
+
+
+def build_compact_indexes(m: int = 16, ef_construction: int = 64):
+    "HNSW on the halfvec column for re-ranking-free search, and on the bit signature for hamming pre-filtering"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"SET maintenance_work_mem = '{INDEX_BUILD_MEM}'"))
+        conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {HALF_INDEX_NAME} ON faces "
+            f"USING hnsw (embedding_half halfvec_cosine_ops) WITH (m = {int(m)}, ef_construction = {int(ef_construction)})"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {BITS_INDEX_NAME} ON faces "
+            f"USING hnsw (embedding_bits bit_hamming_ops) WITH (m = {int(m)}, ef_construction = {int(ef_construction)})"
+        ))
+        conn.execute(text("ANALYZE faces"))
+    print("Built compact embedding indexes on faces")
+
+
+def drop_float_embeddings(batch: int = COMPACT_BACKFILL_BATCH) -> int:
+    """
+    Release the float32 copies once every row has its compact columns and readers run
+    with EMBEDDING_STORAGE=halfvec. Space is reclaimed by (auto)vacuum afterwards.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        missing = conn.execute(text(
+            "SELECT count(*) FROM faces WHERE embedding IS NOT NULL AND embedding_half IS NULL"
+        )).scalar()
+        if missing:
+            raise RuntimeError(f"{missing} faces have no compact embedding yet, run the backfill first")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {FACE_INDEX_NAME}"))
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {IVFFLAT_INDEX_NAME}"))
+        total = 0
+        while True:
+            updated = conn.execute(text(
+                "UPDATE faces SET embedding = NULL WHERE id IN "
+                "(SELECT id FROM faces WHERE embedding IS NOT NULL ORDER BY id LIMIT :batch)"
+            ), {"batch": batch}).rowcount
+            total += updated
+            if updated < batch:
+                break
+    print(f"Dropped float embeddings of {total} faces")
+    return total
@@ -0,0 +1,116 @@
+# stream a zip of remote files to the client while they download
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http_client import download_bytes
+
+ZIP_FETCH_WORKERS = int(os.getenv("ZIP_FETCH_WORKERS", "6"))
+ZIP_WRITE_CHUNK = 1024 * 1024
+# already-compressed formats gain nothing from deflate, only cpu time
+STORED_EXTENSIONS = {
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "heif", "avif", "mp4", "mov", "zip",
+    "arw", "nef", "cr2", "cr3", "raw", "dng", "rw2", "orf", "raf",
+}
+
+
+class _Sink:
+    """
+    Write-only buffer zipfile writes into. It has no tell/seek, so zipfile
+    treats it as unseekable and emits data descriptors instead of going back
+    to patch headers; the generator drains it after every chunk.
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def member_name(url: str, taken: set) -> str:
+    "file name from a (presigned) url, suffixed when two urls share a basename"
+    name = os.path.basename(url.split("?")[0]) or "file"
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in taken:
+        candidate = f"{base} ({n}){ext}"
+        n += 1
+    taken.add(candidate)
+    return candidate
+
+
+def _fetch(url: str) -> bytes | Exception:
+    try:
+        return download_bytes(url)
+    except Exception as e:
+        return e
+
+
+def stream_zip(urls: list, workers: int = ZIP_FETCH_WORKERS):
+    """
+    Yields a ZIP64-capable archive of the given urls. Up to `workers` members
+    download ahead of the writer and each is written (then released) as soon as
+    it is next in order, so memory stays at a few members no matter how large
+    the archive gets. Members that fail to download are listed in
+    _download_errors.txt at the end instead of aborting an already started response.
+    """
+    sink = _Sink()
+    taken = set()
+    errors = []
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="zip-fetch")
+    try:
+        pending = deque()
+        remaining = iter(urls)
+        for url in remaining:
+            pending.append((url, pool.submit(_fetch, url)))
+            if len(pending) >= workers:
+                break
+
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+            while pending:
+                url, future = pending.popleft()
+                following = next(remaining, None)
+                if following is not None:
+                    pending.append((following, pool.submit(_fetch, following)))
+
+                data = future.result()
+                name = member_name(url, taken)
+                if isinstance(data, Exception):
+                    print(f"Zip member {name} failed: {data}")
+                    errors.append(f"{name}: {data}")
+                    continue
+
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+                info.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                info.file_size = len(data)  # lets zipfile pick zip64 headers up front for >4 GiB members
+                with zf.open(info, "w") as dest:
+                    view = memoryview(data)
+                    for start in range(0, len(view), ZIP_WRITE_CHUNK):
+                        dest.write(view[start:start + ZIP_WRITE_CHUNK])
+                        chunk = sink.drain()
+                        if chunk:
+                            yield chunk
+                del data, view
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+
+            if errors:
+                zf.writestr("_download_errors.txt", "\n".join(errors) + "\n")
+        # central directory
+        yield sink.drain()
+    finally:
+        # client went away or we finished: don't keep downloading members nobody will read
+        pool.shutdown(wait=False, cancel_futures=True)
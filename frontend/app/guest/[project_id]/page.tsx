@@ -25,6 +25,8 @@ export default function SelfieCapture() {
     const [downloadProgress, setDownloadProgress] = useState(0)
     const [downloadStatus, setDownloadStatus] = useState("")
     const [isDownloading, setIsDownloading] = useState(false)
+    const [nextCursor, setNextCursor] = useState<string | null>(null)
+    const [isLoadingMore, setIsLoadingMore] = useState(false)
     const { project_id } = useParams()
     const { user } = useUser()
 
@@ -93,12 +95,14 @@ export default function SelfieCapture() {
                 })
                 setUploadComplete(true)
                 setGeneratedImages([])
+                setNextCursor(null)
                 setCapturedImage(null)
                 return
             }
 
             if (response.matching_images) {
                 setGeneratedImages(response.matching_images)
+                setNextCursor(response.next_cursor ?? null)
                 setUploadComplete(true)
                 toast.success(`Found ${response.matching_images.length} photos!`, {
                     description: "Your photos are ready to download.",
@@ -133,6 +137,39 @@ export default function SelfieCapture() {
         return await response.json()
     }
 
+    const loadMore = async () => {
+        if (!nextCursor) return
+
+        setIsLoadingMore(true)
+        try {
+            const response = await fetch(
+                `${process.env.NEXT_PUBLIC_BACKEND_BASE_URL}/guest/search-more?cursor=${encodeURIComponent(nextCursor)}`
+            )
+
+            if (response.status === 410) {
+                setNextCursor(null)
+                toast.info("Search expired", {
+                    description: "Take a new selfie to see the rest of your photos.",
+                })
+                return
+            }
+            if (!response.ok) {
+                throw new Error("Load more failed")
+            }
+
+            const data = await response.json()
+            setGeneratedImages((prev: any[]) => [...prev, ...data.matching_images])
+            setNextCursor(data.next_cursor ?? null)
+        } catch (err) {
+            toast.error("Failed to load more photos", {
+                description: "Please try again.",
+            })
+            console.error("Load more error:", err)
+        } finally {
+            setIsLoadingMore(false)
+        }
+    }
+
     const handleDownloadAll = async () => {
         if (generatedImages.length === 0) return
 
@@ -173,6 +210,7 @@ export default function SelfieCapture() {
 
     const resetFlow = () => {
         setGeneratedImages([])
+        setNextCursor(null)
         setUploadComplete(false)
         setCapturedImage(null)
     }
@@ -202,7 +240,7 @@ export default function SelfieCapture() {
                                 <div>
                                     <h1 className="font-semibold">Your Photos</h1>
                                     <p className="text-xs text-muted-foreground">
-                                        {generatedImages.length} {generatedImages.length === 1 ? "photo" : "photos"} found
+                                        {generatedImages.length}{nextCursor ? "+" : ""} {generatedImages.length === 1 && !nextCursor ? "photo" : "photos"} found
                                     </p>
                                 </div>
                             </div>
@@ -283,6 +321,28 @@ export default function SelfieCapture() {
                             </div>
                         ))}
                     </div>
+
+                    {nextCursor && (
+                        <div className="flex justify-center mt-6">
+                            <Button
+                                onClick={loadMore}
+                                disabled={isLoadingMore}
+                                variant="outline"
+                            >
+                                {isLoadingMore ? (
+                                    <>
+                                        <Loader2 className="w-4 h-4 mr-2 animate-spin" />
+                                        Loading...
+                                    </>
+                                ) : (
+                                    <>
+                                        <ChevronDown className="w-4 h-4 mr-2" />
+                                        Load More
+                                    </>
+                                )}
+                            </Button>
+                        </div>
+                    )}
                 </main>
 
                 {/* Footer */}